@@ -0,0 +1,137 @@
+"""
+Benchmark concurrent vitals ingest against dashboard reads for each SQLite
+profile in settings.SQLITE_PROFILES.
+
+Writer threads store batches through ingest.write_rows (the same path as the
+ingest queue, rollups included) while reader threads run the caretaker
+dashboard queries: the last 2 minutes of raw readings, the latest reading
+per metric and an hour of 1-minute rollups. Each profile gets a fresh
+database file, so lumi.db is never touched.
+
+Usage: python bench_sqlite.py [--seconds 10] [--writers 2] [--readers 8] [--batch 500]
+"""
+import argparse
+import datetime
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from sqlalchemy import select
+
+import ingest, models
+from config import settings
+from database import Base, make_engine
+
+health_metrics = models.HealthMetric.__table__
+rollup_1m = models.VitalsRollupMinute.__table__
+
+PATIENTS = 50
+
+def _seed(engine):
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), [{"id": i, "fullname": f"Bench {i}", "phone": f"bench{i}"} for i in range(1, PATIENTS + 1)])
+
+def _writer(engine, stop, batch, offset, results):
+    clock = datetime.datetime.utcnow() - datetime.timedelta(hours=1) + datetime.timedelta(microseconds=offset)
+    rows_written = commits = errors = 0
+    latencies = []
+    while not stop.is_set():
+        rows = []
+        for i in range(batch):
+            clock += datetime.timedelta(milliseconds=7)
+            rows.append(ingest.build_row(1 + i % PATIENTS, "heart_rate", str(60 + i % 40), "bpm", clock))
+        started = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                rows_written += len(ingest.write_rows(conn, rows))
+            commits += 1
+        except Exception as e:
+            errors += 1
+            print(f"⚠️ write failed: {e}")
+        latencies.append(time.perf_counter() - started)
+    results.append(("write", rows_written, commits, errors, latencies))
+
+def _reader(engine, stop, seed, results):
+    user_id = 1 + seed % PATIENTS
+    queries = errors = 0
+    latencies = []
+    while not stop.is_set():
+        now = datetime.datetime.utcnow()
+        started = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                conn.execute(
+                    select(health_metrics).where(health_metrics.c.user_id == user_id, health_metrics.c.timestamp >= now - datetime.timedelta(minutes=2))
+                ).all()
+                for metric_type in models.MetricType:
+                    conn.execute(
+                        select(health_metrics)
+                        .where(health_metrics.c.user_id == user_id, health_metrics.c.metric_type == metric_type)
+                        .order_by(health_metrics.c.timestamp.desc())
+                        .limit(1)
+                    ).first()
+                conn.execute(
+                    select(rollup_1m).where(rollup_1m.c.user_id == user_id, rollup_1m.c.bucket_start >= now - datetime.timedelta(hours=1))
+                ).all()
+            queries += 1
+        except Exception as e:
+            errors += 1
+            print(f"⚠️ read failed: {e}")
+        latencies.append(time.perf_counter() - started)
+        user_id = 1 + user_id % PATIENTS
+    results.append(("read", queries, errors, latencies))
+
+def _percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def run(profile: str, seconds: float, writers: int, readers: int, batch: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}", profile)
+        _seed(engine)
+        stop = threading.Event()
+        results = []
+        threads = [threading.Thread(target=_writer, args=(engine, stop, batch, i, results)) for i in range(writers)]
+        threads += [threading.Thread(target=_reader, args=(engine, stop, i, results)) for i in range(readers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        engine.dispose()
+
+    writes = [r for r in results if r[0] == "write"]
+    reads = [r for r in results if r[0] == "read"]
+    write_latencies = [l for r in writes for l in r[4]]
+    read_latencies = [l for r in reads for l in r[3]]
+    return {
+        "profile": profile,
+        "rows_per_s": round(sum(r[1] for r in writes) / seconds),
+        "commit_p50_ms": round(_percentile(write_latencies, 0.5) * 1000, 1),
+        "commit_max_ms": round(max(write_latencies, default=0) * 1000, 1),
+        "write_errors": sum(r[3] for r in writes),
+        "reads_per_s": round(sum(r[1] for r in reads) / seconds),
+        "read_p50_ms": round(statistics.median(read_latencies) * 1000, 1) if read_latencies else 0.0,
+        "read_p99_ms": round(_percentile(read_latencies, 0.99) * 1000, 1),
+        "read_max_ms": round(max(read_latencies, default=0) * 1000, 1),
+        "read_errors": sum(r[2] for r in reads),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--batch", type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"⏱️ {args.writers} writers x {args.batch} rows/commit, {args.readers} dashboard readers, {args.seconds}s per profile")
+    for profile in settings.SQLITE_PROFILES:
+        report = run(profile, args.seconds, args.writers, args.readers, args.batch)
+        print("  ".join(f"{key}={value}" for key, value in report.items()))
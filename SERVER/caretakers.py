@@ -0,0 +1,52 @@
+"""
+Caretaker -> patient links.
+
+A caretaker sees the patients that list the caretaker's phone as a
+nominee. Instead of joining users to every nominee by phone (and
+DISTINCT-ing the result) on each dashboard poll, the links are kept in the
+caretaker_patients table: the nominee endpoints call sync_patient in the
+same transaction as the change, and lookups read one primary-key range.
+"""
+from sqlalchemy import delete, distinct, select
+
+import models
+from database import insert
+
+caretaker_patients = models.CaretakerPatient.__table__
+nominees = models.Nominee.__table__
+
+def patient_ids(phone: str):
+    """Subquery of the ids of the caretaker's patients, for User.id.in_(...)."""
+    return select(caretaker_patients.c.patient_id).where(caretaker_patients.c.caretaker_phone == phone)
+
+def sync_patient(db, patient_id: int):
+    """Rewrite the patient's links from their nominees. Call before committing a nominee change."""
+    # The session does not autoflush: make the pending nominee change visible first
+    db.flush()
+    phones = db.scalars(
+        select(distinct(nominees.c.phone)).where(nominees.c.user_id == patient_id, nominees.c.phone.isnot(None))
+    ).all()
+    db.execute(delete(caretaker_patients).where(caretaker_patients.c.patient_id == patient_id))
+    if phones:
+        db.execute(caretaker_patients.insert(), [{"caretaker_phone": phone, "patient_id": patient_id} for phone in phones])
+
+def rebuild(conn) -> int:
+    """Recompute every link from nominees (migrate_db.py backfill)."""
+    conn.execute(delete(caretaker_patients))
+    # DO NOTHING: workers starting together may backfill at the same time
+    return conn.execute(insert(caretaker_patients).from_select(
+        ["caretaker_phone", "patient_id"],
+        select(nominees.c.phone, nominees.c.user_id).where(nominees.c.phone.isnot(None), nominees.c.user_id.isnot(None)).distinct(),
+    ).on_conflict_do_nothing()).rowcount
+
+def backfill_if_empty(conn) -> int:
+    """
+    Startup check: a database from before caretaker_patients existed gets
+    the table empty, and caretakers would see no patients until the
+    backfill migration runs. Fill it now if there are nominees but no links.
+    """
+    if conn.scalar(select(caretaker_patients.c.patient_id).limit(1)) is not None:
+        return 0
+    if conn.scalar(select(nominees.c.user_id).where(nominees.c.phone.isnot(None)).limit(1)) is None:
+        return 0
+    return rebuild(conn)
@@ -30,6 +30,7 @@ def cleanup_duplicates():
                     
                     # Delete related data manually
                     db.query(models.Nominee).filter(models.Nominee.user_id == remove.id).delete()
+                    db.query(models.CaretakerPatient).filter(models.CaretakerPatient.patient_id == remove.id).delete()
                     db.query(models.HealthMetric).filter(models.HealthMetric.user_id == remove.id).delete()
                     db.query(models.EmergencyAlert).filter(models.EmergencyAlert.user_id == remove.id).delete()
                     
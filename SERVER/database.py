@@ -1,15 +1,67 @@
-from sqlalchemy import create_engine
+from sqlalchemy import Float, Integer, cast, create_engine, event, extract, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from config import settings
 
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+# asyncio driver used for the same database by the async engine
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+def make_engine(url: str, profile: str, is_async: bool = False):
+    """
+    SQLite: engine with the connection pool and per-connection pragmas of
+    settings.SQLITE_PROFILES[profile]. Other databases (PostgreSQL) use
+    settings.DATABASE_ENGINE_OPTIONS. With is_async, an AsyncEngine on the
+    backend's asyncio driver (aiosqlite/asyncpg) with the same settings.
+    """
+    if is_async:
+        parsed = make_url(url)
+        url = parsed.set(drivername=ASYNC_DRIVERS[parsed.get_backend_name()]).render_as_string(hide_password=False)
+    create = create_async_engine if is_async else create_engine
+    if not url.startswith("sqlite"):
+        return create(url, **settings.DATABASE_ENGINE_OPTIONS)
+
+    if profile not in settings.SQLITE_PROFILES:
+        raise ValueError(f"Unknown SQLITE_PROFILE '{profile}' (expected one of {', '.join(settings.SQLITE_PROFILES)})")
+    options = settings.SQLITE_PROFILES[profile]
+    new_engine = create(url, connect_args={"check_same_thread": False}, **options["pool"])
+    # Pool events live on the sync engine that an AsyncEngine wraps
+    events_target = new_engine.sync_engine if is_async else new_engine
+
+    @event.listens_for(events_target, "first_connect")
+    def set_sqlite_file_pragmas(dbapi_connection, connection_record):
+        # Stored in the database file, so set once per process: repeating them on
+        # every new connection takes a lock and stalls behind running writers
+        cursor = dbapi_connection.cursor()
+        # Only takes effect for new database files (existing ones are converted by migrate_db.py).
+        # Lets the retention compactor hand freed pages back with incremental_vacuum.
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cursor.execute(f"PRAGMA journal_mode = {options['journal_mode']}")
+        cursor.close()
+
+    @event.listens_for(events_target, "connect")
+    def set_sqlite_pragma(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in options["pragmas"].items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    return new_engine
+
+engine = make_engine(SQLALCHEMY_DATABASE_URL, settings.SQLITE_PROFILE)
+IS_SQLITE = engine.dialect.name == "sqlite"
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# For async def routes: queries are awaited instead of blocking the event loop
+async_engine = make_engine(SQLALCHEMY_DATABASE_URL, settings.SQLITE_PROFILE, is_async=True)
+# Objects stay usable after commit (lazy refreshes would need an await)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 def get_db():
@@ -18,3 +70,30 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# SQL that differs between SQLite and PostgreSQL
+
+def insert(table):
+    """INSERT supporting on_conflict_do_nothing/on_conflict_do_update and .excluded on both databases."""
+    return sqlite.insert(table) if IS_SQLITE else postgresql.insert(table)
+
+def least(*values):
+    # SQLite's multi-argument min()/max() are scalar, PostgreSQL spells them LEAST/GREATEST
+    return func.min(*values) if IS_SQLITE else func.least(*values)
+
+def greatest(*values):
+    return func.max(*values) if IS_SQLITE else func.greatest(*values)
+
+def epoch_seconds(column):
+    """Seconds since 1970 of a naive UTC DateTime column, with the fraction kept."""
+    if IS_SQLITE:
+        return cast((func.julianday(column) - 2440587.5) * 86400.0, Float)
+    return cast(extract("epoch", column), Float)
+
+def floor_int(value):
+    # CAST truncates on SQLite (callers only pass values >= 0) but rounds on PostgreSQL
+    return cast(value if IS_SQLITE else func.floor(value), Integer)
@@ -1,16 +1,28 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
 from datetime import datetime, timedelta
 from typing import Optional
+from collections import OrderedDict
+import threading
+import time
 
 from config import settings
-from database import get_db
-import models, schemas
+from database import get_db, get_async_db
+import caretakers, models, schemas
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -21,32 +33,195 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+class UserCache:
+    """
+    Bounded TTL/LRU cache of authenticated users, keyed by the token's phone
+    and session id. Holds plain column snapshots; each request gets its own
+    copy attached to its session without a SELECT. Entries are dropped
+    explicitly when the user row changes (login, profile update, logout).
+
+    Invalidation only reaches this process, so an entry older than
+    sid_check_seconds is stale: the caller re-reads the user's session id
+    (one indexed column) before trusting it, and a login on another worker
+    ends this session within that interval.
+    """
+    def __init__(self, max_users: int, ttl_seconds: float, sid_check_seconds: float):
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self.sid_check_seconds = sid_check_seconds
+        self._entries = OrderedDict() # (phone, sid) -> [expires_at, checked_at, snapshot]
+        self._lock = threading.Lock()
+        # Invalidations are numbered; put() refuses snapshots read before the phone's last one
+        self._version = 0
+        self._invalidated = OrderedDict() # phone -> version of its last invalidation
+        self._forgotten = 0 # newest version dropped from _invalidated
+        self.hits = 0
+        self.misses = 0
+        self.sid_checks = 0
+
+    def version(self) -> int:
+        """Take before reading the user row, and pass to put()."""
+        return self._version
+
+    def get(self, phone: str, sid: Optional[str]) -> tuple:
+        """(snapshot or None, stale): a stale snapshot needs its session id checked, then checked()."""
+        key = (phone, sid)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None, False
+            self._entries.move_to_end(key)
+            self.hits += 1
+            stale = now - entry[1] > self.sid_check_seconds
+            if stale:
+                self.sid_checks += 1
+            return entry[2], stale
+
+    def checked(self, phone: str, sid: Optional[str]):
+        """The session id of a stale entry still matches the database."""
+        with self._lock:
+            entry = self._entries.get((phone, sid))
+            if entry is not None:
+                entry[1] = time.monotonic()
+
+    def put(self, phone: str, sid: Optional[str], user: models.User, version: int):
+        snapshot = {column.key: getattr(user, column.key) for column in models.User.__table__.columns}
+        with self._lock:
+            if max(self._invalidated.get(phone, 0), self._forgotten) > version:
+                return # the row was changed after this snapshot was read
+            now = time.monotonic()
+            self._entries[(phone, sid)] = [now + self.ttl_seconds, now, snapshot]
+            self._entries.move_to_end((phone, sid))
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, phone: str):
+        with self._lock:
+            self._version += 1
+            self._invalidated[phone] = self._version
+            self._invalidated.move_to_end(phone)
+            while len(self._invalidated) > self.max_users:
+                self._forgotten = self._invalidated.popitem(last=False)[1]
+            for key in [key for key in self._entries if key[0] == phone]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._entries)
+        total = self.hits + self.misses
+        return {
+            "size": size,
+            "max_users": self.max_users,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "sid_checks": self.sid_checks,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+        }
+
+user_cache = UserCache(
+    max_users=settings.AUTH_CACHE_MAX_USERS,
+    ttl_seconds=settings.AUTH_CACHE_TTL_SECONDS,
+    sid_check_seconds=settings.AUTH_CACHE_SID_CHECK_SECONDS,
+)
+
+def _decode_token(token: str) -> tuple:
+    """(phone, session id) from a bearer token."""
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         phone: str = payload.get("sub")
         if phone is None:
-            raise credentials_exception
+            raise _credentials_exception()
         token_data = schemas.TokenData(phone=phone)
     except JWTError:
-        raise credentials_exception
-        
-    user = db.query(models.User).filter(models.User.phone == token_data.phone).first()
+        raise _credentials_exception()
+    return token_data.phone, payload.get("sid")
+
+def _cached_user(snapshot: dict) -> models.User:
+    # Already validated for this phone + sid; a private copy for this request's session
+    user = models.User(**snapshot)
+    make_transient_to_detached(user)
+    return user
+
+def _session_ok(token_sid: Optional[str], user_sid: Optional[str]) -> bool:
+    # Single device login: a newer login replaced users.session_id
+    return not (token_sid and user_sid and token_sid != user_sid)
+
+def _check_user(user: Optional[models.User], phone: str, token_sid: Optional[str], version: int) -> models.User:
     if user is None:
-        raise credentials_exception
-    
+        raise _credentials_exception()
+
     # Check Session ID for Single Device Login
-    token_sid = payload.get("sid")
-    if token_sid and user.session_id and token_sid != user.session_id:
+    if not _session_ok(token_sid, user.session_id):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Session expired: Logged in on another device",
             headers={"WWW-Authenticate": "Bearer"},
         )
-        
+
+    user_cache.put(phone, token_sid, user, version)
     return user
+
+def _current_session_id(phone: str):
+    return select(models.User.session_id).where(models.User.phone == phone).limit(1)
+
+def get_user_from_token(token: str, db: Session):
+    """Decode a bearer token and load its user, enforcing single device login."""
+    phone, token_sid = _decode_token(token)
+    snapshot, stale = user_cache.get(phone, token_sid)
+    if stale:
+        # The row may have changed in another worker: trust the snapshot only if the session is still current
+        row = db.execute(_current_session_id(phone)).first()
+        if row is not None and _session_ok(token_sid, row.session_id):
+            user_cache.checked(phone, token_sid)
+        else:
+            user_cache.invalidate(phone)
+            snapshot = None
+    if snapshot is not None:
+        return db.merge(_cached_user(snapshot), load=False)
+    version = user_cache.version()
+    user = db.query(models.User).filter(models.User.phone == phone).first()
+    return _check_user(user, phone, token_sid, version)
+
+async def get_user_from_token_async(token: str, db: AsyncSession):
+    """get_user_from_token for an AsyncSession."""
+    phone, token_sid = _decode_token(token)
+    snapshot, stale = user_cache.get(phone, token_sid)
+    if stale:
+        row = (await db.execute(_current_session_id(phone))).first()
+        if row is not None and _session_ok(token_sid, row.session_id):
+            user_cache.checked(phone, token_sid)
+        else:
+            user_cache.invalidate(phone)
+            snapshot = None
+    if snapshot is not None:
+        return await db.merge(_cached_user(snapshot), load=False)
+    version = user_cache.version()
+    user = await db.scalar(select(models.User).where(models.User.phone == phone).limit(1))
+    return _check_user(user, phone, token_sid, version)
+
+# Plain def: FastAPI runs it in the threadpool, so a slow query does not stall the event loop
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    return get_user_from_token(token, db)
+
+async def get_current_user_async(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    """For async def routes using get_async_db: the user is attached to the same AsyncSession."""
+    return await get_user_from_token_async(token, db)
+
+# Per-patient reads (vitals): the patient themselves or one of their caretakers, like the /vitals/ws subscriptions
+
+def _not_your_patient() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a patient of yours")
+
+def require_patient_access(user_id: int, current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+    if user_id != current_user.id and db.scalar(caretakers.patient_ids(current_user.phone).where(caretakers.caretaker_patients.c.patient_id == user_id)) is None:
+        raise _not_your_patient()
+    return current_user
+
+async def require_patient_access_async(user_id: int, current_user: models.User = Depends(get_current_user_async), db: AsyncSession = Depends(get_async_db)):
+    if user_id != current_user.id and await db.scalar(caretakers.patient_ids(current_user.phone).where(caretakers.caretaker_patients.c.patient_id == user_id)) is None:
+        raise _not_your_patient()
+    return current_user
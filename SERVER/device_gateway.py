@@ -0,0 +1,480 @@
+"""
+Device gateway: pulls vitals from patients' wearables on the server.
+
+Each registered device (models.Device) gets one asyncio task on the app's
+event loop that either polls its URL every poll_interval_seconds or keeps a
+streaming connection open and reads one JSON payload per line. All polls
+share one pooled httpx.AsyncClient, so a process can serve thousands of
+devices. Failing devices back off exponentially (with jitter) without
+affecting the others.
+
+Readings are buffered and handed to the ingest pipeline (ingest.accept) from
+a worker thread every GATEWAY_FLUSH_INTERVAL_SECONDS, so they are stored,
+rolled up, streamed and checked against the vitals rules exactly like
+readings POSTed to /vitals/.
+
+Every uvicorn worker starts a gateway, but only one of them (the leader)
+polls: each copy would stamp the same readings with its own receive time, so
+the duplicates would get past the unique index. Leadership is a PostgreSQL
+advisory lock, or on SQLite an flock on a file next to the database. The
+leader re-reads the devices table every GATEWAY_SYNC_SECONDS to pick up
+devices registered through other workers; the others retry for leadership
+on the same tick, so one takes over if the leader exits.
+
+Device URLs are user input, so the gateway only calls the schemes and hosts
+in GATEWAY_ALLOWED_SCHEMES / GATEWAY_ALLOWED_HOSTS, and refuses names that
+resolve to private, loopback or link-local addresses (outside
+GATEWAY_ALLOWED_NETWORKS). Requests go to the address that was checked, so a
+name cannot be re-pointed between the check and the connection.
+"""
+import asyncio
+import datetime
+import ipaddress
+import json
+import math
+import os
+import random
+import socket
+import time
+
+import httpx
+from sqlalchemy import text
+
+import models, ingest
+from config import settings
+from database import IS_SQLITE, SessionLocal, engine
+
+try:
+    import fcntl
+except ImportError: # Windows: no flock, run as a single process
+    fcntl = None
+
+def parse_health_api(payload: dict, received_at: datetime.datetime) -> list:
+    """FAKE-DATA/health_api.py /all format."""
+    readings = []
+    heart = payload.get("heart_beat")
+    if heart:
+        readings.append(("heart_rate", str(heart["heart_rate"]), heart.get("unit", "bpm")))
+    pressure = payload.get("blood_pressure")
+    if pressure:
+        readings.append(("blood_pressure", f"{pressure['systolic']}/{pressure['diastolic']}", pressure.get("unit", "mmHg")))
+    steps = payload.get("step_count")
+    if steps:
+        readings.append(("steps", str(steps["steps"]), steps.get("unit", "count")))
+    # The API reports naive local time; stamp with the gateway's receive time (UTC) like the browser did
+    return [(metric_type, value, unit, received_at) for metric_type, value, unit in readings]
+
+def parse_vitals(payload, received_at: datetime.datetime) -> list:
+    """Same records as POST /vitals/: one or a list of {metric_type, value, unit, timestamp}."""
+    records = payload if isinstance(payload, list) else [payload]
+    return [
+        (record["metric_type"], record["value"], record.get("unit", ""), record.get("timestamp") or received_at)
+        for record in records
+    ]
+
+class BlockedURL(ValueError):
+    """A device URL the gateway will not call."""
+
+def check_url(url: str) -> httpx.URL:
+    """Parsed URL if its scheme and host are allowed, else BlockedURL. No DNS lookup."""
+    try:
+        parsed = httpx.URL(url)
+    except httpx.InvalidURL:
+        raise BlockedURL("Invalid device URL")
+    if parsed.scheme not in settings.GATEWAY_ALLOWED_SCHEMES:
+        raise BlockedURL(f"Device URL scheme must be one of: {', '.join(settings.GATEWAY_ALLOWED_SCHEMES)}")
+    host = parsed.host.lower()
+    if not any(host == allowed or (allowed.startswith(".") and host.endswith(allowed)) for allowed in settings.GATEWAY_ALLOWED_HOSTS):
+        raise BlockedURL(f"Device host '{host}' is not allowed")
+    return parsed
+
+_allowed_networks = [ipaddress.ip_network(network, strict=False) for network in settings.GATEWAY_ALLOWED_NETWORKS]
+
+def check_address(address: str) -> str:
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    if any(ip in network for network in _allowed_networks):
+        return str(ip)
+    if not ip.is_global or ip.is_multicast:
+        raise BlockedURL(f"Device address {ip} is not allowed")
+    return str(ip)
+
+def _port(parsed: httpx.URL) -> int:
+    return parsed.port or (443 if parsed.scheme == "https" else 80)
+
+def _pick_address(infos: list) -> str:
+    # Every address the name resolves to must pass, not just the first: a connection could use any of them
+    return [check_address(info[4][0]) for info in infos][0]
+
+def resolve(url: str) -> str:
+    """Checked address for a device URL (blocking DNS lookup). Raises BlockedURL."""
+    parsed = check_url(url)
+    try:
+        infos = socket.getaddrinfo(parsed.host, _port(parsed), type=socket.SOCK_STREAM)
+    except socket.gaierror:
+        raise BlockedURL(f"Device host '{parsed.host}' does not resolve")
+    return _pick_address(infos)
+
+def _describe(error: Exception) -> str:
+    # Fixed wording only: exception text can carry what an internal host answered
+    if isinstance(error, BlockedURL):
+        return "address not allowed"
+    if isinstance(error, httpx.TimeoutException):
+        return "timeout"
+    if isinstance(error, httpx.HTTPStatusError):
+        return f"HTTP {error.response.status_code}"
+    if isinstance(error, socket.gaierror):
+        return "host does not resolve"
+    if isinstance(error, (httpx.TransportError, OSError)):
+        return "connection failed"
+    if isinstance(error, (ValueError, KeyError, TypeError)):
+        return "invalid payload"
+    return "error"
+
+PARSERS = {
+    "health_api": parse_health_api,
+    "vitals": parse_vitals,
+}
+MODES = ("poll", "stream")
+
+# pg_try_advisory_lock key held by the polling worker
+GATEWAY_LOCK_ID = 4202
+
+class Leadership:
+    """Held by the one process that polls devices. Blocking calls: run them in a thread."""
+    def __init__(self, lock_file: str = None):
+        self.lock_file = lock_file
+        self._conn = None
+        self._fd = None
+
+    def acquire(self) -> bool:
+        if IS_SQLITE:
+            if self.lock_file is None or fcntl is None:
+                return True # in-memory database or no flock: only this process can use it
+            fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+            self._fd = fd
+            return True
+        conn = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        try:
+            if conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": GATEWAY_LOCK_ID}).scalar():
+                self._conn = conn # the lock lives as long as this session
+                return True
+        except Exception:
+            pass
+        conn.close()
+        return False
+
+    def alive(self) -> bool:
+        """False once a PostgreSQL lock was lost with its connection."""
+        if self._conn is None:
+            return True
+        try:
+            self._conn.execute(text("SELECT 1"))
+            return True
+        except Exception:
+            self.release()
+            return False
+
+    def release(self):
+        if self._fd is not None:
+            os.close(self._fd) # drops the flock
+            self._fd = None
+        if self._conn is not None:
+            try:
+                self._conn.close() # ends the session and its advisory lock
+            except Exception:
+                pass
+            self._conn = None
+
+def _lock_file() -> str:
+    database = engine.url.database
+    if not IS_SQLITE or not database or database == ":memory:":
+        return None
+    return f"{database}.gateway.lock"
+
+class DeviceState:
+    __slots__ = ("id", "user_id", "kind", "url", "mode", "interval", "task",
+                 "state", "consecutive_failures", "last_error", "last_success_at", "readings",
+                 "address", "resolved_at")
+
+    def __init__(self, device: models.Device):
+        # Plain copies: the ORM object belongs to another thread's session
+        self.id = device.id
+        self.user_id = device.user_id
+        self.kind = device.kind
+        self.url = device.url
+        self.mode = device.mode
+        interval = device.poll_interval_seconds
+        if interval is None or not math.isfinite(interval):
+            interval = 1.0
+        self.interval = max(interval, settings.GATEWAY_MIN_POLL_INTERVAL_SECONDS)
+        self.task = None
+        self.state = "ok"
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.last_success_at = None
+        self.readings = 0
+        self.address = None # checked IP the URL's host resolved to
+        self.resolved_at = 0.0
+
+    def config(self) -> tuple:
+        return (self.user_id, self.kind, self.url, self.mode, self.interval)
+
+class DeviceGateway:
+    def __init__(self, max_connections: int, request_timeout: float, backoff_max: float, flush_interval: float,
+                 sync_interval: float, leadership: Leadership):
+        self.max_connections = max_connections
+        self.request_timeout = request_timeout
+        self.backoff_max = backoff_max
+        self.flush_interval = flush_interval
+        self.sync_interval = sync_interval
+        self.leadership = leadership
+
+        self.devices = {}
+        self.leading = False
+        self._leader_task = None
+        self.loop = None
+        self.client = None
+        self.stream_client = None
+        self._pending = []
+        self._flusher = None
+        self._slots = None
+
+        self.polls = 0
+        self.failures = 0
+        self.dropped = 0
+
+    async def start(self):
+        if self.loop is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        # httpcore's pool slows down sharply with many requests in flight,
+        # so polls queue here for one of max_connections slots instead
+        self._slots = asyncio.Semaphore(self.max_connections)
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            # Waiting for a pooled connection is normal under load, only the request itself times out
+            timeout=httpx.Timeout(self.request_timeout, pool=None),
+        )
+        # Streams hold their connection indefinitely, keep them out of the polling pool
+        self.stream_client = httpx.AsyncClient(timeout=httpx.Timeout(self.request_timeout, read=None))
+        self._flusher = asyncio.create_task(self._flush_loop())
+        self._leader_task = asyncio.create_task(self._lead())
+
+    async def _lead(self):
+        while True:
+            try:
+                if not self.leading and await asyncio.to_thread(self.leadership.acquire):
+                    self.leading = True
+                    print("📡 Device gateway is polling devices in this process")
+                elif self.leading and not await asyncio.to_thread(self.leadership.alive):
+                    self.leading = False
+                    for device_id in list(self.devices):
+                        self._stop_device(device_id)
+                    print("⚠️ Device gateway lost its leadership lock, stopped polling")
+                if self.leading:
+                    self._sync(await asyncio.to_thread(self._load_devices))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Device gateway sync failed: {e}")
+            await asyncio.sleep(self.sync_interval)
+
+    def _sync(self, states: list):
+        """Match the running devices to the enabled ones in the database."""
+        wanted = {state.id: state for state in states}
+        for device_id in [device_id for device_id in self.devices if device_id not in wanted]:
+            self._stop_device(device_id)
+        for state in states:
+            running = self.devices.get(state.id)
+            if running is None or running.config() != state.config():
+                self._start_device(state)
+
+    def _load_devices(self) -> list:
+        db = SessionLocal()
+        try:
+            return [DeviceState(device) for device in db.query(models.Device).filter(models.Device.enabled == True).all()]
+        finally:
+            db.close()
+
+    async def stop(self):
+        if self.loop is None:
+            return
+        tasks = [state.task for state in self.devices.values() if state.task] + [self._flusher, self._leader_task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.to_thread(self._ingest, self._take_pending())
+        if self.leading:
+            await asyncio.to_thread(self.leadership.release)
+            self.leading = False
+        await self.client.aclose()
+        await self.stream_client.aclose()
+        self.devices.clear()
+        self.loop = None
+
+    # Called from request threads when devices are added, changed or removed.
+    # Other workers leave it to the leader's next sync.
+    def register(self, device: models.Device):
+        if self.loop is None or not self.leading:
+            return
+        if not device.enabled:
+            self.unregister(device.id)
+            return
+        self.loop.call_soon_threadsafe(self._start_device, DeviceState(device))
+
+    def unregister(self, device_id: int):
+        if self.loop is not None and self.leading:
+            self.loop.call_soon_threadsafe(self._stop_device, device_id)
+
+    def _start_device(self, state: DeviceState):
+        self._stop_device(state.id)
+        self.devices[state.id] = state
+        run = self._stream_device if state.mode == "stream" else self._poll_device
+        state.task = asyncio.create_task(run(state))
+
+    def _stop_device(self, device_id: int):
+        state = self.devices.pop(device_id, None)
+        if state is not None and state.task is not None:
+            state.task.cancel()
+            state.state = "stopped"
+
+    def _backoff(self, state: DeviceState, error: Exception) -> float:
+        state.consecutive_failures += 1
+        state.last_error = _describe(error)
+        state.state = "backoff"
+        self.failures += 1
+        delay = min(self.backoff_max, state.interval * 2 ** state.consecutive_failures)
+        # Jitter so devices that failed together do not retry together
+        return delay * random.uniform(0.5, 1.0)
+
+    def _succeeded(self, state: DeviceState):
+        state.consecutive_failures = 0
+        state.state = "ok"
+        state.last_success_at = datetime.datetime.utcnow()
+
+    async def _target(self, state: DeviceState) -> dict:
+        """Request arguments for the device, pinned to an address that passed check_address."""
+        parsed = check_url(state.url)
+        now = time.monotonic()
+        if state.address is None or now - state.resolved_at > settings.GATEWAY_DNS_TTL_SECONDS:
+            infos = await self.loop.getaddrinfo(parsed.host, _port(parsed), type=socket.SOCK_STREAM)
+            state.address = _pick_address(infos)
+            state.resolved_at = now
+        # Host header and TLS name (SNI, certificate check) stay those of the registered URL
+        return {
+            "url": parsed.copy_with(host=state.address),
+            "headers": {"Host": parsed.netloc.decode("ascii")},
+            "extensions": {"sni_hostname": parsed.host},
+        }
+
+    async def _poll_device(self, state: DeviceState):
+        # Spread the first polls so thousands of devices do not fire in lockstep
+        await asyncio.sleep(random.uniform(0, state.interval))
+        while True:
+            delay = state.interval
+            try:
+                target = await self._target(state)
+                async with self._slots:
+                    response = await self.client.get(**target)
+                response.raise_for_status()
+                self._accept(state, response.json())
+                self._succeeded(state)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                state.address = None # resolve again on the next attempt
+                delay = self._backoff(state, e)
+            self.polls += 1
+            await asyncio.sleep(delay)
+
+    async def _stream_device(self, state: DeviceState):
+        while True:
+            try:
+                async with self.stream_client.stream("GET", **await self._target(state)) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if line.strip():
+                            self._accept(state, json.loads(line))
+                            self._succeeded(state)
+                raise ConnectionError("stream ended")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                state.address = None
+                await asyncio.sleep(self._backoff(state, e))
+
+    def _accept(self, state: DeviceState, payload):
+        received_at = datetime.datetime.utcnow()
+        # Malformed payloads raise here and count as a failed poll
+        rows = [
+            ingest.build_row(state.user_id, metric_type, value, unit, timestamp)
+            for metric_type, value, unit, timestamp in PARSERS[state.kind](payload, received_at)
+        ]
+        if rows:
+            state.readings += len(rows)
+            self._pending.append((state.user_id, rows))
+
+    def _take_pending(self) -> list:
+        pending, self._pending = self._pending, []
+        return pending
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            pending = self._take_pending()
+            if pending:
+                await asyncio.to_thread(self._ingest, pending)
+
+    def _ingest(self, pending: list):
+        by_user = {}
+        for user_id, rows in pending:
+            by_user.setdefault(user_id, []).extend(rows)
+        for user_id, rows in by_user.items():
+            try:
+                if not ingest.accept(user_id, rows):
+                    self.dropped += len(rows)
+                    print(f"⚠️ Device gateway dropped {len(rows)} readings for user {user_id}: ingest queue full")
+            except Exception as e:
+                self.dropped += len(rows)
+                print(f"❌ Device gateway ingest failed for user {user_id}: {e}")
+
+    def status(self, device_id: int) -> dict:
+        state = self.devices.get(device_id)
+        if state is None:
+            return {"state": "stopped"}
+        return {
+            "state": state.state,
+            "consecutive_failures": state.consecutive_failures,
+            "last_error": state.last_error,
+            "last_success_at": state.last_success_at,
+        }
+
+    def stats(self) -> dict:
+        states = [state.state for state in self.devices.values()]
+        return {
+            "running": self.loop is not None,
+            "leader": self.leading,
+            "devices": len(states),
+            "backing_off": states.count("backoff"),
+            "polls": self.polls,
+            "failures": self.failures,
+            "readings": sum(state.readings for state in self.devices.values()),
+            "dropped": self.dropped,
+            "pending_batches": len(self._pending),
+        }
+
+gateway = DeviceGateway(
+    max_connections=settings.GATEWAY_MAX_CONNECTIONS,
+    request_timeout=settings.GATEWAY_REQUEST_TIMEOUT_SECONDS,
+    backoff_max=settings.GATEWAY_BACKOFF_MAX_SECONDS,
+    flush_interval=settings.GATEWAY_FLUSH_INTERVAL_SECONDS,
+    sync_interval=settings.GATEWAY_SYNC_SECONDS,
+    leadership=Leadership(_lock_file()),
+)
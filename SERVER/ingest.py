@@ -0,0 +1,331 @@
+"""
+Vitals ingest pipeline.
+
+POST /vitals/ turns each batch into plain column dicts with build_rows().
+In 'sync' mode the batch is written in its own transaction; in 'queue' mode
+it is appended to an in-process queue and a background writer flushes all
+pending batches from all users in a single transaction (group commit).
+"""
+import datetime
+import threading
+import time
+
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+import models, presence, rollups
+from config import settings
+from database import engine, insert
+
+health_metrics = models.HealthMetric.__table__
+
+def to_utc_naive(ts: datetime.datetime) -> datetime.datetime:
+    # Timestamps are stored as naive UTC (clients send ISO strings with 'Z')
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return ts
+
+def build_row(user_id: int, metric_type: str, value, unit: str, timestamp) -> dict:
+    """
+    One insertable row. timestamp may be a datetime, an ISO 8601 string or
+    epoch seconds. Raises ValueError for malformed readings.
+    """
+    if isinstance(timestamp, str):
+        timestamp = datetime.datetime.fromisoformat(timestamp)
+    elif isinstance(timestamp, (int, float)):
+        try:
+            timestamp = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+        except (OverflowError, OSError):
+            raise ValueError(f"Timestamp out of range: {timestamp!r}")
+    elif not isinstance(timestamp, datetime.datetime):
+        raise ValueError(f"Invalid timestamp: {timestamp!r}")
+    row = {
+        "user_id": user_id,
+        "metric_type": models.MetricType(metric_type),
+        "unit": unit,
+        "timestamp": to_utc_naive(timestamp),
+        "hr_bpm": None,
+        "systolic": None,
+        "diastolic": None,
+        "steps": None,
+    }
+    row.update(models.HealthMetric.parse_value(metric_type, value))
+    return row
+
+def build_rows(user_id: int, metrics) -> list:
+    """
+    Validate incoming HealthMetricCreate items and return insertable rows.
+    Raises ValueError on the first malformed reading.
+    """
+    return [build_row(user_id, m.metric_type, m.value, m.unit, m.timestamp) for m in metrics]
+
+def _key(row: dict) -> tuple:
+    return (row["user_id"], row["metric_type"], row["timestamp"])
+
+def write_rows(conn, rows: list) -> list:
+    """
+    Insert rows with one executemany on an open connection/session and fold
+    them into the rollups in the same transaction. Readings already stored
+    (same user_id, metric_type and timestamp) are skipped by ON CONFLICT DO
+    NOTHING and left out of the rollups. Returns (id, row) for each row
+    actually inserted.
+    """
+    unique = list({_key(row): row for row in reversed(rows)}.values())[::-1] # first copy wins
+    if not unique:
+        return []
+    stmt = (
+        insert(health_metrics)
+        .on_conflict_do_nothing(index_elements=["user_id", "metric_type", "timestamp"])
+        .returning(health_metrics.c.id, health_metrics.c.user_id, health_metrics.c.metric_type, health_metrics.c.timestamp)
+    )
+    stored = {(user_id, metric_type, ts): row_id for row_id, user_id, metric_type, ts in conn.execute(stmt, unique)}
+    inserted = [(stored[_key(row)], row) for row in unique if _key(row) in stored]
+    rollups.apply(conn, [row for _, row in inserted])
+    return inserted
+
+class RecentKeys:
+    """
+    Bounded memory of recently stored readings, so retried batches are
+    dropped before they reach the queue or the database. Keys are the
+    (user_id, metric_type, timestamp) tuples themselves, not their hashes,
+    so two different readings can never be mistaken for each other. They are
+    kept in two generations; when the current one is full the older one is
+    discarded.
+    """
+    def __init__(self, max_keys: int):
+        self.generation_size = max(max_keys // 2, 1)
+        self._current = set()
+        self._previous = set()
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    def fresh(self, rows: list) -> list:
+        """Rows not seen recently (nor earlier in the same batch)."""
+        batch = set()
+        fresh = []
+        with self._lock:
+            for row in rows:
+                key = _key(row)
+                if key in self._current or key in self._previous or key in batch:
+                    continue
+                batch.add(key)
+                fresh.append(row)
+            self.duplicates += len(rows) - len(fresh)
+        return fresh
+
+    def remember(self, rows: list):
+        """Call once the rows have been committed: a failed write must not hide their retry."""
+        with self._lock:
+            for row in rows:
+                self._current.add(_key(row))
+            if len(self._current) >= self.generation_size:
+                self._previous, self._current = self._current, set()
+
+recent = RecentKeys(settings.INGEST_RECENT_KEYS)
+
+# Callbacks run for every accepted batch, e.g. live streaming to caretakers
+_listeners = []
+
+def add_listener(callback):
+    """Register callback(user_id, rows), called from the request thread after a batch is accepted."""
+    _listeners.append(callback)
+
+def publish(user_id: int, rows: list):
+    for callback in _listeners:
+        try:
+            callback(user_id, rows)
+        except Exception as e:
+            print(f"❌ Vitals listener {callback.__qualname__} failed: {e}")
+
+def transient(error: Exception) -> bool:
+    """Database locked, down or the connection lost: worth retrying the same rows later."""
+    return isinstance(error, OperationalError) or (isinstance(error, DBAPIError) and error.connection_invalidated)
+
+class IngestQueue:
+    """
+    Write-behind queue with group commit.
+
+    Rows wait in memory until flush_rows are pending or flush_interval has
+    passed. Memory is bounded by max_rows (pending + being written); when
+    full, submit() waits up to submit_timeout and then reports failure so
+    the endpoint can answer 503. A flush that fails with a transient error
+    keeps its rows queued and is retried with exponential backoff (up to
+    retry_max), so while the database is unavailable the queue fills and
+    submitters get 503s instead of having their readings dropped. Any other
+    failure is a row the database will never take (out of range, foreign key
+    to a deleted user): the batch is written in halves until those rows are
+    isolated, and they are logged, counted and dropped.
+    """
+    def __init__(self, max_rows: int, flush_rows: int, flush_interval: float, submit_timeout: float, retry_max: float):
+        self.max_rows = max_rows
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.submit_timeout = submit_timeout
+        self.retry_max = retry_max
+
+        self._pending = []
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._space = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+        self.rows_written = 0
+        self.duplicates = 0 # skipped by the unique index
+        self.flushes = 0
+        self.rejected = 0
+        self.failures = 0 # consecutive failed flushes
+        self.dropped = 0  # rows the database refused
+        self._retry_at = 0.0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="vitals-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the writer and flush everything still pending."""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        if self._pending:
+            print(f"❌ Vitals writer stopped with {len(self._pending)} rows unwritten")
+
+    def submit(self, rows: list) -> bool:
+        with self._space:
+            fits = self._space.wait_for(
+                lambda: len(self._pending) + self._in_flight + len(rows) <= self.max_rows,
+                timeout=self.submit_timeout,
+            )
+            if not fits:
+                self.rejected += len(rows)
+                return False
+            self._pending.extend(rows)
+            if len(self._pending) >= self.flush_rows:
+                self._wake.set()
+        return True
+
+    def depth(self) -> int:
+        return len(self._pending) + self._in_flight
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(max(self.flush_interval, self._retry_at - time.monotonic()))
+            self._wake.clear()
+            if time.monotonic() >= self._retry_at:
+                self.flush()
+        self.flush()
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._in_flight = len(batch)
+            if not batch:
+                return 0
+
+            refused = []
+            try:
+                try:
+                    with engine.begin() as conn:
+                        inserted = write_rows(conn, batch)
+                except Exception as e:
+                    if transient(e):
+                        raise
+                    print(f"⚠️ Vitals flush of {len(batch)} rows failed, isolating the rows that cannot be stored: {e}")
+                    middle = len(batch) // 2
+                    inserted = self._write_isolating(batch[:middle], refused) + self._write_isolating(batch[middle:], refused)
+            except Exception as e:
+                # Database locked or down: keep the batch queued (ahead of newer rows) and back off.
+                # Halves already committed while isolating are skipped as duplicates on the retry,
+                # rows already refused are not retried.
+                refused_ids = {id(row) for row in refused}
+                batch = [row for row in batch if id(row) not in refused_ids]
+                self.failures += 1
+                delay = min(self.retry_max, self.flush_interval * 2 ** (self.failures - 1))
+                self._retry_at = time.monotonic() + delay
+                print(f"❌ Vitals flush of {len(batch)} rows failed ({self.failures} in a row), retrying in {delay:g}s: {e}")
+                with self._space:
+                    self._pending[:0] = batch
+                    self._in_flight = 0
+                return 0
+
+            recent.remember(batch)
+            with self._space:
+                self._in_flight = 0
+                self.rows_written += len(inserted)
+                self.duplicates += len(batch) - len(inserted)
+                self.flushes += 1
+                self.failures = 0
+                self._retry_at = 0.0
+                self._space.notify_all()
+            return len(inserted)
+
+    def _write_isolating(self, rows: list, refused: list) -> list:
+        """
+        write_rows in its own transaction, splitting on non-transient errors
+        until the bad rows are alone; those are dropped and added to refused.
+        """
+        if not rows:
+            return []
+        try:
+            with engine.begin() as conn:
+                return write_rows(conn, rows)
+        except Exception as e:
+            if transient(e):
+                raise
+            if len(rows) == 1:
+                self.dropped += 1
+                refused.append(rows[0])
+                row = rows[0]
+                print(f"❌ Dropped vitals row user={row['user_id']} {row['metric_type'].value} at {row['timestamp']}: {e}")
+                return []
+        middle = len(rows) // 2
+        return self._write_isolating(rows[:middle], refused) + self._write_isolating(rows[middle:], refused)
+
+    def stats(self) -> dict:
+        return {
+            "mode": settings.VITALS_INGEST_MODE,
+            "depth": self.depth(),
+            "max_rows": self.max_rows,
+            "rows_written": self.rows_written,
+            "duplicates": self.duplicates,
+            "duplicates_filtered": recent.duplicates,
+            "flushes": self.flushes,
+            "rejected": self.rejected,
+            "failures": self.failures,
+            "dropped": self.dropped,
+        }
+
+queue = IngestQueue(
+    max_rows=settings.INGEST_QUEUE_MAX_ROWS,
+    flush_rows=settings.INGEST_FLUSH_ROWS,
+    flush_interval=settings.INGEST_FLUSH_INTERVAL_SECONDS,
+    submit_timeout=settings.INGEST_SUBMIT_TIMEOUT_SECONDS,
+    retry_max=settings.INGEST_RETRY_MAX_SECONDS,
+)
+
+def accept(user_id: int, rows: list) -> bool:
+    """
+    Ingest a batch produced outside a request (e.g. by the device gateway)
+    the same way POST /vitals/ does. Returns False if the queue is full.
+    """
+    rows = recent.fresh(rows)
+    if not rows:
+        return True
+    if settings.VITALS_INGEST_MODE == "queue":
+        if not queue.submit(rows):
+            return False
+    else:
+        with engine.begin() as conn:
+            rows = [row for _, row in write_rows(conn, rows)]
+        recent.remember(rows)
+    presence.tracker.touch(user_id, device=True)
+    publish(user_id, rows)
+    return True
@@ -1,12 +1,14 @@
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from config import settings
-from database import engine, Base
-from routers import auth, users, medications, nominees, vitals, emergency
+from database import engine, async_engine
+from routers import auth, users, medications, nominees, vitals, emergency, devices, admin
+import ingest, metrics, migrate_db, presence, profiler, retention, rules, sql_stats, vitals_cache, device_gateway
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+# Create tables (a new database starts fully migrated; an old one is told to run migrate_db.py)
+migrate_db.init_db()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -19,8 +21,29 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Vitals-Cursor", "X-Vitals-Changed", "X-DB-Queries", "Server-Timing"],
 )
 
+if settings.SQL_STATS_ENABLED:
+    sql_stats.instrument(engine)
+    sql_stats.instrument(async_engine.sync_engine)
+    app.middleware("http")(sql_stats.middleware)
+
+# Cheap while no profiling session runs (see profiler.py)
+app.add_middleware(profiler.ProfilerMiddleware)
+
+if settings.METRICS_ENABLED:
+    # Added last so it is outermost: latency includes the other middleware
+    app.add_middleware(metrics.MetricsMiddleware)
+    metrics.instrument_pool("sync", engine)
+    metrics.instrument_pool("async", async_engine.sync_engine)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def get_metrics(request: Request):
+        if not metrics.scrape_allowed(request.headers.get("authorization"), request.client.host if request.client else None):
+            raise HTTPException(status_code=403, detail="Metrics access denied")
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 app.include_router(auth.router)
 app.include_router(auth.router)
 app.include_router(users.router)
@@ -28,6 +51,8 @@ app.include_router(medications.router)
 app.include_router(nominees.router)
 app.include_router(vitals.router)
 app.include_router(emergency.router)
+app.include_router(devices.router)
+app.include_router(admin.router)
 
 @app.get("/")
 def read_root():
@@ -41,6 +66,24 @@ async def startup_event():
     # Start the Database Manager Service as a child process
     print("🚀 Starting Database Manager Service on Port 8002...")
     subprocess.Popen([sys.executable, "db_manager.py"])
+    ingest.queue.start()
+    presence.tracker.start()
+    retention.compactor.start()
+    vitals_cache.cache.warm()
+    profiler.install_signal_handler()
+    if settings.GATEWAY_ENABLED:
+        await device_gateway.gateway.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await device_gateway.gateway.stop()
+    # Flush vitals still waiting in the write-behind queue
+    ingest.queue.stop()
+    presence.tracker.stop()
+    retention.compactor.stop()
+    # Write out a session still running
+    profiler.profiler.stop()
+    await async_engine.dispose()
 
 
 if __name__ == "__main__":
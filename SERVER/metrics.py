@@ -0,0 +1,229 @@
+"""
+Prometheus text-format metrics, served at GET /metrics.
+
+Per-route request counts and latency histograms are recorded by
+MetricsMiddleware, a plain ASGI middleware: no Request object or extra task
+per request. Counters are sharded per thread, so recording is a couple of
+dict updates on the calling thread's own shard with no lock; a scrape sums
+the shards. Everything else (in-flight requests, threadpool, ingest queue,
+WebSockets, DB pool) is read when scraped, except the time callers wait for
+a pooled connection, which is a histogram like request latency.
+
+The endpoint is off unless METRICS=1, and then only serves scrapers that send
+METRICS_TOKEN as a bearer token (or, with no token configured, loopback
+clients).
+"""
+import hmac
+import threading
+import time
+from bisect import bisect_left
+
+from anyio import to_thread
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+import ingest
+from config import settings
+from routers import emergency, vitals
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# A free connection comes back in microseconds; the top buckets reach the pool timeout
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class ShardedCounters:
+    """Counters keyed by label tuples. Each thread only ever writes its own shard."""
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock() # only taken when a thread creates its shard, and by scrapes
+
+    def shard(self) -> dict:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def add(self, key, amount=1):
+        shard = self.shard()
+        shard[key] = shard.get(key, 0) + amount
+
+    def totals(self) -> dict:
+        with self._lock:
+            shards = list(self._shards)
+        totals = {}
+        for shard in shards:
+            # dict.copy() is atomic under the GIL, iterating the live shard is not
+            for key, value in shard.copy().items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counters = ShardedCounters() # (labels, bucket index) -> count, (labels, "sum") -> seconds
+
+    def observe(self, labels: tuple, value: float):
+        shard = self.counters.shard()
+        key = (labels, bisect_left(self.buckets, value))
+        shard[key] = shard.get(key, 0) + 1
+        key = (labels, "sum")
+        shard[key] = shard.get(key, 0) + value
+
+requests_total = ShardedCounters()     # (method, route, status)
+request_seconds = Histogram()          # (method, route)
+in_flight = ShardedCounters()          # () -> requests being served
+pool_checkouts = ShardedCounters()     # (engine name,)
+pool_exhausted = ShardedCounters()     # (engine name,) checkouts that left no connection free
+pool_wait_seconds = Histogram(POOL_WAIT_BUCKETS) # (engine name,) time to get a connection, timeouts included
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight.add(())
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            in_flight.add((), -1)
+            # Route template, not the raw path: one series per endpoint, and unknown URLs share one
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            requests_total.add((scope["method"], path, status))
+            request_seconds.observe((scope["method"], path), elapsed)
+
+_pools = {} # engine name -> pool
+
+LOOPBACK_HOSTS = {"127.0.0.1", "::1", "localhost"}
+
+def scrape_allowed(authorization: str, client_host: str) -> bool:
+    """Whether GET /metrics may be served to this client."""
+    if settings.METRICS_TOKEN:
+        return hmac.compare_digest((authorization or "").encode(), f"Bearer {settings.METRICS_TOKEN}".encode())
+    return client_host in LOOPBACK_HOSTS
+
+def _capacity(pool):
+    # pool_size + max_overflow; None when the pool does not cap connections
+    if not isinstance(pool, QueuePool) or pool._max_overflow < 0:
+        return None
+    return pool.size() + pool._max_overflow
+
+def instrument_pool(name: str, engine):
+    """Count and time checkouts of an Engine's pool (or an AsyncEngine's sync_engine pool)."""
+    pool = engine.pool
+    _pools[name] = pool
+    capacity = _capacity(pool)
+    connect = pool.connect
+
+    # The checkout event fires once a connection is in hand, so the wait is timed around connect()
+    def timed_connect():
+        started = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            pool_wait_seconds.observe((name,), time.perf_counter() - started)
+
+    pool.connect = timed_connect
+
+    @event.listens_for(pool, "checkout")
+    def count_checkout(dbapi_connection, connection_record, connection_proxy):
+        pool_checkouts.add((name,))
+        if capacity is not None and pool.checkedout() >= capacity:
+            pool_exhausted.add((name,))
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+def _family(lines: list, name: str, kind: str, help_text: str, samples):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    for suffix, names, values, value in samples:
+        lines.append(f"{name}{suffix}{_labels(names, values)} {value}")
+
+def _histogram_samples(histogram: Histogram, names: tuple):
+    series = {}
+    for (labels, index), value in histogram.counters.totals().items():
+        counts, total = series.setdefault(labels, ([0] * (len(histogram.buckets) + 1), [0.0]))
+        if index == "sum":
+            total[0] += value
+        else:
+            counts[index] += value
+    for labels, (counts, total) in sorted(series.items()):
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + ("+Inf",), counts):
+            cumulative += count
+            yield "_bucket", names + ("le",), labels + (bound,), cumulative
+        yield "_sum", names, labels, round(total[0], 6)
+        yield "_count", names, labels, cumulative
+
+def render() -> str:
+    """The exposition text. Call from the event loop (threadpool stats are read from anyio)."""
+    lines = []
+    _family(lines, "lumi_http_requests_total", "counter", "HTTP requests by method, route and status.",
+            (("", ("method", "route", "status"), key, value) for key, value in sorted(requests_total.totals().items())))
+    _family(lines, "lumi_http_request_duration_seconds", "histogram", "HTTP request latency by method and route.",
+            _histogram_samples(request_seconds, ("method", "route")))
+    _family(lines, "lumi_http_requests_in_flight", "gauge", "HTTP requests being served.",
+            [("", (), (), in_flight.totals().get((), 0))])
+
+    # Sync routes and dependencies run on anyio's worker threads: borrowed == total means requests queue
+    limiter = to_thread.current_default_thread_limiter()
+    _family(lines, "lumi_threadpool_threads", "gauge", "Worker threads available for sync routes.",
+            [("", (), (), int(limiter.total_tokens))])
+    _family(lines, "lumi_threadpool_busy", "gauge", "Worker threads in use.",
+            [("", (), (), limiter.borrowed_tokens)])
+    _family(lines, "lumi_threadpool_waiting", "gauge", "Calls waiting for a free worker thread.",
+            [("", (), (), limiter.statistics().tasks_waiting)])
+
+    queue_stats = ingest.queue.stats()
+    _family(lines, "lumi_ingest_queue_depth", "gauge", "Vitals rows waiting for (or in) the write-behind flush.",
+            [("", (), (), queue_stats["depth"])])
+    _family(lines, "lumi_ingest_queue_capacity", "gauge", "Rows the ingest queue holds before submitters block.",
+            [("", (), (), queue_stats["max_rows"])])
+    _family(lines, "lumi_ingest_rows_written_total", "counter", "Vitals rows stored by the ingest queue.",
+            [("", (), (), queue_stats["rows_written"])])
+    _family(lines, "lumi_ingest_rejected_total", "counter", "Ingest submissions rejected because the queue was full.",
+            [("", (), (), queue_stats["rejected"])])
+    _family(lines, "lumi_ingest_flush_failures", "gauge", "Consecutive failed flushes of the ingest queue (rows are kept and retried).",
+            [("", (), (), queue_stats["failures"])])
+    _family(lines, "lumi_ingest_dropped_total", "counter", "Vitals rows the ingest queue dropped because the database refused them.",
+            [("", (), (), queue_stats["dropped"])])
+
+    _family(lines, "lumi_websocket_connections", "gauge", "Open WebSocket connections by channel.", [
+        ("", ("channel",), ("emergency",), len(emergency.manager.active_connections)),
+        ("", ("channel",), ("vitals",), len(vitals.stream.subscribers)),
+    ])
+
+    checkouts, exhausted = pool_checkouts.totals(), pool_exhausted.totals()
+    pools = sorted(_pools.items())
+    queue_pools = [(name, pool) for name, pool in pools if _capacity(pool) is not None]
+    _family(lines, "lumi_db_pool_checkouts_total", "counter", "Connections checked out of the pool.",
+            [("", ("engine",), (name,), checkouts.get((name,), 0)) for name, _ in pools])
+    _family(lines, "lumi_db_pool_exhausted_total", "counter", "Checkouts that took the last free connection; callers after it wait.",
+            [("", ("engine",), (name,), exhausted.get((name,), 0)) for name, _ in pools])
+    _family(lines, "lumi_db_pool_wait_seconds", "histogram", "Time to get a connection from the pool (including opening one).",
+            _histogram_samples(pool_wait_seconds, ("engine",)))
+    _family(lines, "lumi_db_pool_checked_out", "gauge", "Connections currently checked out.",
+            [("", ("engine",), (name,), pool.checkedout()) for name, pool in queue_pools])
+    _family(lines, "lumi_db_pool_capacity", "gauge", "Pool size plus allowed overflow.",
+            [("", ("engine",), (name,), _capacity(pool)) for name, pool in queue_pools])
+    return "\n".join(lines) + "\n"
@@ -1,52 +1,378 @@
-from database import engine
-from sqlalchemy import text
+"""
+Versioned schema migrations.
 
-def migrate():
+Each migration runs once, in version order, and is recorded in the
+schema_migrations table. A new database is created from the models by
+main.py (create_all) and stamped with every version, since the models
+already describe the latest schema. On an existing database main.py applies
+pending transactional migrations at startup; the rest (index builds,
+VACUUM) are applied with:
+
+    python migrate_db.py upgrade     apply pending migrations (the default)
+    python migrate_db.py status      list applied and pending migrations
+    python migrate_db.py explain     query plans for the queries each index serves
+
+Migrations 1-5 are the checks this script always ran, so they are safe on
+databases that were migrated before versioning existed. Migration 13 is
+migration 3's index, split out so PostgreSQL can build it CONCURRENTLY.
+"""
+import datetime
+import sys
+
+from database import IS_SQLITE, engine, Base, insert
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, bindparam, inspect, text
+from sqlalchemy.schema import CreateTable
+import caretakers, models, rollups
+
+# Kept out of Base.metadata: it is bookkeeping, not part of the app schema
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String),
+    Column("applied_at", DateTime),
+)
+
+class Migration:
+    def __init__(self, version: int, name: str, apply, transactional: bool = True, query: str = None, params: dict = None):
+        self.version = version
+        self.name = name
+        self.apply = apply # apply(conn)
+        # Non-transactional migrations get an autocommit connection (VACUUM, CREATE INDEX CONCURRENTLY)
+        self.transactional = transactional
+        # For index migrations: the hot-path query the index serves (see `explain`)
+        self.query = query
+        self.params = params or {}
+
+MIGRATIONS = []
+
+def migration(version: int, name: str, transactional: bool = True):
+    def register(apply):
+        MIGRATIONS.append(Migration(version, name, apply, transactional))
+        return apply
+    return register
+
+def _add_missing_column(conn, table: str, column: str, default: str = None):
+    """ALTER TABLE ... ADD COLUMN with the model's type, spelled for the connected database."""
+    if column in {c["name"] for c in inspect(conn).get_columns(table)}:
+        print(f"✅ '{column}' column exists.")
+        return
+    print(f"⚠️ '{column}' column missing. Adding...")
+    sql_type = Base.metadata.tables[table].c[column].type.compile(dialect=conn.dialect)
+    ddl = f"ALTER TABLE {table} ADD COLUMN {column} {sql_type}"
+    if default is not None:
+        ddl += f" DEFAULT {default}"
+    conn.execute(text(ddl))
+    print(f"✅ Added '{column}'.")
+
+# Column checks use the inspector instead of SELECT-and-catch: on PostgreSQL a
+# failed statement aborts the whole transaction
+
+@migration(1, "users: health_issues, role, last_active_at, session_id")
+def _users_columns(conn):
+    _add_missing_column(conn, "users", "health_issues")
+    _add_missing_column(conn, "users", "role", default="'patient'")
+    _add_missing_column(conn, "users", "last_active_at")
+    _add_missing_column(conn, "users", "session_id")
+
+@migration(2, "health_metrics: typed value columns")
+def _typed_value_columns(conn):
+    # Typed value columns replacing the string 'value' column
+    for column in ("hr_bpm", "systolic", "diastolic", "steps"):
+        _add_missing_column(conn, "health_metrics", column)
+
+    # Backfill typed columns from legacy string values ('72', '120/80', '1500')
+    # Only databases from before the typed columns have it
+    if "value" not in {c["name"] for c in inspect(conn).get_columns("health_metrics")}:
+        return
+    if IS_SQLITE:
+        # SQLite casts anything (non-numbers become 0), and has no split function
+        numeric = "value IS NOT NULL"
+        systolic, diastolic = "substr(value, 1, instr(value, '/') - 1)", "substr(value, instr(value, '/') + 1)"
+        bp_pair = "instr(value, '/') > 0"
+    else:
+        # PostgreSQL casts raise on malformed text, which would abort the migration: those rows stay NULL
+        numeric = r"value ~ '^\s*-?[0-9]+(\.[0-9]+)?\s*$'"
+        systolic, diastolic = "split_part(value, '/', 1)", "split_part(value, '/', 2)"
+        bp_pair = r"value ~ '^\s*[0-9]+\s*/\s*[0-9]+\s*$'"
+    result = conn.execute(text(
+        "UPDATE health_metrics SET hr_bpm = CAST(value AS REAL) "
+        f"WHERE metric_type = 'heart_rate' AND hr_bpm IS NULL AND {numeric}"
+    ))
+    print(f"✅ Backfilled {result.rowcount} heart_rate rows.")
+    result = conn.execute(text(
+        "UPDATE health_metrics SET "
+        f"systolic = CAST({systolic} AS INTEGER), "
+        f"diastolic = CAST({diastolic} AS INTEGER) "
+        f"WHERE metric_type = 'blood_pressure' AND systolic IS NULL AND {bp_pair}"
+    ))
+    print(f"✅ Backfilled {result.rowcount} blood_pressure rows.")
+    result = conn.execute(text(
+        # Through REAL so '1500.0' parses on PostgreSQL too
+        "UPDATE health_metrics SET steps = CAST(CAST(value AS REAL) AS INTEGER) "
+        f"WHERE metric_type = 'steps' AND steps IS NULL AND {numeric}"
+    ))
+    print(f"✅ Backfilled {result.rowcount} steps rows.")
+
+UNIQUE_READINGS = "ux_health_metrics_user_type_ts"
+
+def _has_index(conn, name: str) -> bool:
+    """The index exists (and on PostgreSQL is valid: a failed CONCURRENTLY build leaves an invalid one)."""
+    if IS_SQLITE:
+        return conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name"), {"name": name}).first() is not None
+    return conn.execute(text(
+        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name AND i.indisvalid"
+    ), {"name": name}).first() is not None
+
+def _drop_duplicate_readings(conn):
+    print("⚠️ Unique index missing. Removing duplicate readings...")
+    deduplicated = conn.execute(text(
+        "DELETE FROM health_metrics WHERE id NOT IN "
+        "(SELECT MIN(id) FROM health_metrics GROUP BY user_id, metric_type, timestamp)"
+    )).rowcount
+    print(f"✅ Removed {deduplicated} duplicate readings.")
+    if deduplicated and conn.execute(text("SELECT 1 FROM vitals_rollup_1m LIMIT 1")).first():
+        print("⚠️ Vitals rollups counted the removed duplicates. Rebuilding...")
+        print(f"✅ Rolled up {rollups.rebuild(conn)} readings.")
+
+@migration(3, "health_metrics: drop duplicate readings")
+def _unique_readings(conn):
+    # One row per (user_id, metric_type, timestamp): drop duplicates from retries, keeping the first copy.
+    # The unique index itself is migration 13, built outside the startup path.
+    if _has_index(conn, UNIQUE_READINGS):
+        print(f"✅ Unique index '{UNIQUE_READINGS}' present.")
+        return
+    _drop_duplicate_readings(conn)
+
+@migration(4, "vitals rollups backfill")
+def _rollups_backfill(conn):
+    # Rollup tables, backfilled once from existing raw readings
+    if conn.execute(text("SELECT 1 FROM vitals_rollup_1m LIMIT 1")).first():
+        print("✅ Vitals rollups exist.")
+        return
+    print("⚠️ Vitals rollups empty. Backfilling from health_metrics...")
+    print(f"✅ Rolled up {rollups.rebuild(conn)} readings.")
+
+@migration(5, "incremental auto_vacuum", transactional=False)
+def _incremental_auto_vacuum(conn):
+    # Incremental auto_vacuum lets the retention compactor return freed pages.
+    # Switching an existing file requires a full VACUUM (outside a transaction).
+    # SQLite only: on PostgreSQL autovacuum and retention.py's VACUUM cover this.
+    if not IS_SQLITE:
+        return
+    if conn.execute(text("PRAGMA auto_vacuum")).scalar() == 2:
+        print("✅ auto_vacuum is INCREMENTAL.")
+        return
+    print("⚠️ auto_vacuum is not INCREMENTAL. Converting (VACUUM)...")
+    conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+    conn.execute(text("VACUUM"))
+    print("✅ Converted to auto_vacuum INCREMENTAL.")
+
+def _create_index(conn, name: str, table: str, columns: list, unique: bool = False):
+    concurrently = "" if IS_SQLITE else "CONCURRENTLY "
+    # A failed concurrent build leaves an INVALID index behind that IF NOT EXISTS would keep
+    if not IS_SQLITE and conn.execute(text(
+        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name AND NOT i.indisvalid"
+    ), {"name": name}).first():
+        conn.execute(text(f"DROP INDEX CONCURRENTLY {name}"))
+    conn.execute(text(f"CREATE {'UNIQUE ' if unique else ''}INDEX {concurrently}IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"))
+    print(f"✅ Index '{name}' present.")
+
+def index_migration(version: int, name: str, table: str, columns: list, query: str, params: dict):
+    """
+    CREATE INDEX for an existing database. PostgreSQL builds it CONCURRENTLY,
+    so reads and writes continue during the build. SQLite has no online
+    build: readers continue (WAL) but writers wait for the build, which is
+    one pass over the table.
+    """
+    def apply(conn):
+        _create_index(conn, name, table, columns)
+    MIGRATIONS.append(Migration(version, f"index {name} on {table} ({', '.join(columns)})", apply, transactional=False, query=query, params=params))
+
+# Hot-path indexes. Plans are SQLite's EXPLAIN QUERY PLAN without / with the index.
+
+# GET /medications/logs and /medications/{user_id}/logs (calendar range per patient)
+# before: SCAN medication_logs
+# after:  SEARCH medication_logs USING INDEX ix_medication_logs_user_date (user_id=? AND date>? AND date<?)
+index_migration(
+    6, "ix_medication_logs_user_date", "medication_logs", ["user_id", "date"],
+    "SELECT * FROM medication_logs WHERE user_id = :user_id AND date >= :start AND date <= :end",
+    {"user_id": 1, "start": datetime.date(2024, 1, 1), "end": datetime.date(2024, 1, 31)},
+)
+# POST /medications/{med_id}/log (existing log for that dose and day)
+# before: SCAN medication_logs
+# after:  SEARCH medication_logs USING INDEX ix_medication_logs_medication_date (medication_id=? AND date=?)
+index_migration(
+    7, "ix_medication_logs_medication_date", "medication_logs", ["medication_id", "date"],
+    "SELECT * FROM medication_logs WHERE medication_id = :medication_id AND date = :date LIMIT 1",
+    {"medication_id": 1, "date": datetime.date(2024, 1, 1)},
+)
+# GET /vitals/ and /vitals/{user_id} (newest readings of every type) and the vitals cache window load
+# before: SEARCH health_metrics USING INDEX ix_health_metrics_user_id (user_id=?) + USE TEMP B-TREE FOR ORDER BY
+# after:  SEARCH health_metrics USING INDEX ix_health_metrics_user_ts (user_id=?)
+index_migration(
+    8, "ix_health_metrics_user_ts", "health_metrics", ["user_id", "timestamp"],
+    "SELECT * FROM health_metrics WHERE user_id = :user_id ORDER BY timestamp DESC LIMIT 50",
+    {"user_id": 1},
+)
+# Patients listing a caretaker's phone as nominee (the caretaker views read caretaker_patients since migration 12)
+# before: SCAN nominees
+# after:  SEARCH nominees USING INDEX ix_nominees_phone (phone=?)
+index_migration(
+    9, "ix_nominees_phone", "nominees", ["phone"],
+    "SELECT DISTINCT users.* FROM users JOIN nominees ON users.id = nominees.user_id WHERE nominees.phone = :phone",
+    {"phone": "5550100"},
+)
+# POST /emergency/trigger and the vitals rules (the patient's open alert)
+# before: SCAN emergency_alerts
+# after:  SEARCH emergency_alerts USING INDEX ix_emergency_alerts_user_active (user_id=? AND is_active=?)
+index_migration(
+    10, "ix_emergency_alerts_user_active", "emergency_alerts", ["user_id", "is_active"],
+    "SELECT * FROM emergency_alerts WHERE user_id = :user_id AND is_active = :active LIMIT 1",
+    {"user_id": 1, "active": True},
+)
+# /emergency/active (patients currently in emergency or alert)
+# before: SCAN patient_statuses
+# after:  SEARCH patient_statuses USING INDEX ix_patient_statuses_status (status=?)
+index_migration(
+    11, "ix_patient_statuses_status", "patient_statuses", ["status"],
+    "SELECT * FROM patient_statuses WHERE status IN ('emergency', 'alert')",
+    {},
+)
+
+@migration(12, "caretaker_patients backfill from nominees")
+def _caretaker_links(conn):
+    print(f"✅ Linked {caretakers.rebuild(conn)} caretaker-patient pairs.")
+
+@migration(13, f"index {UNIQUE_READINGS} and ix_health_metrics_user_id on health_metrics", transactional=False)
+def _unique_readings_index(conn):
+    # Split from migration 3 so PostgreSQL builds it CONCURRENTLY rather than
+    # locking health_metrics against writes during startup. Readings stored since
+    # migration 3 ran may have brought duplicates back: drop them first (a
+    # duplicate landing during the build fails it; re-run upgrade).
+    if not _has_index(conn, UNIQUE_READINGS):
+        _drop_duplicate_readings(conn)
+        _create_index(conn, UNIQUE_READINGS, "health_metrics", ["user_id", "metric_type", "timestamp"], unique=True)
+        # Superseded by the unique index on the same columns
+        conn.execute(text(f"DROP INDEX {'' if IS_SQLITE else 'CONCURRENTLY '}IF EXISTS ix_health_metrics_user_type_ts"))
+    _create_index(conn, "ix_health_metrics_user_id", "health_metrics", ["user_id"])
+
+# pg_advisory_xact_lock key shared by everything that applies migrations
+MIGRATION_LOCK_ID = 4201
+
+def _applied(conn, lock: bool = False) -> dict:
+    """
+    Applied migrations by version. With lock, other migrators (workers
+    starting together, the CLI) wait until this transaction ends, so each
+    migration is applied and recorded once.
+    """
+    if lock and not IS_SQLITE:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_ID})
+    conn.execute(CreateTable(schema_migrations, if_not_exists=True))
+    if lock and IS_SQLITE:
+        # A write statement takes the database write lock; other writers wait (busy_timeout)
+        conn.execute(text("UPDATE schema_migrations SET version = version WHERE 0"))
+    return {row.version: row for row in conn.execute(schema_migrations.select())}
+
+def _record(conn, migration: Migration):
+    conn.execute(insert(schema_migrations).values(
+        version=migration.version, name=migration.name, applied_at=datetime.datetime.utcnow()
+    ).on_conflict_do_nothing(index_elements=["version"]))
+
+def pending() -> list:
+    with engine.begin() as conn:
+        applied = _applied(conn)
+    return [m for m in sorted(MIGRATIONS, key=lambda m: m.version) if m.version not in applied]
+
+def stamp():
+    """Mark every migration applied (the database was just created from the models)."""
+    with engine.begin() as conn:
+        applied = _applied(conn, lock=True)
+        for migration in MIGRATIONS:
+            if migration.version not in applied:
+                _record(conn, migration)
+
+def _apply(migration: Migration) -> bool:
+    """Apply and record one migration unless another process got there first."""
+    if not migration.transactional:
+        # No transaction to hold a lock in: these are idempotent (IF NOT EXISTS, checks) and recorded with DO NOTHING
+        print(f"⬆️ Migration {migration.version}: {migration.name}")
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            migration.apply(conn)
+            _record(conn, migration)
+        return True
+    with engine.begin() as conn:
+        if migration.version in _applied(conn, lock=True):
+            return False
+        print(f"⬆️ Migration {migration.version}: {migration.name}")
+        migration.apply(conn)
+        _record(conn, migration)
+    return True
+
+def init_db():
+    """
+    Startup hook for main.py: creates missing tables; a database created here
+    is stamped as fully migrated. On an existing one, pending transactional
+    migrations (columns, backfills) are applied now, since the code needs
+    them. Non-transactional ones (index builds, VACUUM) only make queries
+    faster and can hold up writers on a large table, so they are left to
+    `python migrate_db.py upgrade`. The exception is the unique index on
+    health_metrics (migration 13): ingest's ON CONFLICT needs it, so startup
+    stops until it has been built.
+    """
+    is_new = not inspect(engine).has_table("users")
+    Base.metadata.create_all(bind=engine)
+    if is_new:
+        stamp()
+        return
+    for migration in pending():
+        if migration.transactional:
+            _apply(migration)
+    with engine.begin() as conn:
+        linked = caretakers.backfill_if_empty(conn)
+    if linked:
+        print(f"✅ Linked {linked} caretaker-patient pairs (caretaker_patients was empty).")
+    with engine.connect() as conn:
+        if not _has_index(conn, UNIQUE_READINGS):
+            raise RuntimeError(f"❌ health_metrics has no unique index '{UNIQUE_READINGS}', which storing readings needs. Run: python migrate_db.py upgrade")
+    waiting = pending()
+    if waiting:
+        print(f"⚠️ {len(waiting)} pending index/maintenance migrations ({', '.join(str(m.version) for m in waiting)}). Run: python migrate_db.py upgrade")
+
+def upgrade() -> int:
+    # New tables (and the schema of a brand-new database) come straight from the models
+    Base.metadata.create_all(bind=engine)
+    applied = 0
+    for migration in pending():
+        applied += _apply(migration)
+    print(f"🎉 Migration complete! ({applied} applied)")
+    return applied
+
+def status():
+    with engine.begin() as conn:
+        applied = _applied(conn)
+    for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+        row = applied.get(migration.version)
+        state = f"applied {row.applied_at:%Y-%m-%d %H:%M}" if row else "pending"
+        print(f"{migration.version:>3}  {state:<22} {migration.name}")
+
+def explain():
+    """Plan of each index migration's query against the current database."""
+    prefix = "EXPLAIN QUERY PLAN " if IS_SQLITE else "EXPLAIN "
     with engine.connect() as conn:
-        try:
-            print("Checking and migrating 'users' table...")
-            
-            # Check/Add health_issues
-            try:
-                conn.execute(text("SELECT health_issues FROM users LIMIT 1"))
-                print("✅ 'health_issues' column exists.")
-            except Exception:
-                print("⚠️ 'health_issues' column missing. Adding...")
-                conn.execute(text("ALTER TABLE users ADD COLUMN health_issues VARCHAR"))
-                print("✅ Added 'health_issues'.")
-
-            # Check/Add role
-            try:
-                conn.execute(text("SELECT role FROM users LIMIT 1"))
-                print("✅ 'role' column exists.")
-            except Exception:
-                print("⚠️ 'role' column missing. Adding...")
-                conn.execute(text("ALTER TABLE users ADD COLUMN role VARCHAR DEFAULT 'patient'"))
-                print("✅ Added 'role'.")
-
-            # Check/Add last_active_at
-            try:
-                conn.execute(text("SELECT last_active_at FROM users LIMIT 1"))
-                print("✅ 'last_active_at' column exists.")
-            except Exception:
-                print("⚠️ 'last_active_at' column missing. Adding...")
-                conn.execute(text("ALTER TABLE users ADD COLUMN last_active_at DATETIME"))
-                print("✅ Added 'last_active_at'.")
-
-            # Check/Add session_id
-            try:
-                conn.execute(text("SELECT session_id FROM users LIMIT 1"))
-                print("✅ 'session_id' column exists.")
-            except Exception:
-                print("⚠️ 'session_id' column missing. Adding...")
-                conn.execute(text("ALTER TABLE users ADD COLUMN session_id VARCHAR"))
-                print("✅ Added 'session_id'.")
-                
-            conn.commit()
-            print("🎉 Migration complete!")
-            
-        except Exception as e:
-            print(f"❌ Migration failed: {e}")
+        for migration in MIGRATIONS:
+            if migration.query is None:
+                continue
+            print(f"{migration.version:>3}  {migration.query}")
+            stmt = text(prefix + migration.query).bindparams(
+                *[bindparam(key, value) for key, value in migration.params.items()]
+            )
+            for row in conn.execute(stmt):
+                print(f"       {row[-1]}")
 
 if __name__ == "__main__":
-    migrate()
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    commands = {"upgrade": upgrade, "status": status, "explain": explain}
+    if command not in commands:
+        sys.exit(f"usage: python migrate_db.py [{'|'.join(commands)}]")
+    commands[command]()
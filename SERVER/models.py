@@ -1,7 +1,14 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Date
-from sqlalchemy.orm import relationship as sqlalchemy_relationship
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Date, Float, Enum, Index
+from sqlalchemy.orm import relationship as sqlalchemy_relationship, declared_attr
 from database import Base
 import datetime
+import enum
+import math
+
+class MetricType(str, enum.Enum):
+    HEART_RATE = "heart_rate"
+    BLOOD_PRESSURE = "blood_pressure"
+    STEPS = "steps"
 
 class User(Base):
     __tablename__ = "users"
@@ -27,9 +34,14 @@ class User(Base):
     emergency_alerts = sqlalchemy_relationship("EmergencyAlert", back_populates="user")
     health_metrics = sqlalchemy_relationship("HealthMetric", back_populates="user")
     patient_status = sqlalchemy_relationship("PatientStatus", uselist=False, back_populates="user")
+    devices = sqlalchemy_relationship("Device", back_populates="user")
 
 class Nominee(Base):
     __tablename__ = "nominees"
+    __table_args__ = (
+        # Patients that list this phone as a nominee (caretaker views use CaretakerPatient)
+        Index("ix_nominees_phone", "phone"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -39,6 +51,17 @@ class Nominee(Base):
     
     user = sqlalchemy_relationship("User", back_populates="nominees")
 
+class CaretakerPatient(Base):
+    """
+    A caretaker (by phone) to one of their patients: one row per distinct
+    nominee phone of a patient. Derived from nominees, see caretakers.py.
+    """
+    __tablename__ = "caretaker_patients"
+
+    # Primary key order: a caretaker's patients are one contiguous range
+    caretaker_phone = Column(String, primary_key=True)
+    patient_id = Column(Integer, ForeignKey("users.id"), primary_key=True, index=True)
+
 class Medication(Base):
     __tablename__ = "medications"
 
@@ -55,6 +78,11 @@ class Medication(Base):
 
 class MedicationLog(Base):
     __tablename__ = "medication_logs"
+    __table_args__ = (
+        # Calendar range reads per patient, and the per-dose "already logged today" check
+        Index("ix_medication_logs_user_date", "user_id", "date"),
+        Index("ix_medication_logs_medication_date", "medication_id", "date"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     medication_id = Column(Integer, ForeignKey("medications.id"))
@@ -68,6 +96,10 @@ class MedicationLog(Base):
 
 class EmergencyAlert(Base):
     __tablename__ = "emergency_alerts"
+    __table_args__ = (
+        # The patient's open alert
+        Index("ix_emergency_alerts_user_active", "user_id", "is_active"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -80,18 +112,90 @@ class EmergencyAlert(Base):
 
 class HealthMetric(Base):
     __tablename__ = "health_metrics"
+    __table_args__ = (
+        # Every read path filters by patient + metric and orders by time.
+        # Unique, so retried and re-sent readings are stored once (see ingest.write_rows).
+        Index("ux_health_metrics_user_type_ts", "user_id", "metric_type", "timestamp", unique=True),
+        # Newest readings of all types for a patient, and time-window loads
+        Index("ix_health_metrics_user_ts", "user_id", "timestamp"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    metric_type = Column(String) # 'heart_rate', 'blood_pressure', 'steps'
-    value = Column(String) # Storing as string to handle '120/80' BP format easily
+    # Single-column index is ordered by (user_id, id): serves ?since=<cursor> seeks
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    metric_type = Column(Enum(MetricType, native_enum=False, length=20, values_callable=lambda e: [m.value for m in e]))
+    # Typed value columns, only the ones matching metric_type are set
+    hr_bpm = Column(Float, nullable=True)
+    systolic = Column(Integer, nullable=True)
+    diastolic = Column(Integer, nullable=True)
+    steps = Column(Integer, nullable=True)
     unit = Column(String)
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
     
     user = sqlalchemy_relationship("User", back_populates="health_metrics")
 
+    @staticmethod
+    def parse_value(metric_type, value):
+        """
+        Split the wire format ('72', '120/80', '1500') into typed columns.
+        Raises ValueError for unknown metric types or malformed values,
+        including NaN, infinities and readings outside VALUE_RANGES.
+        """
+        metric_type = MetricType(metric_type)
+        try:
+            if metric_type == MetricType.HEART_RATE:
+                fields = {"hr_bpm": _finite(float(value))}
+            elif metric_type == MetricType.BLOOD_PRESSURE:
+                systolic, diastolic = str(value).split("/")
+                fields = {"systolic": _integer(int(systolic)), "diastolic": _integer(int(diastolic))}
+            else:
+                fields = {"steps": _integer(int(_finite(float(value))))}
+        except OverflowError:
+            raise ValueError(f"{metric_type.value} value out of range: {value!r}")
+        for field, number in fields.items():
+            low, high = VALUE_RANGES[field]
+            if not low <= number <= high:
+                raise ValueError(f"{field} {number:g} outside the plausible range {low}-{high}")
+        return fields
+
+    @property
+    def value(self):
+        # Wire format kept for existing clients
+        if self.metric_type == MetricType.HEART_RATE:
+            if self.hr_bpm is None:
+                return None
+            return str(int(self.hr_bpm)) if self.hr_bpm.is_integer() else str(self.hr_bpm)
+        if self.metric_type == MetricType.BLOOD_PRESSURE:
+            return f"{self.systolic}/{self.diastolic}"
+        return None if self.steps is None else str(self.steps)
+
+# Plausible readings per typed column; anything outside is a sensor or client error.
+# steps is a cumulative counter, so its bound is loose.
+VALUE_RANGES = {
+    "hr_bpm": (20, 300),
+    "systolic": (40, 300),
+    "diastolic": (20, 200),
+    "steps": (0, 100_000_000),
+}
+
+def _finite(number: float) -> float:
+    # float() accepts 'nan', 'inf' and '1e999'; none of them is a reading
+    if not math.isfinite(number):
+        raise ValueError(f"Non-finite value: {number!r}")
+    return number
+
+def _integer(number: int) -> int:
+    # Integer columns are int4 on PostgreSQL: a larger value would only fail when the row is written
+    if not -2**31 <= number < 2**31:
+        raise OverflowError(number)
+    return number
+
 class PatientStatus(Base):
     __tablename__ = "patient_statuses"
+    __table_args__ = (
+        # Patients currently in emergency/alert
+        Index("ix_patient_statuses_status", "status"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), unique=True) # One status per user
@@ -100,3 +204,63 @@ class PatientStatus(Base):
     last_updated = Column(DateTime, default=datetime.datetime.utcnow)
 
     user = sqlalchemy_relationship("User", back_populates="patient_status")
+
+class Device(Base):
+    """A patient's wearable (or its vendor API) that the device gateway pulls readings from."""
+    __tablename__ = "devices"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    name = Column(String)
+    kind = Column(String, default="health_api") # payload format, see gateway.PARSERS
+    url = Column(String)
+    mode = Column(String, default="poll") # 'poll' or 'stream' (NDJSON lines)
+    poll_interval_seconds = Column(Float, default=1.0)
+    enabled = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    user = sqlalchemy_relationship("User", back_populates="devices")
+
+class OTPCode(Base):
+    """Pending login OTP, used by otp_store.DatabaseOTPStore so every worker sees it."""
+    __tablename__ = "otp_codes"
+
+    phone = Column(String, primary_key=True)
+    otp_hash = Column(String)
+    expires_at = Column(Float, index=True) # epoch seconds
+    attempts = Column(Integer, default=0)
+
+class RateLimitBucket(Base):
+    """Token bucket shared by all workers (otp_store.DatabaseOTPStore)."""
+    __tablename__ = "rate_limit_buckets"
+
+    key = Column(String, primary_key=True) # '<scope>:<phone or ip>'
+    tokens = Column(Float)
+    updated_at = Column(Float) # epoch seconds
+
+class VitalsRollupMixin:
+    """
+    Pre-aggregated bucket of one typed HealthMetric column for one patient.
+    Maintained incrementally by rollups.apply() as readings are ingested.
+    """
+    @declared_attr
+    def user_id(cls):
+        return Column(Integer, ForeignKey("users.id"), primary_key=True)
+
+    metric = Column(String, primary_key=True) # 'hr_bpm', 'systolic', 'diastolic', 'steps'
+    bucket_start = Column(DateTime, primary_key=True)
+    min_value = Column(Float)
+    max_value = Column(Float)
+    sum_value = Column(Float)
+    count = Column(Integer)
+    last_value = Column(Float)
+    last_ts = Column(DateTime)
+
+class VitalsRollupMinute(VitalsRollupMixin, Base):
+    __tablename__ = "vitals_rollup_1m"
+
+class VitalsRollupHour(VitalsRollupMixin, Base):
+    __tablename__ = "vitals_rollup_1h"
+
+class VitalsRollupDay(VitalsRollupMixin, Base):
+    __tablename__ = "vitals_rollup_1d"
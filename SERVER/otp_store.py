@@ -0,0 +1,182 @@
+"""
+Login OTP storage and /auth/otp rate limiting.
+
+Two interchangeable stores, selected with OTP_STORE:
+
+- 'memory' (MemoryOTPStore): per process, bounded to OTP_MAX_ENTRIES codes
+  and OTP_RATE_LIMIT_MAX_KEYS rate-limit buckets. Only correct with a single
+  uvicorn worker.
+- 'db' (DatabaseOTPStore): codes and buckets live in the otp_codes and
+  rate_limit_buckets tables, so any worker can verify a code another one
+  issued. Every operation is a few single-row statements on a primary key.
+
+Codes expire after OTP_TTL_SECONDS, are consumed by a successful verify and
+dropped after OTP_MAX_ATTEMPTS wrong guesses. Only an HMAC of the code is
+kept. Rate limits are token buckets per scope ('phone', 'ip') configured in
+OTP_RATE_LIMITS.
+"""
+import abc
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import case, delete, select, update
+
+import models
+from config import settings
+from database import engine, insert
+
+otp_codes = models.OTPCode.__table__
+rate_limit_buckets = models.RateLimitBucket.__table__
+
+def _digest(phone: str, otp: str) -> str:
+    return hmac.new(settings.SECRET_KEY.encode(), f"{phone}:{otp}".encode(), hashlib.sha256).hexdigest()
+
+class OTPStore(abc.ABC):
+    def __init__(self, ttl_seconds: float, max_attempts: int, limits: dict):
+        self.ttl_seconds = ttl_seconds
+        self.max_attempts = max_attempts
+        # scope -> (burst, tokens added per second)
+        self.limits = {scope: (burst, per_minute / 60.0) for scope, (burst, per_minute) in limits.items()}
+
+    @abc.abstractmethod
+    def put(self, phone: str, otp: str):
+        """Store a new code for phone, replacing any pending one."""
+
+    @abc.abstractmethod
+    def verify(self, phone: str, otp: str) -> bool:
+        """True (and the code is consumed) if otp is the pending, unexpired code."""
+
+    @abc.abstractmethod
+    def limit(self, scope: str, key: str) -> float:
+        """Take a token from the (scope, key) bucket. Returns 0 if allowed, else seconds until one is available."""
+
+class TokenBuckets:
+    """In-memory token buckets, LRU-bounded to max_keys (an evicted bucket simply starts full again)."""
+    def __init__(self, burst: float, rate: float, max_keys: int):
+        self.burst = burst
+        self.rate = rate
+        self.max_keys = max_keys
+        self._buckets = OrderedDict() # key -> [tokens, updated_at]
+
+    def take(self, key: str, now: float) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / self.rate
+
+class MemoryOTPStore(OTPStore):
+    def __init__(self, ttl_seconds: float, max_attempts: int, limits: dict, max_entries: int, max_limit_keys: int):
+        super().__init__(ttl_seconds, max_attempts, limits)
+        self.max_entries = max_entries
+        # Every code gets the same TTL, so insertion order is expiry order:
+        # expired codes are always at the front and are popped in O(1)
+        self._codes = OrderedDict() # phone -> [digest, expires_at, failed attempts]
+        self._buckets = {scope: TokenBuckets(burst, rate, max_limit_keys) for scope, (burst, rate) in self.limits.items()}
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float):
+        while self._codes:
+            phone, entry = next(iter(self._codes.items()))
+            if entry[1] > now:
+                break
+            self._codes.popitem(last=False)
+
+    def put(self, phone: str, otp: str):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            self._codes.pop(phone, None)
+            self._codes[phone] = [_digest(phone, otp), now + self.ttl_seconds, 0]
+            while len(self._codes) > self.max_entries:
+                self._codes.popitem(last=False)
+
+    def verify(self, phone: str, otp: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._codes.get(phone)
+            if entry is None or entry[1] <= now:
+                return False
+            if hmac.compare_digest(entry[0], _digest(phone, otp)):
+                del self._codes[phone]
+                return True
+            entry[2] += 1
+            if entry[2] >= self.max_attempts:
+                del self._codes[phone]
+            return False
+
+    def limit(self, scope: str, key: str) -> float:
+        with self._lock:
+            return self._buckets[scope].take(key, time.monotonic())
+
+class DatabaseOTPStore(OTPStore):
+    def put(self, phone: str, otp: str):
+        now = time.time()
+        # Buckets idle long enough to be full again are equivalent to no row
+        idle = max(burst / rate for burst, rate in self.limits.values())
+        with engine.begin() as conn:
+            conn.execute(delete(otp_codes).where(otp_codes.c.expires_at <= now))
+            conn.execute(delete(rate_limit_buckets).where(rate_limit_buckets.c.updated_at <= now - idle))
+            values = {"otp_hash": _digest(phone, otp), "expires_at": now + self.ttl_seconds, "attempts": 0}
+            conn.execute(
+                insert(otp_codes).values(phone=phone, **values)
+                .on_conflict_do_update(index_elements=["phone"], set_=values)
+            )
+
+    def verify(self, phone: str, otp: str) -> bool:
+        with engine.begin() as conn:
+            consumed = conn.execute(
+                delete(otp_codes).where(
+                    otp_codes.c.phone == phone,
+                    otp_codes.c.otp_hash == _digest(phone, otp),
+                    otp_codes.c.expires_at > time.time(),
+                )
+            ).rowcount
+            if consumed:
+                return True
+            conn.execute(update(otp_codes).where(otp_codes.c.phone == phone).values(attempts=otp_codes.c.attempts + 1))
+            conn.execute(delete(otp_codes).where(otp_codes.c.phone == phone, otp_codes.c.attempts >= self.max_attempts))
+            return False
+
+    def limit(self, scope: str, key: str) -> float:
+        burst, rate = self.limits[scope]
+        key = f"{scope}:{key}"
+        now = time.time()
+        rb = rate_limit_buckets
+        refilled = rb.c.tokens + (now - rb.c.updated_at) * rate
+        tokens = case((refilled > burst, burst), else_=refilled)
+        # Refill and take in one UPDATE so concurrent workers cannot both spend the last token
+        take = update(rb).where(rb.c.key == key, tokens >= 1).values(tokens=tokens - 1, updated_at=now)
+        with engine.begin() as conn:
+            if conn.execute(take).rowcount:
+                return 0.0
+            created = conn.execute(
+                insert(rb).values(key=key, tokens=burst - 1, updated_at=now).on_conflict_do_nothing(index_elements=["key"])
+            ).rowcount
+            # Lost a race to create the bucket: try the existing one once more
+            if created or conn.execute(take).rowcount:
+                return 0.0
+            left = conn.execute(select(tokens).where(rb.c.key == key)).scalar()
+            return (1 - left) / rate
+
+def create_store(kind: str) -> OTPStore:
+    common = dict(ttl_seconds=settings.OTP_TTL_SECONDS, max_attempts=settings.OTP_MAX_ATTEMPTS, limits=settings.OTP_RATE_LIMITS)
+    if kind == "memory":
+        return MemoryOTPStore(max_entries=settings.OTP_MAX_ENTRIES, max_limit_keys=settings.OTP_RATE_LIMIT_MAX_KEYS, **common)
+    if kind == "db":
+        return DatabaseOTPStore(**common)
+    raise ValueError(f"Unknown OTP_STORE '{kind}' (expected 'memory' or 'db')")
+
+store = create_store(settings.OTP_STORE)
@@ -0,0 +1,130 @@
+"""
+In-memory presence tracking.
+
+Vitals, logins and logouts record activity here instead of updating
+users.last_active_at on every request. A background thread writes the
+latest timestamp per user back to the users table in one batched UPDATE
+every PRESENCE_FLUSH_INTERVAL_SECONDS, and readers such as /users/patients
+take the newer of the tracked and stored values (another worker may have
+flushed more recent activity).
+
+Readings the device gateway pulls from a wearable only count as activity
+while the user is signed in: seen by a request here since their last logout.
+"""
+import datetime
+import threading
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.exc import OperationalError
+
+import models
+from config import settings
+from database import engine
+
+users = models.User.__table__
+
+class PresenceTracker:
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._seen = {}  # user_id -> last activity (naive UTC)
+        self._dirty = {} # not yet written to users.last_active_at
+        self._signed_in = set()  # user_ids with request activity since their last logout
+        self._logged_out = {}    # user_id -> logout time (naive UTC)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.touches = 0
+        self.flushes = 0
+        self.rows_written = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="presence-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the flusher and write out everything pending."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+
+    def touch(self, user_id: int, when: datetime.datetime = None, device: bool = False):
+        """Record activity; device=True for readings polled from a wearable, ignored unless signed in."""
+        when = when or datetime.datetime.utcnow()
+        with self._lock:
+            if device and user_id not in self._signed_in:
+                return
+            self.touches += 1
+            if not device:
+                self._signed_in.add(user_id)
+                self._logged_out.pop(user_id, None)
+            if when > self._seen.get(user_id, datetime.datetime.min):
+                self._seen[user_id] = when
+                self._dirty[user_id] = when
+
+    def mark_offline(self, user_id: int):
+        # Same as the old logout behaviour: activity an hour in the past reads as offline
+        now = datetime.datetime.utcnow()
+        when = now - datetime.timedelta(hours=1)
+        with self._lock:
+            self._signed_in.discard(user_id)
+            self._logged_out[user_id] = now
+            self._seen[user_id] = when
+            self._dirty[user_id] = when
+
+    def last_seen(self, user_id: int, stored: datetime.datetime = None):
+        """The newer of the tracked activity and the stored users.last_active_at."""
+        with self._lock:
+            seen = self._seen.get(user_id)
+            logged_out = self._logged_out.get(user_id)
+        if stored is not None and logged_out is not None and stored <= logged_out:
+            stored = None # activity the logout here ended
+        if seen is None or stored is None:
+            return seen or stored
+        return max(seen, stored)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self) -> int:
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return 0
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                    update(users).where(users.c.id == bindparam("uid")).values(last_active_at=bindparam("seen")),
+                    [{"uid": uid, "seen": seen} for uid, seen in dirty.items()],
+                )
+        except OperationalError as e:
+            # e.g. database is locked: keep the timestamps for the next tick unless newer ones arrived
+            print(f"⚠️ Presence flush of {len(dirty)} users failed, retrying: {e}")
+            with self._lock:
+                for uid, seen in dirty.items():
+                    self._dirty.setdefault(uid, seen)
+            return 0
+        self.flushes += 1
+        self.rows_written += len(dirty)
+        return len(dirty)
+
+    def stats(self) -> dict:
+        with self._lock:
+            tracked, pending = len(self._seen), len(self._dirty)
+        return {
+            "tracked_users": tracked,
+            "signed_in": len(self._signed_in),
+            "pending": pending,
+            "touches": self.touches,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+        }
+
+tracker = PresenceTracker(flush_interval=settings.PRESENCE_FLUSH_INTERVAL_SECONDS)
@@ -0,0 +1,225 @@
+"""
+Opt-in sampling profiler for a running server.
+
+A background thread snapshots every thread's Python stack
+(sys._current_frames) every PROFILER_INTERVAL_SECONDS and counts identical
+stacks. When the session ends the counts are written to
+PROFILER_OUTPUT_DIR in collapsed-stack format ("thread;file:func;... count"),
+which flamegraph.pl, speedscope and inferno read directly.
+
+Two kinds of session, started from POST /admin/profile or with SIGUSR1:
+
+- for N seconds: every thread is sampled the whole time
+- for 1-in-K requests to one route (e.g. "POST /vitals/"): samples are only
+  taken while a selected request is in flight. Stacks running the route's
+  endpoint function are rooted at the route; every other thread (other
+  requests, background workers, dependencies before the endpoint is
+  entered) is rooted at "(other_threads)", so it cannot be mistaken for the
+  route's own time.
+
+Nothing is sampled, and the middleware check is one attribute read, while
+no session is running.
+"""
+import datetime
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+from starlette.routing import compile_path
+
+from config import settings
+
+# Innermost frames of threads that are parked, not working: skipped so idle workers do not dominate
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"), # concurrent.futures worker blocked in SimpleQueue.get (C code)
+}
+
+# Root of route-session stacks that are not running the route's endpoint
+OTHER_ROOT = "(other_threads)"
+
+def _frame_name(code) -> str:
+    # Last two path components: enough to tell routers/vitals.py from vitals.py
+    filename = "/".join(code.co_filename.replace("\\", "/").split("/")[-2:])
+    return f"{filename}:{code.co_name}"
+
+class ProfileSession:
+    def __init__(self, seconds: float, method: str = None, path: str = None, every: int = 1, label: str = "manual"):
+        self.seconds = seconds
+        # Route template to select requests from ("POST", "/vitals/{user_id}"); None samples everything
+        self.method = method
+        self.route = f"{method} {path}" if path else None
+        self.path_regex = compile_path(path)[0] if path else None
+        self.every = max(every, 1)
+        self.label = label
+        self.started_at = time.monotonic()
+        self.stacks = Counter()
+        self.samples = 0
+        self.matched = 0   # requests to the route seen
+        self.selected = 0  # of which profiled
+        self.in_flight = {} # id(scope) -> scope of selected requests being served
+        self.file = None
+
+class SamplingProfiler:
+    def __init__(self, interval: float, output_dir: str):
+        self.interval = interval
+        self.output_dir = output_dir
+        self.session = None
+        self.last_file = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, seconds: float, method: str = None, path: str = None, every: int = 1, label: str = "manual") -> ProfileSession:
+        """Start a session. Raises RuntimeError if one is already running."""
+        with self._lock:
+            if self.session is not None:
+                raise RuntimeError("A profiling session is already running")
+            session = ProfileSession(seconds, method, path, every, label)
+            os.makedirs(self.output_dir, exist_ok=True)
+            stamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+            name = label if path is None else "".join(c if c.isalnum() else "_" for c in f"{method}{path}").strip("_")
+            session.file = os.path.join(self.output_dir, f"profile-{stamp}-{name}.folded")
+            self.session = session
+            self._thread = threading.Thread(target=self._run, args=(session,), name="profiler", daemon=True)
+            self._thread.start()
+        if session.route:
+            print(f"🔬 Profiling 1 in {session.every} '{session.route}' requests for {seconds:g}s")
+        else:
+            print(f"🔬 Profiling all threads for {seconds:g}s")
+        return session
+
+    def stop(self):
+        session = self.session
+        if session is not None:
+            session.seconds = 0 # the sampler thread notices on its next tick and writes the file
+            self._thread.join()
+
+    def status(self) -> dict:
+        session = self.session
+        if session is None:
+            return {"running": False, "last_file": self.last_file}
+        return {
+            "running": True,
+            "route": session.route,
+            "every": session.every,
+            "elapsed_seconds": round(time.monotonic() - session.started_at, 1),
+            "seconds": session.seconds,
+            "samples": session.samples,
+            "requests_matched": session.matched,
+            "requests_profiled": session.selected,
+            "file": session.file,
+        }
+
+    # Request selection (called by ProfilerMiddleware)
+
+    def select(self, scope):
+        """The running route session if it profiles this request, else None."""
+        session = self.session
+        if session is None or session.route is None or scope["method"] != session.method:
+            return None
+        if not session.path_regex.match(scope["path"]):
+            return None
+        session.matched += 1
+        if (session.matched - 1) % session.every:
+            return None
+        session.selected += 1
+        session.in_flight[id(scope)] = scope
+        return session
+
+    # Sampling
+
+    def _run(self, session: ProfileSession):
+        own = threading.get_ident()
+        root = session.route
+        # The sampler needs the GIL to look at other threads, and a busy thread only gives it up
+        # every switch interval (5 ms): short CPU-bound handlers would never be caught mid-run
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(switch_interval, settings.PROFILER_SWITCH_INTERVAL_SECONDS))
+        try:
+            self._sample(session, own, root)
+        finally:
+            sys.setswitchinterval(switch_interval)
+        self._write(session)
+
+    def _sample(self, session: ProfileSession, own: int, root: str):
+        while time.monotonic() < session.started_at + session.seconds:
+            time.sleep(self.interval)
+            endpoints = None
+            if root is not None:
+                requests = tuple(session.in_flight.values())
+                if not requests:
+                    continue
+                # Routing puts the endpoint in the (shared) scope once the request reaches it
+                endpoints = {getattr(scope.get("endpoint"), "__code__", None) for scope in requests}
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    continue
+                stack = []
+                serving = False
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    serving = serving or (endpoints is not None and frame.f_code in endpoints)
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}").replace(" ", "_"))
+                if root is not None:
+                    stack.append(root if serving else OTHER_ROOT)
+                session.stacks[";".join(reversed(stack))] += 1
+            session.samples += 1
+
+    def _write(self, session: ProfileSession):
+        try:
+            with open(session.file, "w") as f:
+                for stack, count in session.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        except OSError as e:
+            print(f"❌ Could not write profile {session.file}: {e}")
+            return
+        finally:
+            # Even when the write fails, so the next session can start
+            with self._lock:
+                self.session = None
+        self.last_file = session.file
+        print(f"🔬 Profile written: {session.file} ({session.samples} samples, {len(session.stacks)} stacks)")
+
+class ProfilerMiddleware:
+    """Marks requests selected by a route session as in flight while they are served."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        session = profiler.select(scope) if scope["type"] == "http" and profiler.session is not None else None
+        if session is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            session.in_flight.pop(id(scope), None)
+
+def install_signal_handler():
+    """SIGUSR1 profiles all threads for PROFILER_SIGNAL_SECONDS. Main thread, POSIX only."""
+    if not hasattr(signal, "SIGUSR1") or threading.current_thread() is not threading.main_thread():
+        return
+
+    def on_signal(signum, frame):
+        # Started from a thread: signal handlers should not block or take locks
+        threading.Thread(target=_start_from_signal, daemon=True).start()
+
+    signal.signal(signal.SIGUSR1, on_signal)
+
+def _start_from_signal():
+    try:
+        profiler.start(settings.PROFILER_SIGNAL_SECONDS, label="signal")
+    except RuntimeError as e:
+        print(f"⚠️ {e}")
+
+profiler = SamplingProfiler(interval=settings.PROFILER_INTERVAL_SECONDS, output_dir=settings.PROFILER_OUTPUT_DIR)
@@ -0,0 +1,159 @@
+"""
+Retention and compaction for raw health_metrics.
+
+Off unless RAW_VITALS_RETENTION_HOURS is set. Rollups are written in the
+same transaction as the raw readings, but older data is only rolled up by
+migrate_db.py, so every chunk is checked against vitals_rollup_1m first
+(rollups.ensure_covered): minutes without rollups are rolled up in the same
+transaction, and a patient whose minutes are only partly counted is skipped
+rather than losing history. Deletion runs per patient and metric on the
+(user_id, metric_type, timestamp) index, in bounded chunks of whole minutes
+with one short transaction each, so the SQLite write lock is never held for
+long. Freed
+pages are returned to the OS with incremental_vacuum (on PostgreSQL, a plain
+VACUUM of health_metrics makes them reusable).
+
+Run once from the command line with: python retention.py
+"""
+import datetime
+import threading
+import time
+
+from sqlalchemy import select, text
+
+import models, rollups
+from config import settings
+from database import IS_SQLITE, engine
+
+health_metrics = models.HealthMetric.__table__
+
+class RetentionCompactor:
+    def __init__(self, retention_hours: float, interval: float, chunk_rows: int, vacuum_pages: int):
+        self.retention_hours = retention_hours
+        self.interval = interval
+        self.chunk_rows = chunk_rows
+        self.vacuum_pages = vacuum_pages
+
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_report = None
+
+    def start(self):
+        if self._thread is not None or not self.retention_hours:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="vitals-compactor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"❌ Vitals compaction failed: {e}")
+
+    def _page_stats(self, conn):
+        if not IS_SQLITE:
+            # PostgreSQL: size of health_metrics with its indexes, in bytes (free space is not exposed cheaply)
+            return 1, conn.execute(text("SELECT pg_total_relation_size('health_metrics')")).scalar(), 0
+        page_size = conn.execute(text("PRAGMA page_size")).scalar()
+        page_count = conn.execute(text("PRAGMA page_count")).scalar()
+        freelist = conn.execute(text("PRAGMA freelist_count")).scalar()
+        return page_size, page_count, freelist
+
+    def _vacuum(self):
+        if not IS_SQLITE:
+            # Plain VACUUM marks the deleted rows reusable and truncates empty pages at
+            # the end of the table without locking out readers or writers
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text("VACUUM health_metrics"))
+            return
+        # No-op unless the database uses auto_vacuum=INCREMENTAL (see migrate_db.py).
+        # executescript steps the pragma to completion; a plain execute frees a single page.
+        raw = engine.raw_connection()
+        try:
+            raw.driver_connection.executescript(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)});")
+        finally:
+            raw.close()
+
+    def _delete_chunk(self, user_id, metric_type, cutoff) -> int:
+        """Delete up to chunk_rows of the oldest aged readings. Returns -1 if they are not safely rolled up."""
+        where = (
+            health_metrics.c.user_id == user_id,
+            health_metrics.c.metric_type == metric_type,
+            health_metrics.c.timestamp < cutoff,
+        )
+        with engine.begin() as conn:
+            timestamps = conn.execute(
+                select(health_metrics.c.timestamp).where(*where)
+                .order_by(health_metrics.c.timestamp).limit(self.chunk_rows)
+            ).scalars().all()
+            if not timestamps:
+                return 0
+            # Whole minutes, so every minute checked here is deleted completely
+            end = min(cutoff, rollups.bucket_start(timestamps[-1], 60) + datetime.timedelta(minutes=1))
+            if not rollups.ensure_covered(conn, user_id, metric_type, timestamps[0], end):
+                print(f"⚠️ Vitals compaction skipped user {user_id} {metric_type.value}: rollups before {end:%Y-%m-%d %H:%M} are incomplete, raw readings kept (rollups.rebuild recounts them)")
+                return -1
+            return conn.execute(
+                health_metrics.delete().where(*where[:2], health_metrics.c.timestamp >= timestamps[0], health_metrics.c.timestamp < end)
+            ).rowcount
+
+    def run_once(self) -> dict:
+        """Delete raw readings older than the retention window and reclaim their pages."""
+        started = time.perf_counter()
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(hours=self.retention_hours)
+
+        with engine.connect() as conn:
+            user_ids = conn.execute(select(models.User.__table__.c.id)).scalars().all()
+            page_size, pages_before, _ = self._page_stats(conn)
+
+        deleted, chunks = 0, 0
+        for user_id in user_ids:
+            for metric_type in models.MetricType:
+                while not self._stop.is_set():
+                    removed = self._delete_chunk(user_id, metric_type, cutoff)
+                    if removed < 0:
+                        break
+                    deleted += removed
+                    chunks += 1
+                    if removed < self.chunk_rows:
+                        break
+                    # Let queued writers take the lock between chunks
+                    time.sleep(0.01)
+
+        self._vacuum()
+
+        with engine.connect() as conn:
+            _, pages_after, freelist_after = self._page_stats(conn)
+
+        self.last_report = {
+            "cutoff": cutoff.isoformat(),
+            "rows_deleted": deleted,
+            "chunks": chunks,
+            "bytes_reclaimed": max(pages_before - pages_after, 0) * page_size,
+            "free_bytes_remaining": freelist_after * page_size,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        print(
+            f"🧹 Vitals compaction: deleted {deleted} rows older than {cutoff:%Y-%m-%d %H:%M}, "
+            f"reclaimed {self.last_report['bytes_reclaimed']} bytes in {self.last_report['duration_ms']} ms"
+        )
+        return self.last_report
+
+compactor = RetentionCompactor(
+    retention_hours=settings.RAW_VITALS_RETENTION_HOURS,
+    interval=settings.COMPACTION_INTERVAL_SECONDS,
+    chunk_rows=settings.COMPACTION_CHUNK_ROWS,
+    vacuum_pages=settings.COMPACTION_VACUUM_PAGES,
+)
+
+if __name__ == "__main__":
+    compactor.run_once()
@@ -0,0 +1,206 @@
+"""
+Multi-resolution vitals rollups.
+
+Every ingested reading is folded into 1-minute, 1-hour and 1-day buckets
+holding min/max/sum/count/last per typed HealthMetric column, so history
+charts read a few hundred buckets instead of hundreds of thousands of raw rows.
+"""
+import datetime
+import re
+
+from sqlalchemy import case, select
+
+import models
+from config import settings
+from database import greatest, insert, least
+
+FIELDS = ("hr_bpm", "systolic", "diastolic", "steps")
+
+# Finest first
+RESOLUTIONS = [
+    ("1m", 60, models.VitalsRollupMinute),
+    ("1h", 3600, models.VitalsRollupHour),
+    ("1d", 86400, models.VitalsRollupDay),
+]
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+_DURATION_RE = re.compile(r"^(\d+(?:\.\d+)?)\s*([smhdw]?)$")
+_UNIT_SECONDS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+def parse_duration(text: str) -> float:
+    """'90', '30s', '5m', '24h', '7d' -> seconds. Raises ValueError, also past DURATION_MAX_SECONDS."""
+    match = _DURATION_RE.match(text.strip().lower())
+    if not match or float(match.group(1)) <= 0:
+        raise ValueError(f"Invalid duration: {text}")
+    seconds = float(match.group(1)) * _UNIT_SECONDS[match.group(2)]
+    # Also keeps now - duration inside datetime's range
+    if seconds > settings.DURATION_MAX_SECONDS:
+        raise ValueError(f"Duration too long: {text} (max {settings.DURATION_MAX_SECONDS / 86400:g}d)")
+    return seconds
+
+def bucket_start(ts: datetime.datetime, seconds: int) -> datetime.datetime:
+    elapsed = int((ts - EPOCH).total_seconds())
+    return EPOCH + datetime.timedelta(seconds=elapsed - elapsed % seconds)
+
+def pick_resolution(span_seconds: float, requested_seconds: float = None, max_points: int = 500):
+    """
+    Coarsest rollup whose bucket width still satisfies the requested width,
+    or the finest one when none was given, then coarsened until the span is
+    at most max_points buckets. None when even daily buckets are too many.
+    """
+    # A span can straddle one more bucket boundary than it is wide
+    fitting = [resolution for resolution in RESOLUTIONS if span_seconds // resolution[1] + 1 <= max_points]
+    if not fitting:
+        return None
+    chosen = fitting[0]
+    for resolution in fitting:
+        if requested_seconds and resolution[1] <= requested_seconds:
+            chosen = resolution
+    return chosen
+
+def _aggregate(rows, seconds: int) -> dict:
+    buckets = {}
+    for row in rows:
+        start = bucket_start(row["timestamp"], seconds)
+        for field in FIELDS:
+            value = row[field]
+            if value is None:
+                continue
+            key = (row["user_id"], field, start)
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = [value, value, value, 1, value, row["timestamp"]]
+                continue
+            if value < bucket[0]:
+                bucket[0] = value
+            if value > bucket[1]:
+                bucket[1] = value
+            bucket[2] += value
+            bucket[3] += 1
+            if row["timestamp"] >= bucket[5]:
+                bucket[4] = value
+                bucket[5] = row["timestamp"]
+    return buckets
+
+def _coarsen(buckets: dict, seconds: int) -> dict:
+    """Merge finer buckets into wider ones, so each raw row is only scanned once."""
+    merged = {}
+    for (user_id, field, start), b in buckets.items():
+        key = (user_id, field, bucket_start(start, seconds))
+        bucket = merged.get(key)
+        if bucket is None:
+            merged[key] = list(b)
+            continue
+        if b[0] < bucket[0]:
+            bucket[0] = b[0]
+        if b[1] > bucket[1]:
+            bucket[1] = b[1]
+        bucket[2] += b[2]
+        bucket[3] += b[3]
+        if b[5] >= bucket[5]:
+            bucket[4] = b[4]
+            bucket[5] = b[5]
+    return merged
+
+def _bucket_rows(buckets: dict) -> list:
+    return [
+        {
+            "user_id": user_id, "metric": field, "bucket_start": start,
+            "min_value": b[0], "max_value": b[1], "sum_value": b[2], "count": b[3],
+            "last_value": b[4], "last_ts": b[5],
+        }
+        for (user_id, field, start), b in buckets.items()
+    ]
+
+def _upsert(table):
+    stmt = insert(table)
+    new = stmt.excluded
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.metric, table.c.bucket_start],
+        set_={
+            "min_value": least(table.c.min_value, new.min_value),
+            "max_value": greatest(table.c.max_value, new.max_value),
+            "sum_value": table.c.sum_value + new.sum_value,
+            "count": table.c.count + new.count,
+            "last_value": case((new.last_ts >= table.c.last_ts, new.last_value), else_=table.c.last_value),
+            "last_ts": greatest(table.c.last_ts, new.last_ts),
+        },
+    )
+
+def apply(conn, rows: list):
+    """Fold ingested rows (see ingest.build_rows) into every rollup, inside the caller's transaction."""
+    if not rows:
+        return
+    buckets = None
+    for _, seconds, model in RESOLUTIONS:
+        buckets = _aggregate(rows, seconds) if buckets is None else _coarsen(buckets, seconds)
+        conn.execute(_upsert(model.__table__), _bucket_rows(buckets))
+
+def rebuild(conn, chunk_size: int = 10000) -> int:
+    """Recompute all rollups from raw health_metrics (used by migrate_db for existing data)."""
+    for _, _, model in RESOLUTIONS:
+        conn.execute(model.__table__.delete())
+
+    raw = models.HealthMetric.__table__
+    columns = [raw.c.id, raw.c.user_id, raw.c.timestamp] + [raw.c[field] for field in FIELDS]
+    last_id, total = 0, 0
+    while True:
+        chunk = conn.execute(
+            select(*columns).where(raw.c.id > last_id).order_by(raw.c.id).limit(chunk_size)
+        ).mappings().all()
+        if not chunk:
+            return total
+        apply(conn, [row for row in chunk if row["timestamp"] is not None])
+        last_id = chunk[-1]["id"]
+        total += len(chunk)
+
+def ensure_covered(conn, user_id: int, metric_type, start: datetime.datetime, end: datetime.datetime) -> bool:
+    """
+    Make sure the 1-minute rollups count every raw reading of one patient and
+    metric in [start, end), whole minutes, before those readings are deleted.
+    Minutes with no rollup at all (data older than the rollups) are rolled up
+    now. Returns False if a minute is only partly counted: which readings are
+    missing cannot be told apart, so the caller must not delete them.
+    """
+    start = bucket_start(start, 60)
+    raw = models.HealthMetric.__table__
+    rows = conn.execute(
+        select(raw.c.user_id, raw.c.timestamp, *[raw.c[field] for field in FIELDS])
+        .where(raw.c.user_id == user_id, raw.c.metric_type == metric_type, raw.c.timestamp >= start, raw.c.timestamp < end)
+    ).mappings().all()
+    expected = _aggregate(rows, 60)
+    rollup = models.VitalsRollupMinute.__table__
+    counted = {
+        (user_id, metric, bucket): count
+        for metric, bucket, count in conn.execute(
+            select(rollup.c.metric, rollup.c.bucket_start, rollup.c.count)
+            .where(rollup.c.user_id == user_id, rollup.c.bucket_start >= start, rollup.c.bucket_start < end)
+        )
+    }
+    missing = set()
+    for key, bucket in expected.items():
+        if key not in counted:
+            missing.add(key)
+        elif counted[key] < bucket[3]:
+            return False
+    if missing:
+        # Only the fields of the minutes that have no rollup yet
+        apply(conn, [
+            {**row, **{field: None for field in FIELDS if (user_id, field, bucket_start(row["timestamp"], 60)) not in missing}}
+            for row in rows
+        ])
+    return True
+
+def read_series(db, user_id: int, model, start: datetime.datetime, end: datetime.datetime) -> dict:
+    table = model.__table__
+    result = db.execute(
+        select(table.c.metric, table.c.bucket_start, table.c.min_value, table.c.max_value,
+               table.c.sum_value, table.c.count, table.c.last_value)
+        .where(table.c.user_id == user_id, table.c.bucket_start >= start, table.c.bucket_start <= end)
+        .order_by(table.c.metric, table.c.bucket_start)
+    )
+    series = {field: [] for field in FIELDS}
+    for metric, t, lo, hi, total, count, last in result:
+        series[metric].append({"t": t, "min": lo, "max": hi, "mean": total / count, "count": count, "last": last})
+    return series
@@ -0,0 +1,45 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+import models, schemas, dependencies, profiler
+from config import settings
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"]
+)
+
+def require_admin(current_user: models.User = Depends(dependencies.get_current_user)):
+    if current_user.phone not in settings.ADMIN_PHONES:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
+def _parse_route(request: Request, route: str) -> tuple:
+    """'POST /vitals/' -> ("POST", "/vitals/"), checked against the app's routes."""
+    method, _, path = route.strip().partition(" ")
+    method, path = method.upper(), path.strip()
+    if method.lower() not in request.app.openapi()["paths"].get(path, {}):
+        raise HTTPException(status_code=404, detail=f"No route '{route}' (expected 'METHOD /path', e.g. 'POST /vitals/')")
+    return method, path
+
+@router.post("/profile")
+def start_profile(profile: schemas.ProfileRequest, request: Request, current_user: models.User = Depends(require_admin)):
+    """Sample stacks for `seconds`, everywhere or only during 1 in `every` requests to `route`."""
+    if not 0 < profile.seconds <= settings.PROFILER_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {settings.PROFILER_MAX_SECONDS:g}")
+    if profile.every < 1:
+        raise HTTPException(status_code=400, detail="every must be at least 1")
+    method, path = _parse_route(request, profile.route) if profile.route else (None, None)
+    try:
+        profiler.profiler.start(profile.seconds, method=method, path=path, every=profile.every)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return profiler.profiler.status()
+
+@router.get("/profile")
+def get_profile(current_user: models.User = Depends(require_admin)):
+    return profiler.profiler.status()
+
+@router.delete("/profile")
+def stop_profile(current_user: models.User = Depends(require_admin)):
+    """End the running session early; the samples so far are written."""
+    profiler.profiler.stop()
+    return profiler.profiler.status()
@@ -1,9 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlalchemy.orm import Session
 from datetime import timedelta
 from typing import Optional
+import math
 
-import models, schemas, dependencies
+import models, schemas, dependencies, presence, otp_store
 from database import get_db
 from config import settings
 
@@ -12,18 +13,33 @@ router = APIRouter(
     tags=["auth"]
 )
 
-import random
-
-# Simple in-memory OTP cache for demonstration
-# In production, use Redis with expiration
-OTP_CACHE = {}
+def _verify_otp(phone: str, otp: str):
+    # Master OTP for testing
+    if otp == settings.OTP_MASTER_CODE:
+        return
+    # A correct code is consumed (replay protection)
+    if not otp_store.store.verify(phone, otp):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired OTP",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
 
 @router.post("/otp")
-def generate_otp(request: schemas.CheckUserRequest):
+def generate_otp(request: schemas.CheckUserRequest, http_request: Request):
     # Determine if user exists to tailor message (security trade-off: enumeration)
     # For this app, it's fine.
-    otp = "1234" # Hardcoded for Hackathon Stability (Resilient to restarts)
-    OTP_CACHE[request.phone] = otp
+    client_ip = http_request.client.host if http_request.client else "unknown"
+    for scope, key in (("ip", client_ip), ("phone", request.phone)):
+        retry_after = otp_store.store.limit(scope, key)
+        if retry_after:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many OTP requests. Please try again later.",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+    otp = settings.OTP_MASTER_CODE # Hardcoded for Hackathon Stability (Resilient to restarts)
+    otp_store.store.put(request.phone, otp)
     print(f"🔐 GENERATED OTP for {request.phone}: {otp}")
     return {"message": "OTP sent successfully"}
 
@@ -35,21 +51,7 @@ def check_user(request: schemas.CheckUserRequest, db: Session = Depends(get_db))
 @router.post("/login", response_model=schemas.Token)
 def login(request: schemas.LoginRequest, db: Session = Depends(get_db)):
     # 1. Verify OTP
-    stored_otp = OTP_CACHE.get(request.phone)
-    
-    # Master OTP for testing
-    if request.otp == "1234":
-        pass 
-    elif not stored_otp or request.otp != stored_otp:
-         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid or expired OTP",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    
-    # Clear OTP after use (replay protection) if it was a real one
-    if request.otp != "1234" and request.phone in OTP_CACHE:
-        del OTP_CACHE[request.phone]
+    _verify_otp(request.phone, request.otp)
     
     # 2. Check if user exists
     user = db.query(models.User).filter(models.User.phone == request.phone).first()
@@ -60,16 +62,17 @@ def login(request: schemas.LoginRequest, db: Session = Depends(get_db)):
             detail="User not found. Please register.",
         )
     
-    # Update last_active_at and set new session_id on login
-    import datetime
+    # Record activity and set new session_id on login
     import uuid
-    user.last_active_at = datetime.datetime.utcnow()
+    presence.tracker.touch(user.id)
     
     # Session Management: Single Device Login
     new_session_id = str(uuid.uuid4())
     user.session_id = new_session_id
     
     db.commit()
+    # Tokens carrying the previous session id must be re-checked against the DB
+    dependencies.user_cache.invalidate(user.phone)
         
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = dependencies.create_access_token(
@@ -81,20 +84,7 @@ def login(request: schemas.LoginRequest, db: Session = Depends(get_db)):
 @router.post("/register", response_model=schemas.Token)
 def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
     # Verify OTP
-    stored_otp = OTP_CACHE.get(user.phone)
-    
-    # Master OTP
-    if user.otp == "1234":
-        pass
-    elif not stored_otp or user.otp != stored_otp:
-         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid or expired OTP",
-        )
-    
-    # Clear OTP
-    if user.otp != "1234" and user.phone in OTP_CACHE:
-        del OTP_CACHE[user.phone]
+    _verify_otp(user.phone, user.otp)
 
     db_user = db.query(models.User).filter(models.User.phone == user.phone).first()
     if db_user:
@@ -0,0 +1,89 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from typing import List
+import math
+import models, schemas, dependencies, device_gateway
+from database import get_db
+from config import settings
+
+router = APIRouter(
+    prefix="/devices",
+    tags=["devices"]
+)
+
+def _with_status(device: models.Device) -> dict:
+    # Stored registration plus the gateway's live polling state
+    columns = {column.name: getattr(device, column.name) for column in models.Device.__table__.columns}
+    return {**columns, **device_gateway.gateway.status(device.id)}
+
+def _validate(kind: str, mode: str, interval: float):
+    if kind is not None and kind not in device_gateway.PARSERS:
+        raise HTTPException(status_code=400, detail=f"Unknown device kind '{kind}'")
+    if mode is not None and mode not in device_gateway.MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown device mode '{mode}'")
+    if interval is not None and not (math.isfinite(interval) and interval >= settings.GATEWAY_MIN_POLL_INTERVAL_SECONDS):
+        raise HTTPException(status_code=400, detail=f"poll_interval_seconds must be a finite number of at least {settings.GATEWAY_MIN_POLL_INTERVAL_SECONDS}")
+
+def _validate_url(url: str):
+    if url is None:
+        return
+    try:
+        device_gateway.resolve(url)
+    except device_gateway.BlockedURL as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/gateway/stats")
+def get_gateway_stats(current_user: models.User = Depends(dependencies.get_current_user)):
+    return device_gateway.gateway.stats()
+
+@router.get("/", response_model=List[schemas.Device])
+def get_devices(db: Session = Depends(get_db), current_user: models.User = Depends(dependencies.get_current_user)):
+    devices = db.query(models.Device).filter(models.Device.user_id == current_user.id).all()
+    return [_with_status(device) for device in devices]
+
+@router.post("/", response_model=schemas.Device)
+def register_device(device: schemas.DeviceCreate, db: Session = Depends(get_db), current_user: models.User = Depends(dependencies.get_current_user)):
+    """Register a wearable for the current patient; the gateway starts pulling from it immediately."""
+    _validate(device.kind, device.mode, device.poll_interval_seconds)
+    _validate_url(device.url)
+    # Registering the same URL again updates it, so clients can call this on every login
+    db_device = db.query(models.Device).filter(models.Device.user_id == current_user.id, models.Device.url == device.url).first()
+    if db_device:
+        for field, value in device.dict().items():
+            setattr(db_device, field, value)
+        db_device.enabled = True
+    else:
+        if db.query(models.Device).filter(models.Device.user_id == current_user.id).count() >= settings.GATEWAY_MAX_DEVICES_PER_USER:
+            raise HTTPException(status_code=409, detail=f"At most {settings.GATEWAY_MAX_DEVICES_PER_USER} devices per account")
+        db_device = models.Device(**device.dict(), user_id=current_user.id)
+        db.add(db_device)
+    db.commit()
+    db.refresh(db_device)
+    device_gateway.gateway.register(db_device)
+    return _with_status(db_device)
+
+@router.put("/{device_id}", response_model=schemas.Device)
+def update_device(device_id: int, device_update: schemas.DeviceUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(dependencies.get_current_user)):
+    db_device = db.query(models.Device).filter(models.Device.id == device_id, models.Device.user_id == current_user.id).first()
+    if not db_device:
+        raise HTTPException(status_code=404, detail="Device not found")
+    _validate(None, None, device_update.poll_interval_seconds)
+    _validate_url(device_update.url)
+
+    for field, value in device_update.dict(exclude_unset=True).items():
+        if value is not None:
+            setattr(db_device, field, value)
+    db.commit()
+    db.refresh(db_device)
+    device_gateway.gateway.register(db_device)
+    return _with_status(db_device)
+
+@router.delete("/{device_id}")
+def delete_device(device_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(dependencies.get_current_user)):
+    db_device = db.query(models.Device).filter(models.Device.id == device_id, models.Device.user_id == current_user.id).first()
+    if not db_device:
+        raise HTTPException(status_code=404, detail="Device not found")
+    db.delete(db_device)
+    db.commit()
+    device_gateway.gateway.unregister(device_id)
+    return {"message": "Device deleted"}
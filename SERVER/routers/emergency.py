@@ -1,11 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from database import get_db
-import models, schemas
-from typing import List
+from database import get_async_db
+import caretakers, models, schemas
+from typing import List, Optional
+import asyncio
 import datetime
 import json
-from dependencies import get_current_user
+from dependencies import get_current_user_async
 
 router = APIRouter(
     prefix="/emergency",
@@ -16,9 +19,11 @@ router = APIRouter(
 class ConnectionManager:
     def __init__(self):
         self.active_connections: List[WebSocket] = []
+        self.loop = None
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
+        self.loop = asyncio.get_running_loop()
         self.active_connections.append(websocket)
 
     def disconnect(self, websocket: WebSocket):
@@ -41,8 +46,86 @@ class ConnectionManager:
                 # Ideally self.disconnect(connection) but strictly removing from list while iterating is risky
                 pass
 
+    def broadcast_threadsafe(self, message: dict):
+        # For sync code running outside the event loop (threadpool routes, ingest listeners)
+        if self.loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.broadcast(message), self.loop)
+
 manager = ConnectionManager()
 
+STATUS_SEVERITY = {"normal": 0, "warning": 1, "alert": 2, "emergency": 3}
+
+def _user_fields(user: models.User, nominee_phone: Optional[str]) -> dict:
+    # Patient details shared by EMERGENCY_TRIGGER / STATUS_UPDATE broadcasts
+    return {
+        "user_id": user.id,
+        "user_name": user.fullname,
+        "user_phone": user.phone,
+        "blood_group": user.blood_group,
+        "address": user.address,
+        "health_issues": user.health_issues,
+        "nominee_phone": nominee_phone
+    }
+
+def user_payload(user: models.User) -> dict:
+    return _user_fields(user, user.nominees[0].phone if user.nominees else None)
+
+async def user_payload_async(db: AsyncSession, user: models.User) -> dict:
+    # Relationships cannot lazy-load on an AsyncSession, so the nominee is queried explicitly
+    nominee_phone = await db.scalar(
+        select(models.Nominee.phone).where(models.Nominee.user_id == user.id).order_by(models.Nominee.id).limit(1)
+    )
+    return _user_fields(user, nominee_phone)
+
+async def _get_status_entry(db: AsyncSession, user: models.User) -> models.PatientStatus:
+    status_entry = await db.scalar(select(models.PatientStatus).where(models.PatientStatus.user_id == user.id))
+    if not status_entry:
+        status_entry = models.PatientStatus(user_id=user.id, phone=user.phone)
+        db.add(status_entry)
+    return status_entry
+
+def escalate_status(db: Session, user: models.User, new_status: str, reason: str) -> List[dict]:
+    """
+    Raise a patient's status (never lowers it) on behalf of the server-side
+    vitals rules. Opens an EmergencyAlert for 'emergency'. Returns the
+    broadcast messages; the caller sends them after this commits.
+    """
+    status_entry = db.query(models.PatientStatus).filter(models.PatientStatus.user_id == user.id).first()
+    if not status_entry:
+        status_entry = models.PatientStatus(user_id=user.id, phone=user.phone, status="normal")
+        db.add(status_entry)
+    if STATUS_SEVERITY.get(new_status, 0) <= STATUS_SEVERITY.get(status_entry.status, 0):
+        return []
+
+    status_entry.status = new_status
+    status_entry.last_updated = datetime.datetime.utcnow()
+    user_data = {**user_payload(user), "reason": reason}
+    messages = [{
+        "type": "STATUS_UPDATE",
+        "user_id": user.id,
+        "status": new_status,
+        "data": {**user_data, "updated_at": status_entry.last_updated}
+    }]
+
+    if new_status == "emergency":
+        alert = db.query(models.EmergencyAlert).filter(
+            models.EmergencyAlert.user_id == user.id,
+            models.EmergencyAlert.is_active == True
+        ).first()
+        if not alert:
+            alert = models.EmergencyAlert(user_id=user.id, stage="vitals_rule", is_active=True, created_at=datetime.datetime.utcnow())
+            db.add(alert)
+            db.flush()
+        messages.append({
+            "type": "EMERGENCY_TRIGGER",
+            "alert_id": alert.id,
+            "data": {**user_data, "triggered_at": alert.created_at}
+        })
+
+    db.commit()
+    return messages
+
 @router.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
     await manager.connect(websocket)
@@ -53,24 +136,19 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
     except WebSocketDisconnect:
         manager.disconnect(websocket)
 
+# The routes below use an AsyncSession: a slow query or commit yields to the
+# event loop instead of freezing every open WebSocket
+
 @router.post("/trigger", response_model=dict)
-async def trigger_emergency(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def trigger_emergency(db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user_async)):
     # Check if already active
-    active = db.query(models.EmergencyAlert).filter(
+    active = await db.scalar(select(models.EmergencyAlert).where(
         models.EmergencyAlert.user_id == current_user.id,
         models.EmergencyAlert.is_active == True
-    ).first()
+    ).limit(1))
     
     # Enrich user data for broadcast
-    user_data = {
-        "user_id": current_user.id,
-        "user_name": current_user.fullname,
-        "user_phone": current_user.phone,
-        "blood_group": current_user.blood_group,
-        "address": current_user.address,
-        "health_issues": current_user.health_issues,
-        "nominee_phone": current_user.nominees[0].phone if current_user.nominees else None
-    }
+    user_data = await user_payload_async(db, current_user)
     
     if active:
         # Re-broadcast active alert in case caretaker missed it or just connected
@@ -89,8 +167,7 @@ async def trigger_emergency(db: Session = Depends(get_db), current_user: models.
     )
     
     db.add(new_alert)
-    db.commit()
-    db.refresh(new_alert)
+    await db.commit()
     
     # Broadcast to Websockets
     await manager.broadcast({
@@ -100,23 +177,20 @@ async def trigger_emergency(db: Session = Depends(get_db), current_user: models.
     })
     
     # Sync with PatientStatus
-    status_entry = db.query(models.PatientStatus).filter(models.PatientStatus.user_id == current_user.id).first()
-    if not status_entry:
-        status_entry = models.PatientStatus(user_id=current_user.id, phone=current_user.phone)
-        db.add(status_entry)
+    status_entry = await _get_status_entry(db, current_user)
     
     # Triggering via API usually implies immediate emergency or at least alert
     status_entry.status = "emergency" # Default fall through
     status_entry.last_updated = datetime.datetime.utcnow()
-    db.commit()
+    await db.commit()
     
     return {"status": "triggered", "alert_id": new_alert.id}
 
 @router.post("/status", response_model=dict)
 async def update_patient_status(
     status_data: dict, 
-    db: Session = Depends(get_db), 
-    current_user: models.User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db), 
+    current_user: models.User = Depends(get_current_user_async)
 ):
     """
     Update patient status: normal, warning, alert, emergency
@@ -125,10 +199,7 @@ async def update_patient_status(
     if new_status not in ["normal", "warning", "alert", "emergency"]:
         raise HTTPException(status_code=400, detail="Invalid status")
 
-    status_entry = db.query(models.PatientStatus).filter(models.PatientStatus.user_id == current_user.id).first()
-    if not status_entry:
-        status_entry = models.PatientStatus(user_id=current_user.id, phone=current_user.phone)
-        db.add(status_entry)
+    status_entry = await _get_status_entry(db, current_user)
     
     status_entry.status = new_status
     status_entry.last_updated = datetime.datetime.utcnow()
@@ -137,100 +208,72 @@ async def update_patient_status(
     # Or just rely on status?
     # The requirement says "change state to emergency" when call now is pressed.
     
-    db.commit()
+    await db.commit()
 
     # Broadcast status change
     await manager.broadcast({
         "type": "STATUS_UPDATE",
         "user_id": current_user.id,
         "status": new_status,
-        "data": {
-            "user_name": current_user.fullname,
-            "user_phone": current_user.phone,
-            "blood_group": current_user.blood_group,
-            "address": current_user.address,
-            "health_issues": current_user.health_issues,
-            "nominee_phone": current_user.nominees[0].phone if current_user.nominees else None,
-            "updated_at": status_entry.last_updated
-        }
+        "data": {**await user_payload_async(db, current_user), "updated_at": status_entry.last_updated}
     })
 
     return {"status": "updated", "current_status": new_status}
 
 @router.get("/active", response_model=List[dict])
-def get_active_alerts(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def get_active_alerts(db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user_async)):
     # If user is caretaker, return alerts ONLY for patients who have listed this caretaker as nominee
     # Return both EmergencyAlerts AND high-priority statuses
     
     if current_user.role != "caretaker":
         return []
     
-    # Get patients who have listed this caretaker (by phone) as a nominee
-    # Same logic as /users/patients endpoint
-    my_patients = db.query(models.User).join(models.Nominee).filter(
-        models.Nominee.phone == current_user.phone
-    ).distinct().all()
-    
-    my_patient_ids = [p.id for p in my_patients]
-    
-    if not my_patient_ids:
-        return []  # No assigned patients, no alerts
-    
-    # Get active alerts (legacy/compatibility) - ONLY for my patients
-    alerts = db.query(models.EmergencyAlert).filter(
-        models.EmergencyAlert.is_active == True,
-        models.EmergencyAlert.user_id.in_(my_patient_ids)
-    ).all()
-    
-    # Get critical statuses - ONLY for my patients
-    critical_statuses = db.query(models.PatientStatus).filter(
-        models.PatientStatus.status.in_(["emergency", "alert"]),
-        models.PatientStatus.user_id.in_(my_patient_ids)
-    ).all()
+    # One query for the caretaker's patients (same links as /users/patients), each row one entry:
+    # a critical status, or else each active alert (legacy/compatibility) of that patient
+    critical = models.PatientStatus.status.in_(["emergency", "alert"])
+    nominee_phone = (
+        select(models.Nominee.phone)
+        .where(models.Nominee.user_id == models.User.id)
+        .order_by(models.Nominee.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    rows = (await db.execute(
+        select(models.User, models.PatientStatus, models.EmergencyAlert, nominee_phone)
+        .outerjoin(models.PatientStatus, and_(models.PatientStatus.user_id == models.User.id, critical))
+        # Alerts only for patients not already covered by a critical status
+        .outerjoin(models.EmergencyAlert, and_(
+            models.EmergencyAlert.user_id == models.User.id,
+            models.EmergencyAlert.is_active == True,
+            models.PatientStatus.id.is_(None),
+        ))
+        .where(
+            models.User.id.in_(caretakers.patient_ids(current_user.phone)),
+            or_(models.PatientStatus.id.isnot(None), models.EmergencyAlert.id.isnot(None)),
+        )
+        # Statuses first, then alerts
+        .order_by(models.PatientStatus.id.is_(None), models.PatientStatus.id, models.EmergencyAlert.id)
+    )).all()
     
     result = []
-    seen_users = set()
-    
-    # Merge logic
-    for status in critical_statuses:
-        user = db.query(models.User).filter(models.User.id == status.user_id).first()
-        if user:
-            seen_users.add(user.id)
-            result.append({
-                "id": status.id, # Using status ID as alert ID for UI compatibility
-                "user_id": user.id,
-                "user_name": user.fullname,
-                "user_phone": user.phone,
-                "blood_group": user.blood_group,
-                "address": user.address,
-                "health_issues": user.health_issues,
-                "triggered_at": status.last_updated,
-                "nominee_phone": user.nominees[0].phone if user.nominees else None,
-                "status": status.status
-            })
-            
-    # Add legacy alerts if not already covered
-    for alert in alerts:
-        if alert.user_id not in seen_users:
-            user = db.query(models.User).filter(models.User.id == alert.user_id).first()
-            if user:
-                result.append({
-                    "id": alert.id,
-                    "user_id": user.id,
-                    "user_name": user.fullname,
-                    "user_phone": user.phone,
-                    "blood_group": user.blood_group,
-                    "address": user.address,
-                    "health_issues": user.health_issues,
-                    "triggered_at": alert.created_at,
-                    "nominee_phone": user.nominees[0].phone if user.nominees else None,
-                    "status": "emergency" # Default for old alerts
-                })
+    for user, status, alert, phone in rows:
+        result.append({
+            "id": status.id if status else alert.id, # Using status ID as alert ID for UI compatibility
+            "user_id": user.id,
+            "user_name": user.fullname,
+            "user_phone": user.phone,
+            "blood_group": user.blood_group,
+            "address": user.address,
+            "health_issues": user.health_issues,
+            "triggered_at": status.last_updated if status else alert.created_at,
+            "nominee_phone": phone,
+            "status": status.status if status else "emergency" # Default for old alerts
+        })
             
     return result
 
 @router.post("/resolve/{alert_id}")
-def resolve_emergency(alert_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def resolve_emergency(alert_id: int, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user_async)):
     # ... resolution logic ...
     # Also resolve patient status to normal
     
@@ -245,7 +288,7 @@ def resolve_emergency(alert_id: int, db: Session = Depends(get_db), current_user
     # For now, let's assume we are resolving the status for the user associated with this alert.
     
     # If checking EmergencyAlert table
-    alert = db.query(models.EmergencyAlert).filter(models.EmergencyAlert.id == alert_id).first()
+    alert = await db.get(models.EmergencyAlert, alert_id)
     target_user_id = None
     
     if alert:
@@ -254,7 +297,7 @@ def resolve_emergency(alert_id: int, db: Session = Depends(get_db), current_user
         alert.resolved_at = datetime.datetime.utcnow()
     else:
         # Check status table
-        status = db.query(models.PatientStatus).filter(models.PatientStatus.id == alert_id).first()
+        status = await db.get(models.PatientStatus, alert_id)
         if status:
             target_user_id = status.user_id
             status.status = "normal"
@@ -262,11 +305,10 @@ def resolve_emergency(alert_id: int, db: Session = Depends(get_db), current_user
     
     if target_user_id:
         # Ensure status is normal
-        p_status = db.query(models.PatientStatus).filter(models.PatientStatus.user_id == target_user_id).first()
+        p_status = await db.scalar(select(models.PatientStatus).where(models.PatientStatus.user_id == target_user_id))
         if p_status:
             p_status.status = "normal"
-            db.commit()
             
-    db.commit()
+    await db.commit()
     
     return {"status": "resolved"}
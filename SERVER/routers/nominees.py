@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from typing import List
-import models, schemas, dependencies
+import caretakers, models, schemas, dependencies
 from database import get_db
 
 router = APIRouter(
@@ -17,6 +17,7 @@ def get_nominees(db: Session = Depends(get_db), current_user: models.User = Depe
 def create_nominee(nominee: schemas.NomineeCreate, db: Session = Depends(get_db), current_user: models.User = Depends(dependencies.get_current_user)):
     db_nominee = models.Nominee(**nominee.dict(), user_id=current_user.id)
     db.add(db_nominee)
+    caretakers.sync_patient(db, current_user.id)
     db.commit()
     db.refresh(db_nominee)
     return db_nominee
@@ -33,6 +34,7 @@ def update_nominee(nominee_id: int, nominee_update: schemas.NomineeUpdate, db: S
         db_nominee.relationship = nominee_update.relationship
     if nominee_update.phone is not None:
         db_nominee.phone = nominee_update.phone
+        caretakers.sync_patient(db, db_nominee.user_id)
         
     db.commit()
     db.refresh(db_nominee)
@@ -44,6 +46,7 @@ def delete_nominee(nominee_id: int, db: Session = Depends(get_db), current_user:
     if not db_nominee:
         raise HTTPException(status_code=404, detail="Nominee not found")
     db.delete(db_nominee)
+    caretakers.sync_patient(db, db_nominee.user_id)
     db.commit()
     return {"message": "Nominee deleted"}
 
@@ -59,6 +62,7 @@ def get_user_nominees(user_id: int, db: Session = Depends(get_db), current_user:
 def create_user_nominee(user_id: int, nominee: schemas.NomineeCreate, db: Session = Depends(get_db), current_user: models.User = Depends(dependencies.get_current_user)):
     db_nominee = models.Nominee(**nominee.dict(), user_id=user_id)
     db.add(db_nominee)
+    caretakers.sync_patient(db, user_id)
     db.commit()
     db.refresh(db_nominee)
     return db_nominee
@@ -75,6 +79,7 @@ def update_user_nominee(user_id: int, nominee_id: int, nominee_update: schemas.N
         db_nominee.relationship = nominee_update.relationship
     if nominee_update.phone is not None:
         db_nominee.phone = nominee_update.phone
+        caretakers.sync_patient(db, db_nominee.user_id)
         
     db.commit()
     db.refresh(db_nominee)
@@ -86,5 +91,6 @@ def delete_user_nominee(user_id: int, nominee_id: int, db: Session = Depends(get
     if not db_nominee:
         raise HTTPException(status_code=404, detail="Nominee not found")
     db.delete(db_nominee)
+    caretakers.sync_patient(db, db_nominee.user_id)
     db.commit()
     return {"message": "Nominee deleted"}
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-import models, schemas, dependencies
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+import caretakers, models, schemas, dependencies, presence
 from database import get_db
 
 router = APIRouter(
@@ -12,6 +13,10 @@ router = APIRouter(
 def read_users_me(current_user: models.User = Depends(dependencies.get_current_user)):
     return current_user
 
+@router.get("/cache/stats")
+def get_user_cache_stats(current_user: models.User = Depends(dependencies.get_current_user)):
+    return dependencies.user_cache.stats()
+
 @router.put("/me", response_model=schemas.User)
 def update_user_me(user_update: schemas.UserUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(dependencies.get_current_user)):
     # Update fields if provided
@@ -29,6 +34,7 @@ def update_user_me(user_update: schemas.UserUpdate, db: Session = Depends(get_db
         current_user.role = user_update.role
     
     db.commit()
+    dependencies.user_cache.invalidate(current_user.phone)
     db.refresh(current_user)
     return current_user
 
@@ -39,19 +45,25 @@ def get_my_patients(db: Session = Depends(get_db), current_user: models.User = D
     # Return patients who have listed this user (by phone) as a nominee
     # Check if current user is a caretaker? (Optional, but good practice)
     
-    # Query: Users joined with Nominees where Nominee.phone == current_user.phone
-    patients = db.query(models.User).join(models.Nominee).filter(models.Nominee.phone == current_user.phone).distinct().all()
+    # Links maintained from the nominees (see caretakers.py)
+    # Status joined in: lazy-loading it per patient below was an N+1
+    patients = (
+        db.query(models.User)
+        .options(joinedload(models.User.patient_status))
+        .filter(models.User.id.in_(caretakers.patient_ids(current_user.phone)))
+        .all()
+    )
     
-    # Enrich with status
+    # Enrich with status and live presence
     for p in patients:
         p.status = p.patient_status.status if p.patient_status else "normal"
+        # Not a change to persist: keep it out of the session's autoflush
+        set_committed_value(p, "last_active_at", presence.tracker.last_seen(p.id, p.last_active_at))
         
     return patients
 
 @router.post("/logout")
 def logout_user(db: Session = Depends(get_db), current_user: models.User = Depends(dependencies.get_current_user)):
-    # Force user to be "offline" by setting last_active_at to past
-    import datetime
-    current_user.last_active_at = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
-    db.commit()
+    # Force user to be "offline" (written to last_active_at by the presence flush)
+    presence.tracker.mark_offline(current_user.id)
     return {"message": "Logged out successfully"}
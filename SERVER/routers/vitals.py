@@ -1,40 +1,545 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from sqlalchemy import func, select
+from sqlalchemy.exc import SQLAlchemyError
+from starlette.requests import ClientDisconnect
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
-import models, schemas, dependencies
-from database import get_db
+from typing import List, Optional
+from collections import OrderedDict
+import asyncio
+import base64
+import datetime
+import json
+import math
+import time
+import uuid
+import models, schemas, dependencies, caretakers, ingest, presence, rollups, vitals_cache, vitals_stats
+from database import AsyncSessionLocal, get_async_db, get_db, engine, epoch_seconds, floor_int
+from config import settings
+
+try:
+    import msgpack
+except ImportError: # optional: only needed for application/msgpack uploads
+    msgpack = None
 
 router = APIRouter(
     prefix="/vitals",
     tags=["vitals"]
 )
 
-@router.post("/", response_model=List[schemas.HealthMetric])
+def _reading(row: dict) -> dict:
+    reading = {"metric_type": row["metric_type"].value, "timestamp": row["timestamp"].isoformat()}
+    for field in rollups.FIELDS:
+        if row[field] is not None:
+            reading[field] = row[field]
+    return reading
+
+class VitalsSubscriber:
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.patient_ids = set()
+        self.interval = 0.0 # 0 = every batch, otherwise at most one frame per interval seconds
+        self.outbox = asyncio.Queue(maxsize=100)
+        self.pending = {} # patient_id -> {metric_type: latest reading} while downsampling
+        self.flush_handle = None
+        self.sender = None
+
+# Live vitals push: caretakers subscribe to patient ids and receive each ingested batch
+class VitalsStreamManager:
+    def __init__(self):
+        self.subscribers: List[VitalsSubscriber] = []
+        self.by_patient = {}
+        self.loop = None
+
+    async def connect(self, websocket: WebSocket) -> VitalsSubscriber:
+        await websocket.accept()
+        self.loop = asyncio.get_running_loop()
+        subscriber = VitalsSubscriber(websocket)
+        subscriber.sender = asyncio.create_task(self._send_loop(subscriber))
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def disconnect(self, subscriber: VitalsSubscriber):
+        self.unsubscribe(subscriber, list(subscriber.patient_ids))
+        if subscriber.flush_handle:
+            subscriber.flush_handle.cancel()
+        subscriber.sender.cancel()
+        self.subscribers.remove(subscriber)
+
+    def subscribe(self, subscriber: VitalsSubscriber, patient_ids):
+        for patient_id in patient_ids:
+            subscriber.patient_ids.add(patient_id)
+            self.by_patient.setdefault(patient_id, set()).add(subscriber)
+
+    def unsubscribe(self, subscriber: VitalsSubscriber, patient_ids):
+        for patient_id in patient_ids:
+            subscriber.patient_ids.discard(patient_id)
+            subscriber.pending.pop(patient_id, None)
+            watchers = self.by_patient.get(patient_id)
+            if watchers is not None:
+                watchers.discard(subscriber)
+                if not watchers:
+                    del self.by_patient[patient_id]
+
+    def publish(self, user_id: int, rows: list):
+        # Called from request threads; hand off to the event loop
+        if self.loop is None or user_id not in self.by_patient:
+            return
+        readings = [_reading(row) for row in rows]
+        self.loop.call_soon_threadsafe(self._dispatch, user_id, readings)
+
+    def _dispatch(self, user_id: int, readings: list):
+        for subscriber in list(self.by_patient.get(user_id, ())):
+            if subscriber.interval <= 0:
+                self._enqueue(subscriber, {"type": "VITALS", "user_id": user_id, "readings": readings})
+                continue
+            latest = subscriber.pending.setdefault(user_id, {})
+            for reading in readings:
+                latest[reading["metric_type"]] = reading
+            if subscriber.flush_handle is None:
+                subscriber.flush_handle = self.loop.call_later(subscriber.interval, self._flush_pending, subscriber)
+
+    def _flush_pending(self, subscriber: VitalsSubscriber):
+        subscriber.flush_handle = None
+        pending, subscriber.pending = subscriber.pending, {}
+        for user_id, latest in pending.items():
+            self._enqueue(subscriber, {"type": "VITALS", "user_id": user_id, "readings": list(latest.values())})
+
+    def _enqueue(self, subscriber: VitalsSubscriber, frame: dict):
+        if subscriber.outbox.full():
+            # Slow client: drop the oldest frame rather than buffering without bound
+            subscriber.outbox.get_nowait()
+        subscriber.outbox.put_nowait(frame)
+
+    async def _send_loop(self, subscriber: VitalsSubscriber):
+        while True:
+            frame = await subscriber.outbox.get()
+            try:
+                await subscriber.websocket.send_text(json.dumps(frame))
+            except Exception:
+                return
+
+stream = VitalsStreamManager()
+ingest.add_listener(stream.publish)
+
+@router.websocket("/ws")
+async def vitals_stream(websocket: WebSocket, token: str):
+    """
+    Live vitals for caretakers. Connect with ?token=<access token>, then send
+    {"action": "subscribe", "patient_ids": [1, 2], "interval": 5}
+    ("interval" is optional: seconds between downsampled frames, 0 = every batch)
+    or {"action": "unsubscribe", "patient_ids": [1]}. Only the caller's own id
+    and their patients' ids can be subscribed to.
+    """
+    try:
+        async with AsyncSessionLocal() as db:
+            user = await dependencies.get_user_from_token_async(token, db)
+            user_id, phone = user.id, user.phone
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    subscriber = await stream.connect(websocket)
+    try:
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+                patient_ids = [int(pid) for pid in message.get("patient_ids", [])]
+                interval = float(message.get("interval", subscriber.interval))
+                if not math.isfinite(interval):
+                    raise ValueError(interval)
+                interval = max(interval, 0.0)
+            except (ValueError, TypeError, AttributeError):
+                await websocket.send_json({"type": "ERROR", "detail": "Invalid subscription message"})
+                continue
+            if message.get("action") == "unsubscribe":
+                stream.unsubscribe(subscriber, patient_ids)
+            else:
+                # Only the user's own readings and their patients' (read per message: links change)
+                async with AsyncSessionLocal() as db:
+                    allowed = set(await db.scalars(caretakers.patient_ids(phone))) | {user_id}
+                forbidden = sorted(set(patient_ids) - allowed)
+                if forbidden:
+                    await websocket.send_json({"type": "ERROR", "detail": "Not a patient of yours", "patient_ids": forbidden})
+                    continue
+                stream.subscribe(subscriber, patient_ids)
+            subscriber.interval = interval
+            await websocket.send_json({
+                "type": "SUBSCRIBED",
+                "patient_ids": sorted(subscriber.patient_ids),
+                "interval": subscriber.interval,
+            })
+    except WebSocketDisconnect:
+        pass
+    finally:
+        stream.disconnect(subscriber)
+
+@router.post("/", response_model=List[schemas.HealthMetric], responses={202: {"description": 'VITALS_INGEST_MODE=queue: {"status": "queued", "count", "duplicates"}'}})
 def create_health_metrics(metrics: List[schemas.HealthMetricCreate], db: Session = Depends(get_db), current_user: models.User = Depends(dependencies.get_current_user)):
-    saved_metrics = []
-    for metric in metrics:
-        db_metric = models.HealthMetric(**metric.dict(), user_id=current_user.id)
-        db.add(db_metric)
-        saved_metrics.append(db_metric)
-    
-    import datetime
-    current_user.last_active_at = datetime.datetime.utcnow()
-    db.add(current_user)
-    
+    try:
+        rows = ingest.build_rows(current_user.id, metrics)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid vitals reading: {e}")
+
+    # Retried batches are answered from memory; the unique index catches the rest
+    received = len(rows)
+    rows = ingest.recent.fresh(rows)
+
+    if settings.VITALS_INGEST_MODE == "queue":
+        # Write-behind: the background writer group-commits all pending batches
+        if rows and not ingest.queue.submit(rows):
+            raise HTTPException(status_code=503, detail="Vitals ingest queue is full", headers={"Retry-After": "1"})
+        # The writer remembers the keys once they are committed
+        presence.tracker.touch(current_user.id)
+        ingest.publish(current_user.id, rows)
+        return JSONResponse(status_code=202, content={"status": "queued", "count": len(rows), "duplicates": received - len(rows)})
+
+    inserted = ingest.write_rows(db, rows)
     db.commit()
-    for metric in saved_metrics:
-        db.refresh(metric)
-        
-    return saved_metrics
+    presence.tracker.touch(current_user.id)
+    rows = [row for _, row in inserted]
+    ingest.recent.remember(rows)
+    ingest.publish(current_user.id, rows)
 
-@router.get("/", response_model=List[schemas.HealthMetric])
-def get_health_metrics(limit: int = 100, db: Session = Depends(get_db), current_user: models.User = Depends(dependencies.get_current_user)):
-    metrics = db.query(models.HealthMetric).filter(models.HealthMetric.user_id == current_user.id).order_by(models.HealthMetric.timestamp.desc()).limit(limit).all()
+    # Only newly stored readings are returned; duplicates were already stored earlier
+    return [models.HealthMetric(id=row_id, **row) for row_id, row in inserted]
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(f"v1:{last_id}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        version, last_id = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split(":")
+        if version != "v1":
+            raise ValueError(version)
+        return int(last_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def query_metrics(db: AsyncSession, user_id: int, limit: int, since: Optional[str], response: Response):
+    """
+    Newest readings for a patient. With ?since=<cursor>, rows stored after
+    that cursor in storage order (oldest first), at most `limit` of them;
+    the next cursor is the last row returned, so a backlog larger than the
+    limit arrives over the following polls instead of being skipped. The
+    next cursor goes in X-Vitals-Cursor and X-Vitals-Changed says whether
+    anything new arrived.
+    """
+    query = select(models.HealthMetric).where(models.HealthMetric.user_id == user_id)
+    last_id = 0
+    if since:
+        last_id = decode_cursor(since)
+        query = query.where(models.HealthMetric.id > last_id).order_by(models.HealthMetric.id)
+    else:
+        query = query.order_by(models.HealthMetric.timestamp.desc())
+    metrics = (await db.scalars(query.limit(limit))).all()
+
+    if metrics:
+        last_id = metrics[-1].id if since else max(m.id for m in metrics)
+    response.headers["X-Vitals-Cursor"] = encode_cursor(last_id)
+    response.headers["X-Vitals-Changed"] = "true" if metrics else "false"
     return metrics
 
+BULK_NDJSON_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines"}
+BULK_MSGPACK_TYPES = {"application/msgpack", "application/x-msgpack", "application/vnd.msgpack"}
+
+# (user_id, upload_id) -> records committed so far, so interrupted uploads can resume
+bulk_progress = OrderedDict()
+
+async def _iter_bulk_records(request: Request, content_type: str):
+    """
+    Yield decoded records as the body streams in; only a partial record is
+    ever buffered (NDJSON lines up to BULK_MAX_LINE_BYTES).
+    """
+    if content_type in BULK_MSGPACK_TYPES:
+        unpacker = msgpack.Unpacker(raw=False)
+        async for chunk in request.stream():
+            unpacker.feed(chunk)
+            for record in unpacker:
+                yield record
+        return
+
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if len(line) > settings.BULK_MAX_LINE_BYTES:
+                raise ValueError(f"line longer than {settings.BULK_MAX_LINE_BYTES} bytes")
+            if line.strip():
+                yield json.loads(line)
+        if len(buffer) > settings.BULK_MAX_LINE_BYTES:
+            raise ValueError(f"line longer than {settings.BULK_MAX_LINE_BYTES} bytes")
+    if buffer.strip():
+        yield json.loads(buffer)
+
+def _write_bulk_chunk(rows: list) -> int:
+    with engine.begin() as conn:
+        return len(ingest.write_rows(conn, rows))
+
+def _record_progress(user_id: int, upload_id: str, committed: int):
+    key = (user_id, upload_id)
+    bulk_progress[key] = committed
+    bulk_progress.move_to_end(key)
+    while len(bulk_progress) > settings.BULK_MAX_TRACKED_UPLOADS:
+        bulk_progress.popitem(last=False)
+
+@router.post("/bulk")
+async def bulk_ingest_health_metrics(
+    request: Request,
+    upload_id: Optional[str] = None,
+    offset: int = 0,
+    current_user: models.User = Depends(dependencies.get_current_user)
+):
+    """
+    Backfill endpoint for devices that were offline. The body is a stream of
+    {"metric_type", "value", "unit", "timestamp"} records as NDJSON
+    (application/x-ndjson) or MessagePack (application/msgpack); timestamp is
+    ISO 8601 or epoch seconds.
+
+    Records are parsed incrementally and validated and committed in chunks of
+    BULK_CHUNK_ROWS with Core executemany; every committed chunk is acknowledged
+    with how many of its readings were already stored (and so skipped).
+    To resume an interrupted upload, pass the same ?upload_id=: records already
+    committed are skipped (?offset= says which record the body starts at when
+    only the remainder is re-sent). GET /vitals/bulk/{upload_id} returns progress.
+    Chunks committed before a database error (503) or a dropped connection
+    are recorded too, so those uploads resume from where they stopped.
+
+    Backfilled readings update rollups but do not go through live listeners
+    (streaming, rules), since they describe the past.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in BULK_MSGPACK_TYPES and msgpack is None:
+        raise HTTPException(status_code=415, detail="MessagePack support is not installed (pip install msgpack)")
+    if content_type not in BULK_NDJSON_TYPES | BULK_MSGPACK_TYPES:
+        raise HTTPException(status_code=415, detail="Send application/x-ndjson or application/msgpack")
+
+    upload_id = upload_id or uuid.uuid4().hex
+    already_committed = bulk_progress.get((current_user.id, upload_id), 0)
+    started = time.perf_counter()
+
+    acks = []
+    rows = []
+    position = offset
+    chunk_start = None
+    pending_write = None
+
+    async def finish_pending():
+        # Acknowledge the previous chunk once its transaction has committed
+        nonlocal pending_write
+        if pending_write is None:
+            return
+        task, ack = pending_write
+        pending_write = None
+        ack["duplicates"] = ack["rows"] - await task
+        acks.append(ack)
+        _record_progress(current_user.id, upload_id, ack["end"])
+
+    def error_response(status_code: int, detail: str):
+        return JSONResponse(status_code=status_code, content={
+            "detail": detail,
+            "upload_id": upload_id,
+            "committed": acks[-1]["end"] if acks else max(already_committed, offset),
+            "chunks": acks,
+        })
+
+    def start_write():
+        nonlocal pending_write, rows, chunk_start
+        ack = {"chunk": len(acks), "start": chunk_start, "end": position, "rows": len(rows)}
+        pending_write = (asyncio.ensure_future(run_in_threadpool(_write_bulk_chunk, rows)), ack)
+        rows, chunk_start = [], None
+
+    try:
+        try:
+            async for record in _iter_bulk_records(request, content_type):
+                position += 1
+                if position <= already_committed:
+                    continue
+                try:
+                    rows.append(ingest.build_row(current_user.id, record["metric_type"], record["value"], record.get("unit", ""), record["timestamp"]))
+                except (KeyError, TypeError, ValueError) as e:
+                    await finish_pending()
+                    return error_response(422, f"Invalid record {position - 1}: {e!r}")
+                if chunk_start is None:
+                    chunk_start = position - 1
+
+                if len(rows) >= settings.BULK_CHUNK_ROWS:
+                    await finish_pending()
+                    # Parse the next chunk while this one is written
+                    start_write()
+
+            await finish_pending()
+            if rows:
+                start_write()
+                await finish_pending()
+        except ValueError as e: # JSON and MessagePack decode errors
+            await finish_pending()
+            return error_response(400, f"Malformed stream after record {position}: {e}")
+        except ClientDisconnect:
+            # No one to answer, but the chunk being written may still commit: record it so a resume skips it
+            await finish_pending()
+            raise
+    except SQLAlchemyError as e:
+        # Chunks committed before the failure are recorded; the client resumes from "committed"
+        print(f"❌ Bulk upload {upload_id} failed after record {position}: {e}")
+        return error_response(503, "Database error, resume the upload with the same upload_id")
+
+    elapsed = time.perf_counter() - started
+    written = sum(ack["rows"] for ack in acks)
+    return {
+        "upload_id": upload_id,
+        "committed": max(position, already_committed),
+        "rows": written,
+        "duplicates": sum(ack["duplicates"] for ack in acks),
+        "chunks": acks,
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "rows_per_second": round(written / elapsed) if elapsed > 0 else None,
+    }
+
+@router.get("/bulk/{upload_id}")
+def get_bulk_progress(upload_id: str, current_user: models.User = Depends(dependencies.get_current_user)):
+    committed = bulk_progress.get((current_user.id, upload_id))
+    if committed is None:
+        raise HTTPException(status_code=404, detail="Unknown upload")
+    return {"upload_id": upload_id, "committed": committed}
+
+@router.get("/cache/stats")
+def get_vitals_cache_stats(current_user: models.User = Depends(dependencies.get_current_user)):
+    return vitals_cache.cache.stats()
+
+# Plain reads run on the async engine; ingest, the in-memory cache and the
+# NumPy stats stay on the threadpool (their work is CPU, not waiting on I/O)
+
+@router.get("/", response_model=List[schemas.HealthMetric])
+async def get_health_metrics(response: Response, limit: int = 100, since: Optional[str] = None, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(dependencies.get_current_user_async)):
+    return await query_metrics(db, current_user.id, limit, since, response)
+
 @router.get("/{user_id}", response_model=List[schemas.HealthMetric])
-def get_user_health_metrics(user_id: int, limit: int = 50, db: Session = Depends(get_db), current_user: models.User = Depends(dependencies.get_current_user)):
-    # In a real app, check if current_user is allowed to view user_id's data (e.g. is caretaker)
-    # For now, allow it.
-    metrics = db.query(models.HealthMetric).filter(models.HealthMetric.user_id == user_id).order_by(models.HealthMetric.timestamp.desc()).limit(limit).all()
-    return metrics
+async def get_user_health_metrics(user_id: int, response: Response, limit: int = 50, since: Optional[str] = None, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(dependencies.require_patient_access_async)):
+    return await query_metrics(db, user_id, limit, since, response)
+
+@router.get("/{user_id}/latest", response_model=schemas.VitalsLatest)
+def get_user_latest_vitals(user_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(dependencies.require_patient_access)):
+    """Current value per metric type for the dashboard tiles, served from the in-memory cache."""
+    readings = {}
+    for metric_type, row in vitals_cache.cache.latest(db, user_id).items():
+        reading = models.HealthMetric(**row)
+        readings[metric_type] = {**row, "metric_type": metric_type, "value": reading.value}
+    return {"user_id": user_id, "readings": readings}
+
+@router.get("/{user_id}/stats", response_model=schemas.VitalsStats)
+def get_user_vitals_stats(
+    user_id: int,
+    window: str = "24h",
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(dependencies.require_patient_access)
+):
+    """
+    Mean, median, p5/p95, std, min/max per vital over the last `window`, plus
+    heart-rate variability (RMSSD), pulse pressure and step rate.
+    """
+    try:
+        window_seconds = rollups.parse_duration(window)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    end = datetime.datetime.utcnow()
+    start = end - datetime.timedelta(seconds=window_seconds)
+    return {"user_id": user_id, "start": start, "end": end, **vitals_stats.compute(db, user_id, start, end)}
+
+@router.get("/{user_id}/series", response_model=schemas.VitalsSeries)
+async def get_user_vitals_series(
+    user_id: int,
+    start: Optional[datetime.datetime] = Query(None, alias="from"),
+    end: Optional[datetime.datetime] = Query(None, alias="to"),
+    resolution: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(dependencies.require_patient_access_async)
+):
+    """
+    Min/max/mean/count/last per bucket from the coarsest rollup that satisfies
+    the request. Defaults to the last 24 hours; resolution is a bucket width
+    such as '5m' or '1h' (picked from the range when omitted). Never more than
+    SERIES_MAX_POINTS buckets per metric: a finer resolution is coarsened, and
+    a range too long even for daily buckets is rejected.
+    """
+    end = ingest.to_utc_naive(end) if end else datetime.datetime.utcnow()
+    start = ingest.to_utc_naive(start) if start else end - datetime.timedelta(days=1)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="'from' must be before 'to'")
+
+    try:
+        requested = rollups.parse_duration(resolution) if resolution else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    picked = rollups.pick_resolution((end - start).total_seconds(), requested, settings.SERIES_MAX_POINTS)
+    if picked is None:
+        raise HTTPException(status_code=400, detail=f"Range too long: at most {settings.SERIES_MAX_POINTS} daily buckets per request")
+    name, seconds, model = picked
+    # A few hundred buckets: cheap enough to shape on the event loop
+    series = await db.run_sync(rollups.read_series, user_id, model, rollups.bucket_start(start, seconds), end)
+    return {"user_id": user_id, "resolution": name, "start": start, "end": end, "series": series}
+
+@router.get("/{user_id}/frames", response_model=schemas.VitalsFrames)
+def get_user_vitals_frames(
+    user_id: int,
+    window: str = "2m",
+    step: str = "1s",
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(dependencies.require_patient_access)
+):
+    """
+    Column-oriented vitals resampled to a fixed grid: one timestamp array plus
+    parallel heart_rate/systolic/diastolic/steps arrays (null where no reading).
+    Windows held by the in-memory cache (vitals_cache.py) are resampled there;
+    longer ones are pivoted and resampled in a single indexed GROUP BY query.
+    """
+    try:
+        window_seconds = rollups.parse_duration(window)
+        step_seconds = rollups.parse_duration(step)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    slots = math.ceil(window_seconds / step_seconds)
+    if slots > settings.FRAMES_MAX_SLOTS:
+        raise HTTPException(status_code=400, detail=f"window/step gives {slots} slots, max is {settings.FRAMES_MAX_SLOTS}")
+
+    end = datetime.datetime.utcnow()
+    start = end - datetime.timedelta(seconds=slots * step_seconds)
+    start_epoch = (start - rollups.EPOCH).total_seconds()
+    response = {
+        "user_id": user_id,
+        "start": start,
+        "step": step_seconds,
+        "t": [round(start_epoch + i * step_seconds, 3) for i in range(slots)],
+    }
+
+    # Short windows (the dashboard chart) come straight from the in-memory ring
+    frames = vitals_cache.cache.frames(db, user_id, start, step_seconds, slots)
+    if frames is not None:
+        return {**response, **frames}
+
+    hm = models.HealthMetric.__table__
+    slot = floor_int((epoch_seconds(hm.c.timestamp) - start_epoch) / step_seconds).label("slot")
+    result = db.execute(
+        select(slot, func.avg(hm.c.hr_bpm), func.avg(hm.c.systolic), func.avg(hm.c.diastolic), func.max(hm.c.steps))
+        .where(
+            hm.c.user_id == user_id,
+            # Listing every type lets SQLite range-scan (user_id, metric_type, timestamp)
+            hm.c.metric_type.in_(list(models.MetricType)),
+            hm.c.timestamp >= start,
+            hm.c.timestamp < end,
+        )
+        .group_by(slot)
+    )
+
+    frames = {"heart_rate": [None] * slots, "systolic": [None] * slots, "diastolic": [None] * slots, "steps": [None] * slots}
+    for index, hr, sys_bp, dia_bp, steps in result:
+        if 0 <= index < slots:
+            frames["heart_rate"][index] = round(hr, 1) if hr is not None else None
+            frames["systolic"][index] = round(sys_bp, 1) if sys_bp is not None else None
+            frames["diastolic"][index] = round(dia_bp, 1) if dia_bp is not None else None
+            frames["steps"][index] = steps
+    return {**response, **frames}
@@ -0,0 +1,124 @@
+"""
+Server-side streaming vital-sign rules.
+
+Runs inside the vitals ingest pipeline (as an ingest listener) so detection
+no longer depends on the patient's browser tab. Rules come from
+settings.VITALS_RULES and are either:
+
+  - count rules: at least `count` of the last `of` readings match
+    (e.g. 3 of the last 5 heart rates > 120)
+  - duration rules: every reading has matched for `for_seconds`
+    (e.g. systolic < 90 for 30 s)
+
+Per-user state is a few integers per rule: a bit ring of the last `of`
+outcomes, the start of the current breach and a fired flag, so evaluation
+is O(rules) per reading with no history scans.
+"""
+import operator
+import threading
+
+import models, ingest
+from config import settings
+from database import SessionLocal
+from routers import emergency
+
+OPERATORS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+class Rule:
+    __slots__ = ("name", "metric_type", "conditions", "count", "window_mask", "for_seconds", "status")
+
+    def __init__(self, name, metric, when, status, count=1, of=1, for_seconds=None):
+        if count > of or of > 64:
+            raise ValueError(f"Rule {name}: need count <= of <= 64")
+        self.name = name
+        self.metric_type = models.MetricType(metric)
+        self.conditions = [(field, OPERATORS[op], threshold) for field, op, threshold in when]
+        self.count = count
+        self.window_mask = (1 << of) - 1
+        self.for_seconds = for_seconds
+        self.status = status
+
+    def matches(self, row: dict) -> bool:
+        for field, compare, threshold in self.conditions:
+            value = row[field]
+            if value is None or not compare(value, threshold):
+                return False
+        return True
+
+class UserRuleState:
+    __slots__ = ("bits", "breach_since", "fired")
+
+    def __init__(self, size: int):
+        self.bits = [0] * size          # ring of recent outcomes, newest in bit 0
+        self.breach_since = [None] * size
+        self.fired = [False] * size
+
+class RuleEngine:
+    def __init__(self, rule_configs):
+        self.rules = [Rule(**config) for config in rule_configs]
+        self._by_type = {}
+        for index, rule in enumerate(self.rules):
+            self._by_type.setdefault(rule.metric_type, []).append((index, rule))
+        self._states = {}
+        self._lock = threading.Lock()
+        self.readings_evaluated = 0
+        self.rules_fired = 0
+
+    def evaluate(self, user_id: int, rows: list) -> list:
+        """Feed readings through the rules; returns the rules that fired."""
+        fired = []
+        with self._lock:
+            state = self._states.get(user_id)
+            if state is None:
+                state = self._states[user_id] = UserRuleState(len(self.rules))
+            for row in rows:
+                rules = self._by_type.get(row["metric_type"])
+                if not rules:
+                    continue
+                self.readings_evaluated += 1
+                for index, rule in rules:
+                    hit = rule.matches(row)
+                    if rule.for_seconds is not None:
+                        ts = row["timestamp"].timestamp()
+                        if not hit:
+                            state.breach_since[index] = None
+                            triggered = False
+                        else:
+                            if state.breach_since[index] is None:
+                                state.breach_since[index] = ts
+                            triggered = ts - state.breach_since[index] >= rule.for_seconds
+                    else:
+                        bits = ((state.bits[index] << 1) | hit) & rule.window_mask
+                        state.bits[index] = bits
+                        triggered = bin(bits).count("1") >= rule.count
+
+                    if not triggered:
+                        state.fired[index] = False
+                    elif not state.fired[index]:
+                        # Fire once per breach episode
+                        state.fired[index] = True
+                        fired.append(rule)
+            self.rules_fired += len(fired)
+        return fired
+
+    def on_batch(self, user_id: int, rows: list):
+        """Ingest listener: evaluate and escalate the patient's status when a rule fires."""
+        fired = self.evaluate(user_id, rows)
+        if not fired:
+            return
+        worst = max(fired, key=lambda rule: emergency.STATUS_SEVERITY.get(rule.status, 0))
+        reason = ", ".join(rule.name for rule in fired)
+        print(f"🚨 Vitals rule fired for user {user_id}: {reason}")
+
+        db = SessionLocal()
+        try:
+            user = db.query(models.User).filter(models.User.id == user_id).first()
+            if user is None:
+                return
+            for message in emergency.escalate_status(db, user, worst.status, reason):
+                emergency.manager.broadcast_threadsafe(message)
+        finally:
+            db.close()
+
+rule_engine = RuleEngine(settings.VITALS_RULES)
+ingest.add_listener(rule_engine.on_batch)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import date, datetime
 
 # Token Schemas
@@ -146,6 +146,115 @@ class HealthMetricCreate(HealthMetricBase):
 class HealthMetric(HealthMetricBase):
     id: int
     user_id: int
+    hr_bpm: Optional[float] = None
+    systolic: Optional[int] = None
+    diastolic: Optional[int] = None
+    steps: Optional[int] = None
 
     class Config:
         orm_mode = True
+
+# Vitals Rollup Schemas
+class VitalsBucket(BaseModel):
+    t: datetime
+    min: float
+    max: float
+    mean: float
+    count: int
+    last: float
+
+class VitalsSeries(BaseModel):
+    user_id: int
+    resolution: str
+    start: datetime
+    end: datetime
+    series: Dict[str, List[VitalsBucket]]
+
+class VitalsFrames(BaseModel):
+    user_id: int
+    start: datetime
+    step: float
+    t: List[float] # epoch seconds of each slot start
+    heart_rate: List[Optional[float]]
+    systolic: List[Optional[float]]
+    diastolic: List[Optional[float]]
+    steps: List[Optional[int]]
+
+class LatestReading(HealthMetricBase):
+    hr_bpm: Optional[float] = None
+    systolic: Optional[int] = None
+    diastolic: Optional[int] = None
+    steps: Optional[int] = None
+
+class VitalsLatest(BaseModel):
+    user_id: int
+    readings: Dict[str, LatestReading] # keyed by metric_type
+
+class SummaryStats(BaseModel):
+    count: int
+    mean: float
+    median: float
+    p5: float
+    p95: float
+    std: float
+    min: float
+    max: float
+
+class HeartRateStats(SummaryStats):
+    rmssd_ms: Optional[float] = None # HR variability over successive readings
+
+class BloodPressureStats(BaseModel):
+    systolic: SummaryStats
+    diastolic: SummaryStats
+    pulse_pressure: SummaryStats
+
+class StepStats(BaseModel):
+    count: int
+    total: int
+    per_minute: Optional[float] = None
+
+class VitalsStats(BaseModel):
+    user_id: int
+    start: datetime
+    end: datetime
+    heart_rate: Optional[HeartRateStats] = None
+    blood_pressure: Optional[BloodPressureStats] = None
+    steps: Optional[StepStats] = None
+
+# Device Gateway Schemas
+class DeviceBase(BaseModel):
+    name: str
+    url: str
+    kind: str = "health_api"
+    mode: str = "poll"
+    poll_interval_seconds: float = 1.0
+
+class DeviceCreate(DeviceBase):
+    pass
+
+class DeviceUpdate(BaseModel):
+    name: Optional[str] = None
+    url: Optional[str] = None
+    poll_interval_seconds: Optional[float] = None
+    enabled: Optional[bool] = None
+
+class Device(DeviceBase):
+    id: int
+    user_id: int
+    enabled: bool
+    created_at: datetime
+    # Live gateway state
+    state: Optional[str] = None # 'ok', 'backoff', 'stopped'
+    consecutive_failures: int = 0
+    last_error: Optional[str] = None
+    last_success_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+
+# Profiler Schemas
+class ProfileRequest(BaseModel):
+    seconds: float = 30
+    # "METHOD /path/{param}" to profile 1 in `every` requests of one route; None samples everything
+    route: Optional[str] = None
+    every: int = 1
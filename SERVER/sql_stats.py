@@ -0,0 +1,122 @@
+"""
+Per-request SQL instrumentation.
+
+Engine events count every statement and its time against the request
+being served (a ContextVar, so threadpool routes and AsyncSession queries
+are both attributed; background threads such as the ingest queue are not).
+middleware() reports the totals in the X-DB-Queries and
+Server-Timing response headers.
+
+It also flags N+1 patterns: a request over its query budget
+(SQL_QUERY_BUDGET, or SQL_ROUTE_BUDGETS["METHOD /path"]), or one running
+the same statement more than SQL_REPEAT_LIMIT times, which is what a
+relationship lazy-loaded in a loop looks like. The report names the line
+of app code that issued the repeated statement. With SQL_STRICT=1 the
+request raises QueryBudgetExceeded instead of logging, so tests fail.
+"""
+import os
+import sys
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from fastapi import Request
+from sqlalchemy import event
+
+from config import settings
+
+_current = ContextVar("sql_stats", default=None)
+
+# Statements are attributed to the first frame from a module in this directory
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+        self.callers = {} # statement -> "file:line" of the app code that repeated it
+
+    def record(self, statement: str, seconds: float):
+        self.queries += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+        if self.statements[statement] == settings.SQL_REPEAT_LIMIT + 1:
+            # Only walked once a statement repeats, so normal requests pay nothing for it
+            self.callers[statement] = _app_caller()
+
+    def problems(self, budget: int) -> list:
+        found = []
+        if self.queries > budget:
+            found.append(f"{self.queries} queries (budget {budget})")
+        for statement, count in self.statements.items():
+            if count > settings.SQL_REPEAT_LIMIT:
+                shape = " ".join(statement.split())[:160]
+                found.append(f"{count}x at {self.callers.get(statement, '?')}: {shape}")
+        return found
+
+def _app_caller() -> str:
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename.startswith(APP_DIR) and filename != os.path.abspath(__file__) and "site-packages" not in filename:
+            return f"{os.path.relpath(filename, APP_DIR)}:{frame.f_lineno}"
+        frame = frame.f_back
+    return "?"
+
+def start() -> RequestStats:
+    stats = RequestStats()
+    _current.set(stats)
+    return stats
+
+def stop():
+    _current.set(None)
+
+def budget_for(method: str, path: str) -> int:
+    return settings.SQL_ROUTE_BUDGETS.get(f"{method} {path}", settings.SQL_QUERY_BUDGET)
+
+def check(stats: RequestStats, method: str, path: str):
+    """Log (or in strict mode raise) when the request looks like an N+1."""
+    problems = stats.problems(budget_for(method, path))
+    if not problems:
+        return
+    message = f"{method} {path}: " + "; ".join(problems)
+    if settings.SQL_STRICT:
+        raise QueryBudgetExceeded(message)
+    print(f"⚠️ SQL {message}")
+
+def headers(stats: RequestStats) -> dict:
+    return {
+        "X-DB-Queries": str(stats.queries),
+        "Server-Timing": f'db;dur={stats.seconds * 1000:.1f};desc="{stats.queries} queries"',
+    }
+
+async def middleware(request: Request, call_next):
+    """HTTP middleware: counts the request's statements, checks them and adds the headers."""
+    stats = start()
+    try:
+        response = await call_next(request)
+    finally:
+        stop()
+    route = request.scope.get("route")
+    check(stats, request.method, route.path if route else request.url.path)
+    response.headers.update(headers(stats))
+    return response
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info["sql_stats_started"] = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    started = conn.info.pop("sql_stats_started", None)
+    if stats is not None and started is not None:
+        stats.record(statement, time.perf_counter() - started)
+
+def instrument(engine):
+    """Attach the counters to an Engine (or the sync_engine of an AsyncEngine)."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
@@ -0,0 +1,20 @@
+"""
+Shared fixtures. Tests run in-process; database tests get a throwaway
+SQLite file each, so no server is needed.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Base, make_engine
+
+@pytest.fixture
+def db_engine(tmp_path):
+    """Engine on a fresh SQLite file with the app's tables (the 'concurrent' profile, as served)."""
+    engine = make_engine(f"sqlite:///{tmp_path / 'lumi.db'}", "concurrent")
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
@@ -0,0 +1,61 @@
+"""
+Regression test: /emergency/active runs a constant number of queries,
+however many patients the caretaker has.
+
+    cd SERVER && python -m pytest tests/test_active_alerts_queries.py
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+from database import make_engine
+from routers import emergency
+
+CARETAKER_PHONE = "9000000000"
+
+def _seed(engine, patients: int) -> int:
+    """Caretaker plus `patients` patients: a third critical, a third with active alerts, some with both."""
+    with engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), [{"id": 1, "fullname": "Care", "phone": CARETAKER_PHONE, "role": "caretaker"}])
+        ids = range(2, patients + 2)
+        conn.execute(models.User.__table__.insert(), [{"id": i, "fullname": f"P{i}", "phone": f"8{i:09d}"} for i in ids])
+        conn.execute(models.Nominee.__table__.insert(), [{"user_id": i, "name": "N", "phone": CARETAKER_PHONE} for i in ids])
+        conn.execute(models.CaretakerPatient.__table__.insert(), [{"caretaker_phone": CARETAKER_PHONE, "patient_id": i} for i in ids])
+        conn.execute(models.PatientStatus.__table__.insert(), [
+            {"user_id": i, "phone": f"8{i:09d}", "status": ("emergency", "alert", "normal")[i % 3]} for i in ids
+        ])
+        conn.execute(models.EmergencyAlert.__table__.insert(), [
+            {"user_id": i, "stage": "voice_alert", "is_active": True} for i in ids if i % 2 == 0
+        ])
+    # Expected entries: every critical status, plus the alerts of patients without one
+    return sum(1 for i in ids if i % 3 != 2 or i % 2 == 0)
+
+def _active_alerts(db_engine, patients: int):
+    expected = _seed(db_engine, patients)
+    async_engine = make_engine(db_engine.url.render_as_string(hide_password=False), "concurrent", is_async=True)
+    statements = []
+    event.listen(async_engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    async def run():
+        async with async_sessionmaker(bind=async_engine, expire_on_commit=False)() as db:
+            caretaker = await db.get(models.User, 1)
+            statements.clear()
+            result = await emergency.get_active_alerts(db=db, current_user=caretaker)
+        await async_engine.dispose()
+        return result
+
+    return asyncio.run(run()), statements, expected
+
+@pytest.mark.parametrize("patients", [3, 200])
+def test_active_alerts_single_query(db_engine, patients):
+    result, statements, expected = _active_alerts(db_engine, patients)
+    assert len(result) == expected
+    assert all(entry["nominee_phone"] == CARETAKER_PHONE for entry in result)
+    assert len(statements) == 1, statements
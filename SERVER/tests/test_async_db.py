@@ -0,0 +1,78 @@
+"""
+Async database layer: the async engine gets the same SQLite profile as the
+sync one, and get_current_user_async attaches the (cached) user to the
+request's AsyncSession.
+
+    cd SERVER && python -m pytest tests/test_async_db.py
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dependencies, models
+from config import settings
+from database import make_engine
+
+PHONE = "5550100"
+
+@pytest.fixture
+def url(db_engine, monkeypatch):
+    with db_engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), [{"id": 1, "fullname": "Pat", "phone": PHONE, "session_id": "s1"}])
+    monkeypatch.setattr(dependencies, "user_cache", dependencies.UserCache(max_users=10, ttl_seconds=300, sid_check_seconds=30))
+    return db_engine.url.render_as_string(hide_password=False)
+
+def _run(url: str, work):
+    async def run():
+        engine = make_engine(url, "concurrent", is_async=True)
+        statements = []
+        event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        try:
+            return await work(async_sessionmaker(bind=engine, expire_on_commit=False), statements)
+        finally:
+            await engine.dispose()
+    return asyncio.run(run())
+
+def test_async_engine_uses_the_sqlite_profile(url):
+    async def pragmas(Session, statements):
+        async with Session() as db:
+            return {name: (await db.execute(text(f"PRAGMA {name}"))).scalar() for name in ("journal_mode", "busy_timeout")}
+
+    # busy_timeout is per connection: only set if the async engine ran the profile's connect hook
+    expected = settings.SQLITE_PROFILES["concurrent"]
+    found = _run(url, pragmas)
+    assert found["journal_mode"] == expected["journal_mode"].lower()
+    assert found["busy_timeout"] == int(expected["pragmas"]["busy_timeout"])
+
+def test_current_user_is_attached_to_the_async_session(url):
+    token = dependencies.create_access_token({"sub": PHONE, "sid": "s1"})
+
+    async def twice(Session, statements):
+        users = []
+        for _ in range(2):
+            async with Session() as db:
+                statements.clear()
+                user = await dependencies.get_current_user_async(token, db)
+                users.append((user.fullname, user in db, len(statements)))
+        return users
+
+    # First request loads the row; the second is served from the cache, without a query
+    assert _run(url, twice) == [("Pat", True, 1), ("Pat", True, 0)]
+
+def test_replaced_session_is_refused_on_the_async_path(url):
+    token = dependencies.create_access_token({"sub": PHONE, "sid": "old"})
+
+    async def load(Session, statements):
+        async with Session() as db:
+            return await dependencies.get_current_user_async(token, db)
+
+    with pytest.raises(HTTPException) as refused:
+        _run(url, load)
+    assert refused.value.status_code == 401
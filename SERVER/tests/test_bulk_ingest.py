@@ -0,0 +1,110 @@
+"""
+POST /vitals/bulk: NDJSON and MessagePack parsing, chunked commits, resuming
+an upload, and malformed or oversized input.
+
+    cd SERVER && python -m pytest tests/test_bulk_ingest.py
+"""
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dependencies, models
+from config import settings
+from routers import vitals
+
+NDJSON = {"Content-Type": "application/x-ndjson"}
+
+def _records(count: int, start: int = 0) -> list:
+    return [
+        {"metric_type": "heart_rate", "value": str(60 + i % 40), "unit": "bpm", "timestamp": 1767225600 + i}
+        for i in range(start, start + count)
+    ]
+
+def _ndjson(records: list) -> bytes:
+    return b"\n".join(json.dumps(record).encode() for record in records) + b"\n"
+
+def _stored(engine) -> int:
+    with engine.connect() as conn:
+        return conn.scalar(select(func.count()).select_from(models.HealthMetric.__table__))
+
+@pytest.fixture
+def client(db_engine, monkeypatch):
+    monkeypatch.setattr(vitals, "engine", db_engine)
+    monkeypatch.setattr(vitals, "bulk_progress", type(vitals.bulk_progress)())
+    monkeypatch.setattr(settings, "BULK_CHUNK_ROWS", 10)
+    app = FastAPI()
+    app.include_router(vitals.router)
+    app.dependency_overrides[dependencies.get_current_user] = lambda: SimpleNamespace(id=1)
+    return TestClient(app)
+
+def test_ndjson_is_committed_in_chunks(client, db_engine):
+    response = client.post("/vitals/bulk?upload_id=a", content=_ndjson(_records(25)), headers=NDJSON)
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["committed"], body["rows"], body["duplicates"]) == (25, 25, 0)
+    assert [(chunk["start"], chunk["end"]) for chunk in body["chunks"]] == [(0, 10), (10, 20), (20, 25)]
+    assert _stored(db_engine) == 25
+    assert client.get("/vitals/bulk/a").json() == {"upload_id": "a", "committed": 25}
+
+def test_blank_lines_and_a_missing_final_newline_are_fine(client, db_engine):
+    body = _ndjson(_records(2)) + b"\n\n" + json.dumps(_records(1, start=2)[0]).encode()
+    assert client.post("/vitals/bulk", content=body, headers=NDJSON).json()["rows"] == 3
+
+@pytest.mark.skipif(vitals.msgpack is None, reason="msgpack not installed")
+def test_msgpack_stream(client, db_engine):
+    body = b"".join(vitals.msgpack.packb(record) for record in _records(12))
+    response = client.post("/vitals/bulk", content=body, headers={"Content-Type": "application/msgpack"})
+    assert response.json()["rows"] == 12
+    assert _stored(db_engine) == 12
+
+def test_unsupported_content_type(client):
+    assert client.post("/vitals/bulk", content=b"[]", headers={"Content-Type": "application/json"}).status_code == 415
+
+def test_resume_skips_committed_records(client, db_engine):
+    # Record 15 is bad: the first chunk commits, the upload stops there
+    records = _records(20)
+    records[15]["value"] = "not a number"
+    failed = client.post("/vitals/bulk?upload_id=r", content=_ndjson(records), headers=NDJSON)
+    assert failed.status_code == 422
+    assert failed.json()["committed"] == 10
+
+    # Re-sending everything skips what was committed
+    resumed = client.post("/vitals/bulk?upload_id=r", content=_ndjson(_records(20)), headers=NDJSON)
+    assert (resumed.json()["committed"], resumed.json()["rows"], resumed.json()["duplicates"]) == (20, 10, 0)
+    assert _stored(db_engine) == 20
+
+def test_resume_with_only_the_remainder(client, db_engine):
+    client.post("/vitals/bulk?upload_id=o", content=_ndjson(_records(10)), headers=NDJSON)
+    resumed = client.post("/vitals/bulk?upload_id=o&offset=10", content=_ndjson(_records(5, start=10)), headers=NDJSON)
+    assert (resumed.json()["committed"], resumed.json()["rows"]) == (15, 5)
+    assert _stored(db_engine) == 15
+
+def test_resent_readings_are_counted_as_duplicates(client):
+    client.post("/vitals/bulk", content=_ndjson(_records(5)), headers=NDJSON)
+    assert client.post("/vitals/bulk", content=_ndjson(_records(5)), headers=NDJSON).json()["duplicates"] == 5
+
+def test_malformed_json_is_a_400(client):
+    response = client.post("/vitals/bulk", content=_ndjson(_records(3)) + b"{not json\n", headers=NDJSON)
+    assert response.status_code == 400
+    assert "after record 3" in response.json()["detail"]
+
+def test_overlong_line_is_refused_without_buffering_it(client, monkeypatch):
+    monkeypatch.setattr(settings, "BULK_MAX_LINE_BYTES", 1024)
+
+    def body():
+        yield _ndjson(_records(2))
+        # A line that never ends: rejected once it passes the cap, not read to the end
+        for _ in range(1000):
+            yield b"x" * 512
+
+    response = client.post("/vitals/bulk", content=body(), headers=NDJSON)
+    assert response.status_code == 400
+    assert "line longer than 1024 bytes" in response.json()["detail"]
@@ -0,0 +1,215 @@
+"""
+Device gateway: the SSRF checks on device URLs, pinning requests to the
+checked address, backoff, leadership and the hand-off to ingest.accept.
+No network: DNS answers are faked.
+
+    cd SERVER && python -m pytest tests/test_device_gateway.py
+"""
+import asyncio
+import os
+import socket
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import device_gateway, ingest
+from config import settings
+from device_gateway import BlockedURL
+
+PUBLIC = "93.184.216.34"
+
+@pytest.fixture
+def allow(monkeypatch):
+    monkeypatch.setattr(settings, "GATEWAY_ALLOWED_SCHEMES", ["https"])
+    monkeypatch.setattr(settings, "GATEWAY_ALLOWED_HOSTS", ["wearables.example.com", ".vendor.example"])
+    monkeypatch.setattr(device_gateway, "_allowed_networks", [])
+
+def _infos(*addresses) -> list:
+    return [(socket.AF_INET6 if ":" in a else socket.AF_INET, socket.SOCK_STREAM, 6, "", (a, 443)) for a in addresses]
+
+def _device(**overrides):
+    fields = dict(id=1, user_id=7, kind="health_api", url="https://wearables.example.com/all", mode="poll", poll_interval_seconds=1.0)
+    fields.update(overrides)
+    return device_gateway.DeviceState(SimpleNamespace(**fields))
+
+def _gateway(**overrides) -> device_gateway.DeviceGateway:
+    options = dict(max_connections=4, request_timeout=1.0, backoff_max=60, flush_interval=0.1,
+                   sync_interval=60, leadership=device_gateway.Leadership(None))
+    options.update(overrides)
+    return device_gateway.DeviceGateway(**options)
+
+@pytest.mark.parametrize("url", [
+    "https://wearables.example.com/all",
+    "https://WEARABLES.example.com:8443/all",
+    "https://eu.vendor.example/v1/readings",
+])
+def test_allowed_urls(allow, url):
+    device_gateway.check_url(url)
+
+@pytest.mark.parametrize("url, reason", [
+    ("http://wearables.example.com/all", "scheme"),
+    ("file:///etc/passwd", "scheme"),
+    ("https://other.example.com/all", "not allowed"),
+    ("https://wearables.example.com.evil.test/all", "not allowed"),
+    ("https://vendor.example.evil.test/", "not allowed"),
+    ("https://[::1/", "Invalid"),
+])
+def test_blocked_urls(allow, url, reason):
+    with pytest.raises(BlockedURL, match=reason):
+        device_gateway.check_url(url)
+
+def test_empty_host_allowlist_allows_nothing(monkeypatch):
+    monkeypatch.setattr(settings, "GATEWAY_ALLOWED_HOSTS", [])
+    with pytest.raises(BlockedURL):
+        device_gateway.check_url("https://wearables.example.com/all")
+
+@pytest.mark.parametrize("address", [
+    "127.0.0.1", "10.1.2.3", "172.16.0.1", "192.168.1.20", "169.254.169.254", "0.0.0.0",
+    "::1", "fe80::1%eth0", "fc00::1", "::ffff:127.0.0.1", "224.0.0.1",
+])
+def test_private_loopback_and_link_local_addresses_are_blocked(allow, address):
+    with pytest.raises(BlockedURL):
+        device_gateway.check_address(address)
+
+def test_public_address_passes(allow):
+    assert device_gateway.check_address(PUBLIC) == PUBLIC
+
+def test_allowed_network_opens_a_lan_range(allow, monkeypatch):
+    monkeypatch.setattr(device_gateway, "_allowed_networks", [device_gateway.ipaddress.ip_network("192.168.1.0/24")])
+    assert device_gateway.check_address("192.168.1.20") == "192.168.1.20"
+    with pytest.raises(BlockedURL):
+        device_gateway.check_address("192.168.2.20")
+
+def test_every_resolved_address_must_pass(allow):
+    assert device_gateway._pick_address(_infos(PUBLIC)) == PUBLIC
+    with pytest.raises(BlockedURL):
+        device_gateway._pick_address(_infos(PUBLIC, "127.0.0.1"))
+
+def test_resolve_checks_the_dns_answer(allow, monkeypatch):
+    monkeypatch.setattr(device_gateway.socket, "getaddrinfo", lambda host, port, type: _infos("10.0.0.5"))
+    with pytest.raises(BlockedURL):
+        device_gateway.resolve("https://wearables.example.com/all")
+
+def test_requests_are_pinned_to_the_checked_address(allow, monkeypatch):
+    """A name re-pointed at an internal address after the check (DNS rebinding) is never connected to."""
+    answers = [_infos(PUBLIC), _infos("127.0.0.1")]
+    clock = [1000.0]
+    monkeypatch.setattr(device_gateway.time, "monotonic", lambda: clock[0])
+
+    async def run():
+        gateway = _gateway()
+        gateway.loop = asyncio.get_running_loop()
+
+        async def getaddrinfo(host, port, type):
+            return answers.pop(0)
+
+        monkeypatch.setattr(gateway.loop, "getaddrinfo", getaddrinfo)
+        state = _device()
+        first = await gateway._target(state)
+        assert str(first["url"]) == f"https://{PUBLIC}/all"
+        assert first["headers"] == {"Host": "wearables.example.com"}
+        assert first["extensions"] == {"sni_hostname": "wearables.example.com"}
+
+        # Within the TTL the pinned address is reused, whatever DNS says now
+        clock[0] += settings.GATEWAY_DNS_TTL_SECONDS - 1
+        assert str((await gateway._target(state))["url"]) == f"https://{PUBLIC}/all"
+        # Once it expires the new answer is checked, and refused
+        clock[0] += 2
+        with pytest.raises(BlockedURL):
+            await gateway._target(state)
+
+    asyncio.run(run())
+
+def test_non_finite_interval_falls_back_to_default():
+    assert _device(poll_interval_seconds=float("nan")).interval == 1.0
+    assert _device(poll_interval_seconds=0.01).interval == settings.GATEWAY_MIN_POLL_INTERVAL_SECONDS
+
+def test_backoff_doubles_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(device_gateway.random, "uniform", lambda low, high: high)
+    gateway = _gateway(backoff_max=10)
+    state = _device(poll_interval_seconds=1.0)
+    delays = [gateway._backoff(state, TimeoutError()) for _ in range(5)]
+    assert delays == [2, 4, 8, 10, 10]
+    assert (state.state, state.consecutive_failures, gateway.failures) == ("backoff", 5, 5)
+    assert state.last_error == "connection failed"
+
+    gateway._succeeded(state)
+    assert (state.state, state.consecutive_failures) == ("ok", 0)
+
+def test_backoff_is_jittered(monkeypatch):
+    monkeypatch.setattr(device_gateway.random, "uniform", lambda low, high: low)
+    assert _gateway()._backoff(_device(), TimeoutError()) == 1.0 # half of 2 s
+
+def test_error_descriptions_do_not_leak_details(allow):
+    assert device_gateway._describe(BlockedURL("Device address 10.0.0.5 is not allowed")) == "address not allowed"
+    assert device_gateway._describe(KeyError("secret")) == "invalid payload"
+    assert device_gateway._describe(RuntimeError("internal answer")) == "error"
+
+def test_accepted_readings_are_flushed_into_ingest(monkeypatch):
+    calls = []
+    monkeypatch.setattr(ingest, "accept", lambda user_id, rows: calls.append((user_id, rows)) or True)
+    gateway = _gateway()
+    payload = {"heart_beat": {"heart_rate": 72}, "blood_pressure": {"systolic": 120, "diastolic": 80}, "step_count": {"steps": 1500}}
+    gateway._accept(_device(id=1, user_id=7), payload)
+    gateway._accept(_device(id=2, user_id=7), {"heart_beat": {"heart_rate": 75}})
+    gateway._accept(_device(id=3, user_id=8), {"heart_beat": {"heart_rate": 80}})
+
+    gateway._ingest(gateway._take_pending())
+    assert gateway._pending == []
+    # One accept per user, with all of that user's readings
+    assert [(user_id, [row["metric_type"].value for row in rows]) for user_id, rows in calls] == [
+        (7, ["heart_rate", "blood_pressure", "steps", "heart_rate"]),
+        (8, ["heart_rate"]),
+    ]
+    assert calls[0][1][0]["hr_bpm"] == 72 and calls[0][1][1]["systolic"] == 120
+
+def test_malformed_payload_is_a_failed_poll():
+    gateway = _gateway()
+    with pytest.raises((KeyError, ValueError)):
+        gateway._accept(_device(), {"heart_beat": {"rate": 72}})
+    assert gateway._pending == []
+
+def test_readings_dropped_when_ingest_refuses(monkeypatch):
+    monkeypatch.setattr(ingest, "accept", lambda user_id, rows: False)
+    gateway = _gateway()
+    gateway._accept(_device(), {"heart_beat": {"heart_rate": 72}})
+    gateway._ingest(gateway._take_pending())
+    assert gateway.dropped == 1
+
+@pytest.mark.skipif(device_gateway.fcntl is None, reason="no flock on this platform")
+def test_only_one_process_leads(tmp_path):
+    lock_file = str(tmp_path / "lumi.db.gateway.lock")
+    first, second = device_gateway.Leadership(lock_file), device_gateway.Leadership(lock_file)
+    assert first.acquire()
+    assert not second.acquire()
+    first.release()
+    assert second.acquire()
+    second.release()
+
+def test_sync_starts_stops_and_restarts_devices(monkeypatch):
+    async def run():
+        gateway = _gateway()
+
+        async def idle(state):
+            await asyncio.sleep(3600)
+
+        monkeypatch.setattr(gateway, "_poll_device", idle)
+        gateway._sync([_device(id=1), _device(id=2)])
+        assert sorted(gateway.devices) == [1, 2]
+        first_task = gateway.devices[1].task
+
+        gateway._sync([_device(id=1), _device(id=2, poll_interval_seconds=5.0)])
+        assert gateway.devices[1].task is first_task # unchanged: keeps running
+        assert gateway.devices[2].interval == 5.0
+
+        gateway._sync([_device(id=2, poll_interval_seconds=5.0)])
+        assert sorted(gateway.devices) == [2]
+        await asyncio.sleep(0)
+        assert first_task.cancelled()
+        for state in gateway.devices.values():
+            state.task.cancel()
+
+    asyncio.run(run())
@@ -0,0 +1,85 @@
+"""
+Duplicate readings: the in-memory RecentKeys filter and ON CONFLICT DO NOTHING.
+
+    cd SERVER && python -m pytest tests/test_ingest_duplicates.py
+"""
+import datetime
+import os
+import sys
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest, models
+
+START = datetime.datetime(2026, 1, 1)
+
+def _row(second: int, value: int = 70, user_id: int = 1) -> dict:
+    return ingest.build_row(user_id, "heart_rate", str(value), "bpm", START + datetime.timedelta(seconds=second))
+
+@pytest.fixture
+def engine(db_engine, monkeypatch):
+    monkeypatch.setattr(ingest, "engine", db_engine)
+    return db_engine
+
+@pytest.fixture
+def recent(monkeypatch):
+    recent = ingest.RecentKeys(max_keys=100)
+    monkeypatch.setattr(ingest, "recent", recent)
+    return recent
+
+def test_fresh_drops_remembered_and_in_batch_duplicates(recent):
+    recent.remember([_row(0)])
+    fresh = recent.fresh([_row(0), _row(1), _row(1, value=99), _row(2)])
+    assert [row["timestamp"].second for row in fresh] == [1, 2]
+    assert fresh[0]["hr_bpm"] == 70 # first copy wins
+    assert recent.duplicates == 2
+
+def test_keys_with_equal_hashes_are_not_confused(recent):
+    # hash(-1) == hash(-2) in CPython, so these two keys hash alike
+    assert hash(ingest._key(_row(0, user_id=-1))) == hash(ingest._key(_row(0, user_id=-2)))
+    recent.remember([_row(0, user_id=-1)])
+    assert recent.fresh([_row(0, user_id=-2)]) != []
+
+def test_oldest_generation_is_forgotten():
+    recent = ingest.RecentKeys(max_keys=4) # generations of 2
+    for second in range(6):
+        recent.remember([_row(second)])
+    # 4 and 5 are the remembered generation, 0-3 were rotated out
+    assert [row["timestamp"].second for row in recent.fresh([_row(s) for s in range(6)])] == [0, 1, 2, 3]
+
+def test_write_rows_skips_stored_readings_and_their_rollups(engine):
+    with engine.begin() as conn:
+        first = ingest.write_rows(conn, [_row(0, 60), _row(1, 80)])
+    with engine.begin() as conn:
+        second = ingest.write_rows(conn, [_row(1, 100), _row(2, 100), _row(2, 120)])
+
+    assert len(first) == 2
+    assert [row["timestamp"].second for _, row in second] == [2]
+    with engine.connect() as conn:
+        stored = conn.execute(select(models.HealthMetric.timestamp, models.HealthMetric.hr_bpm).order_by(models.HealthMetric.timestamp)).all()
+        rollup = conn.execute(select(models.VitalsRollupMinute.count, models.VitalsRollupMinute.max_value)
+                              .where(models.VitalsRollupMinute.metric == "hr_bpm")).one()
+    # The stored reading at second 1 is kept, and the first copy of second 2 wins
+    assert [hr for _, hr in stored] == [60, 80, 100]
+    assert tuple(rollup) == (3, 100)
+
+def test_queue_remembers_keys_only_after_commit(engine, recent, monkeypatch):
+    queue = ingest.IngestQueue(max_rows=100, flush_rows=50, flush_interval=0.01, submit_timeout=0.01, retry_max=0.05)
+    queue.submit([_row(0)])
+    assert recent.fresh([_row(0)]) != [] # queued, not yet stored
+
+    write_rows = ingest.write_rows
+    def database_down(conn, rows):
+        raise OperationalError("INSERT INTO health_metrics ...", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(ingest, "write_rows", database_down)
+    queue.flush()
+    assert recent.fresh([_row(0)]) != [] # the failed write must not hide a retry
+
+    monkeypatch.setattr(ingest, "write_rows", write_rows)
+    queue.flush()
+    assert recent.fresh([_row(0)]) == []
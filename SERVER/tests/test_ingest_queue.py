@@ -0,0 +1,152 @@
+"""
+Write-behind ingest queue: group commit, retry on failure, backpressure.
+
+    cd SERVER && python -m pytest tests/test_ingest_queue.py
+"""
+import datetime
+import os
+import sys
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest, models
+
+START = datetime.datetime(2026, 1, 1)
+
+def _rows(count: int, user_id: int = 1, offset: int = 0) -> list:
+    return [
+        ingest.build_row(user_id, "heart_rate", str(60 + i % 40), "bpm", START + datetime.timedelta(seconds=offset + i))
+        for i in range(count)
+    ]
+
+def _stored(engine) -> int:
+    with engine.connect() as conn:
+        return conn.scalar(select(func.count()).select_from(models.HealthMetric.__table__))
+
+@pytest.fixture
+def engine(db_engine, monkeypatch):
+    monkeypatch.setattr(ingest, "engine", db_engine)
+    return db_engine
+
+def _database_down(conn, rows):
+    raise OperationalError("INSERT INTO health_metrics ...", {}, Exception("database is locked"))
+
+def _queue(**overrides) -> ingest.IngestQueue:
+    options = dict(max_rows=100, flush_rows=50, flush_interval=0.01, submit_timeout=0.01, retry_max=0.05)
+    options.update(overrides)
+    return ingest.IngestQueue(**options)
+
+def test_flush_writes_all_pending_batches_in_one_transaction(engine):
+    queue = _queue()
+    assert queue.submit(_rows(10, user_id=1))
+    assert queue.submit(_rows(5, user_id=2))
+    assert queue.depth() == 15
+
+    assert queue.flush() == 15
+    assert _stored(engine) == 15
+    assert queue.depth() == 0
+    assert (queue.flushes, queue.rows_written, queue.duplicates) == (1, 15, 0)
+
+def test_flush_counts_stored_duplicates(engine):
+    queue = _queue()
+    queue.submit(_rows(10))
+    queue.flush()
+    queue.submit(_rows(10, offset=5)) # 5 already stored
+    assert queue.flush() == 5
+    assert _stored(engine) == 15
+    assert queue.duplicates == 5
+
+def test_failed_flush_keeps_rows_and_retries(engine, monkeypatch):
+    queue = _queue()
+    queue.submit(_rows(10))
+    write_rows = ingest.write_rows
+
+    monkeypatch.setattr(ingest, "write_rows", _database_down)
+    assert queue.flush() == 0
+    assert queue.flush() == 0
+    assert queue.failures == 2
+    assert queue.depth() == 10
+    assert _stored(engine) == 0
+
+    # Newer rows queue behind the failed batch
+    queue.submit(_rows(5, offset=100))
+    monkeypatch.setattr(ingest, "write_rows", write_rows)
+    assert queue.flush() == 15
+    assert _stored(engine) == 15
+    assert queue.failures == 0
+    assert queue.depth() == 0
+
+def test_backoff_doubles_up_to_retry_max(engine, monkeypatch):
+    queue = _queue(flush_interval=1.0, retry_max=3.0)
+    queue.submit(_rows(1))
+    monkeypatch.setattr(ingest, "write_rows", _database_down)
+    delays = []
+    for _ in range(4):
+        queue.flush()
+        delays.append(round(queue._retry_at - ingest.time.monotonic()))
+    assert delays == [1, 2, 3, 3]
+
+def test_poison_rows_are_dropped_not_retried(engine):
+    queue = _queue()
+    rows = _rows(10)
+    rows[3]["steps"] = rows[7]["steps"] = 2 ** 70 # no database column can hold these
+    queue.submit(rows)
+    assert queue.flush() == 8
+    assert _stored(engine) == 8
+    assert (queue.dropped, queue.failures, queue.depth()) == (2, 0, 0)
+    assert queue.stats()["dropped"] == 2
+
+    # Later batches are not held up behind them
+    queue.submit(_rows(5, offset=100))
+    assert queue.flush() == 5
+
+def test_transient_error_while_isolating_requeues_the_rest(engine, monkeypatch):
+    queue = _queue()
+    rows = _rows(4)
+    rows[0]["steps"] = 2 ** 70
+    queue.submit(rows)
+    write_rows = ingest.write_rows
+    calls = []
+
+    def flaky(conn, batch):
+        calls.append(len(batch))
+        if len(calls) == 5: # the second half, once the first has been isolated
+            _database_down(conn, batch)
+        return write_rows(conn, batch)
+
+    monkeypatch.setattr(ingest, "write_rows", flaky)
+    assert queue.flush() == 0
+    assert (queue.failures, queue.dropped, queue.depth()) == (1, 1, 3) # the refused row is not requeued
+
+    monkeypatch.setattr(ingest, "write_rows", write_rows)
+    assert queue.flush() == 2 # row 1 was committed with the first half
+    assert (_stored(engine), queue.dropped, queue.depth()) == (3, 1, 0)
+
+def test_full_queue_rejects_submitters(engine):
+    queue = _queue(max_rows=15)
+    assert queue.submit(_rows(10))
+    assert not queue.submit(_rows(10, offset=10))
+    assert queue.rejected == 10
+    assert queue.depth() == 10
+
+    # Space frees up once the writer has stored the pending rows
+    queue.flush()
+    assert queue.submit(_rows(10, offset=10))
+
+def test_rows_stay_counted_while_failing_so_backpressure_holds(engine, monkeypatch):
+    queue = _queue(max_rows=15)
+    queue.submit(_rows(10))
+    monkeypatch.setattr(ingest, "write_rows", _database_down)
+    queue.flush()
+    assert not queue.submit(_rows(10, offset=10))
+
+def test_stop_flushes_pending_rows(engine):
+    queue = _queue(flush_interval=60, flush_rows=1000)
+    queue.start()
+    queue.submit(_rows(20))
+    queue.stop()
+    assert _stored(engine) == 20
@@ -0,0 +1,73 @@
+"""
+/metrics: the DB pool wait histogram and who may scrape.
+
+    cd SERVER && python -m pytest tests/test_metrics.py
+"""
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+from config import settings
+
+@pytest.fixture
+def pool_engine(tmp_path, monkeypatch):
+    # One connection, no overflow: a second caller has to wait for it
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", pool_size=1, max_overflow=0, pool_timeout=0.2)
+    monkeypatch.setattr(metrics, "pool_wait_seconds", metrics.Histogram(metrics.POOL_WAIT_BUCKETS))
+    monkeypatch.setattr(metrics, "_pools", {})
+    metrics.instrument_pool("test", engine)
+    yield engine
+    engine.dispose()
+
+def _observed(histogram) -> tuple:
+    """(count, seconds) observed for the test engine."""
+    totals = histogram.counters.totals()
+    return sum(count for (labels, index), count in totals.items() if index != "sum"), totals[(("test",), "sum")]
+
+def test_pool_wait_is_timed(pool_engine):
+    held = pool_engine.connect()
+    released = threading.Timer(0.1, held.close)
+    released.start()
+    with pool_engine.connect() as conn: # waits for the held connection
+        conn.execute(text("SELECT 1"))
+    released.join()
+    count, seconds = _observed(metrics.pool_wait_seconds)
+    assert count == 2 and seconds >= 0.1
+
+def test_pool_timeouts_are_observed(pool_engine):
+    with pool_engine.connect():
+        with pytest.raises(PoolTimeout):
+            pool_engine.connect()
+    count, seconds = _observed(metrics.pool_wait_seconds)
+    assert count == 2 and seconds >= 0.2
+
+def test_pool_wait_is_rendered(pool_engine):
+    with pool_engine.connect():
+        pass
+
+    async def scrape():
+        return metrics.render() # reads the threadpool limiter: needs the event loop
+
+    text_format = asyncio.run(scrape())
+    assert "# TYPE lumi_db_pool_wait_seconds histogram" in text_format
+    assert 'lumi_db_pool_wait_seconds_count{engine="test"} 1' in text_format
+    assert 'lumi_db_pool_wait_seconds_bucket{engine="test",le="+Inf"} 1' in text_format
+
+def test_scrape_needs_the_token(monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_TOKEN", "s3cret")
+    assert metrics.scrape_allowed("Bearer s3cret", "203.0.113.9")
+    assert not metrics.scrape_allowed("Bearer wrong", "127.0.0.1")
+    assert not metrics.scrape_allowed(None, "127.0.0.1")
+
+def test_without_a_token_only_loopback_scrapes(monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_TOKEN", "")
+    assert metrics.scrape_allowed(None, "127.0.0.1")
+    assert not metrics.scrape_allowed(None, "203.0.113.9")
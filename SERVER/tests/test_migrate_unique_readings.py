@@ -0,0 +1,59 @@
+"""
+Migrations 3 and 13: duplicate readings dropped at startup, the unique
+index built afterwards (CONCURRENTLY on PostgreSQL), and startup refusing
+to run without it.
+
+    cd SERVER && python -m pytest tests/test_migrate_unique_readings.py
+"""
+import os
+import sys
+
+import pytest
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import migrate_db
+from database import IS_SQLITE
+
+pytestmark = pytest.mark.skipif(not IS_SQLITE, reason="DATABASE_URL is not SQLite")
+
+@pytest.fixture
+def legacy(db_engine, monkeypatch):
+    """A database from before migration 3: no unique index, and a reading stored twice."""
+    with db_engine.begin() as conn:
+        conn.execute(text(f"DROP INDEX {migrate_db.UNIQUE_READINGS}"))
+        conn.execute(text("DROP INDEX ix_health_metrics_user_id"))
+        conn.execute(text(
+            "INSERT INTO health_metrics (id, user_id, metric_type, hr_bpm, timestamp) VALUES "
+            "(1, 1, 'heart_rate', 72, '2024-01-01 00:00:00'), "
+            "(2, 1, 'heart_rate', 72, '2024-01-01 00:00:00'), "
+            "(3, 1, 'heart_rate', 75, '2024-01-01 00:00:01')"
+        ))
+    monkeypatch.setattr(migrate_db, "engine", db_engine)
+    return db_engine
+
+def _ids(engine) -> list:
+    with engine.connect() as conn:
+        return [row[0] for row in conn.execute(text("SELECT id FROM health_metrics ORDER BY id"))]
+
+def test_startup_drops_duplicates_but_leaves_the_index_to_the_cli(legacy):
+    with legacy.begin() as conn:
+        migrate_db._unique_readings(conn)
+        assert not migrate_db._has_index(conn, migrate_db.UNIQUE_READINGS)
+    assert _ids(legacy) == [1, 3]
+
+def test_index_migration_builds_the_unique_index(legacy):
+    with legacy.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        migrate_db._unique_readings_index(conn)
+        assert migrate_db._has_index(conn, migrate_db.UNIQUE_READINGS)
+        assert migrate_db._has_index(conn, "ix_health_metrics_user_id")
+        migrate_db._unique_readings_index(conn) # idempotent
+    assert _ids(legacy) == [1, 3]
+
+def test_startup_refuses_to_run_without_the_unique_index(legacy):
+    with pytest.raises(RuntimeError, match="migrate_db.py upgrade"):
+        migrate_db.init_db()
+    assert _ids(legacy) == [1, 3] # migration 3 still ran
+    migrate_db.upgrade()
+    migrate_db.init_db()
@@ -0,0 +1,111 @@
+"""
+OTP stores: expiry, attempts, capacity and rate limits, for both the
+in-memory store and the database one (on a throwaway SQLite file).
+
+    cd SERVER && python -m pytest tests/test_otp_store.py
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import otp_store
+
+LIMITS = {"phone": (3, 60), "ip": (5, 60)} # burst, tokens per minute
+
+class FakeClock:
+    """Stands in for the time module: both monotonic() and time() advance together."""
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(otp_store, "time", clock)
+    return clock
+
+@pytest.fixture(params=["memory", "db"])
+def store(request, monkeypatch, clock):
+    if request.param == "memory":
+        return otp_store.MemoryOTPStore(ttl_seconds=300, max_attempts=3, limits=LIMITS, max_entries=100, max_limit_keys=100)
+    monkeypatch.setattr(otp_store, "engine", request.getfixturevalue("db_engine"))
+    return otp_store.DatabaseOTPStore(ttl_seconds=300, max_attempts=3, limits=LIMITS)
+
+def test_base_class_is_abstract():
+    with pytest.raises(TypeError):
+        otp_store.OTPStore(ttl_seconds=300, max_attempts=3, limits=LIMITS)
+
+def test_code_is_consumed_by_verify(store):
+    store.put("5550100", "4821")
+    assert store.verify("5550100", "4821")
+    assert not store.verify("5550100", "4821")
+
+def test_new_code_replaces_pending_one(store):
+    store.put("5550100", "1111")
+    store.put("5550100", "2222")
+    assert not store.verify("5550100", "1111")
+    assert store.verify("5550100", "2222")
+
+def test_code_expires(store, clock):
+    store.put("5550100", "4821")
+    clock.now += 299
+    store.put("5550101", "0000")
+    clock.now += 2
+    assert not store.verify("5550100", "4821")
+    assert store.verify("5550101", "0000")
+
+def test_code_dropped_after_max_attempts(store):
+    store.put("5550100", "4821")
+    assert not store.verify("5550100", "0000")
+    assert not store.verify("5550100", "0001")
+    assert store.verify("5550100", "4821") # two wrong guesses: still pending
+    store.put("5550100", "4821")
+    for guess in ("0000", "0001", "0002"):
+        assert not store.verify("5550100", guess)
+    assert not store.verify("5550100", "4821")
+
+def test_codes_are_per_phone(store):
+    store.put("5550100", "4821")
+    assert not store.verify("5550101", "4821")
+    assert store.verify("5550100", "4821")
+
+def test_memory_store_capacity_evicts_oldest(clock):
+    store = otp_store.MemoryOTPStore(ttl_seconds=300, max_attempts=3, limits=LIMITS, max_entries=2, max_limit_keys=100)
+    for phone in ("5550100", "5550101", "5550102"):
+        store.put(phone, "4821")
+    assert len(store._codes) == 2
+    assert not store.verify("5550100", "4821")
+    assert store.verify("5550102", "4821")
+
+def test_rate_limit_burst_then_refill(store, clock):
+    assert [store.limit("phone", "5550100") for _ in range(3)] == [0, 0, 0]
+    assert store.limit("phone", "5550100") == pytest.approx(1.0)
+    # Buckets are per key and per scope
+    assert store.limit("phone", "5550101") == 0
+    assert store.limit("ip", "5550100") == 0
+    clock.now += 1
+    assert store.limit("phone", "5550100") == 0
+    assert store.limit("phone", "5550100") > 0
+
+def test_rate_limit_refill_caps_at_burst(store, clock):
+    store.limit("phone", "5550100")
+    clock.now += 3600
+    assert [store.limit("phone", "5550100") for _ in range(3)] == [0, 0, 0]
+    assert store.limit("phone", "5550100") > 0
+
+def test_token_buckets_are_bounded():
+    buckets = otp_store.TokenBuckets(burst=1, rate=1 / 60, max_keys=2)
+    assert buckets.take("a", 0) == 0
+    assert buckets.take("a", 0) > 0
+    buckets.take("b", 0)
+    buckets.take("c", 0) # evicts "a", which starts full again
+    assert len(buckets._buckets) == 2
+    assert buckets.take("a", 0) == 0
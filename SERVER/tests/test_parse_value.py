@@ -0,0 +1,58 @@
+"""
+HealthMetric.parse_value: wire format to typed columns, and the readings it refuses.
+
+    cd SERVER && python -m pytest tests/test_parse_value.py
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import HealthMetric
+
+@pytest.mark.parametrize("metric_type, value, expected", [
+    ("heart_rate", "72", {"hr_bpm": 72.0}),
+    ("heart_rate", "72.5", {"hr_bpm": 72.5}),
+    ("blood_pressure", "120/80", {"systolic": 120, "diastolic": 80}),
+    ("steps", "1500", {"steps": 1500}),
+    ("steps", "1500.0", {"steps": 1500}),
+    ("steps", "0", {"steps": 0}),
+])
+def test_parses_wire_format(metric_type, value, expected):
+    assert HealthMetric.parse_value(metric_type, value) == expected
+
+@pytest.mark.parametrize("metric_type, value", [
+    ("heart_rate", "nan"),
+    ("heart_rate", "inf"),
+    ("heart_rate", "1e999"),
+    ("heart_rate", "abc"),
+    ("blood_pressure", "120"),
+    ("blood_pressure", "120/80/60"),
+    ("temperature", "37"),
+])
+def test_rejects_malformed(metric_type, value):
+    with pytest.raises(ValueError):
+        HealthMetric.parse_value(metric_type, value)
+
+@pytest.mark.parametrize("metric_type, value", [
+    ("steps", "3000000000"),        # past int4: would only fail at INSERT on PostgreSQL
+    ("steps", str(2 ** 70)),
+    ("blood_pressure", f"{2 ** 40}/80"),
+])
+def test_rejects_values_the_columns_cannot_hold(metric_type, value):
+    with pytest.raises(ValueError, match="out of range"):
+        HealthMetric.parse_value(metric_type, value)
+
+@pytest.mark.parametrize("metric_type, value", [
+    ("heart_rate", "500"),
+    ("heart_rate", "5"),
+    ("heart_rate", "-72"),
+    ("blood_pressure", "400/80"),
+    ("blood_pressure", "120/10"),
+    ("steps", "-1"),
+])
+def test_rejects_implausible_readings(metric_type, value):
+    with pytest.raises(ValueError, match="plausible range"):
+        HealthMetric.parse_value(metric_type, value)
@@ -0,0 +1,65 @@
+"""
+Per-patient vitals reads: allowed for the patient and their linked
+caretakers only (dependencies.require_patient_access).
+
+    cd SERVER && python -m pytest tests/test_patient_access.py
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dependencies, models
+from database import make_engine
+
+PATIENT, CARETAKER, STRANGER = 1, 2, 3
+
+@pytest.fixture
+def url(db_engine):
+    with db_engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), [
+            {"id": PATIENT, "fullname": "Pat", "phone": "5550100"},
+            {"id": CARETAKER, "fullname": "Care", "phone": "5550200", "role": "caretaker"},
+            {"id": STRANGER, "fullname": "Other", "phone": "5550300", "role": "caretaker"},
+        ])
+        conn.execute(models.CaretakerPatient.__table__.insert(), [{"caretaker_phone": "5550200", "patient_id": PATIENT}])
+    return db_engine.url.render_as_string(hide_password=False)
+
+def _check(url: str, reader: int, patient: int):
+    engine = make_engine(url, "concurrent")
+    try:
+        with sessionmaker(bind=engine)() as db:
+            return dependencies.require_patient_access(patient, db.get(models.User, reader), db)
+    finally:
+        engine.dispose()
+
+def _check_async(url: str, reader: int, patient: int):
+    async def run():
+        engine = make_engine(url, "concurrent", is_async=True)
+        try:
+            async with async_sessionmaker(bind=engine)() as db:
+                return await dependencies.require_patient_access_async(patient, await db.get(models.User, reader), db)
+        finally:
+            await engine.dispose()
+    return asyncio.run(run())
+
+@pytest.mark.parametrize("check", [_check, _check_async])
+def test_patient_reads_own_vitals(url, check):
+    assert check(url, PATIENT, PATIENT).id == PATIENT
+
+@pytest.mark.parametrize("check", [_check, _check_async])
+def test_linked_caretaker_reads_patient(url, check):
+    assert check(url, CARETAKER, PATIENT).id == CARETAKER
+
+@pytest.mark.parametrize("check", [_check, _check_async])
+@pytest.mark.parametrize("reader, patient", [(STRANGER, PATIENT), (PATIENT, CARETAKER), (CARETAKER, STRANGER), (PATIENT, 999)])
+def test_everyone_else_is_refused(url, check, reader, patient):
+    with pytest.raises(HTTPException) as refused:
+        check(url, reader, patient)
+    assert refused.value.status_code == 403
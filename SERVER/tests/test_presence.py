@@ -0,0 +1,98 @@
+"""
+Presence tracking: batched last_active_at flushes, retries when the
+database is busy, logouts, and wearable readings while signed out.
+
+    cd SERVER && python -m pytest tests/test_presence.py
+"""
+import datetime
+import os
+import sys
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models, presence
+
+START = datetime.datetime(2026, 1, 1)
+
+@pytest.fixture
+def engine(db_engine, monkeypatch):
+    with db_engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), [{"id": i, "fullname": f"U{i}", "phone": f"555010{i}"} for i in (1, 2, 3)])
+    monkeypatch.setattr(presence, "engine", db_engine)
+    return db_engine
+
+def _stored(engine, *user_ids) -> list:
+    with engine.connect() as conn:
+        stored = dict(conn.execute(select(models.User.id, models.User.last_active_at)).all())
+    return [stored[user_id] for user_id in user_ids]
+
+def _tracker() -> presence.PresenceTracker:
+    return presence.PresenceTracker(flush_interval=60)
+
+def test_flush_writes_the_latest_activity_per_user_in_one_batch(engine):
+    tracker = _tracker()
+    tracker.touch(1, START)
+    tracker.touch(1, START + datetime.timedelta(seconds=5))
+    tracker.touch(1, START + datetime.timedelta(seconds=2)) # out of order: ignored
+    tracker.touch(2, START)
+    assert tracker.flush() == 2
+    assert _stored(engine, 1, 2) == [START + datetime.timedelta(seconds=5), START]
+    assert _stored(engine, 3)[0] > START # untouched: still its creation time
+    assert tracker.flush() == 0 # nothing new
+    assert (tracker.flushes, tracker.rows_written, tracker.touches) == (1, 2, 4)
+
+def test_failed_flush_keeps_pending_timestamps(engine, monkeypatch):
+    tracker = _tracker()
+    tracker.touch(1, START)
+    tracker.touch(2, START)
+
+    class Locked:
+        def begin(self):
+            raise OperationalError("UPDATE users ...", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(presence, "engine", Locked())
+    assert tracker.flush() == 0
+    tracker.touch(2, START + datetime.timedelta(seconds=9)) # newer activity while failing wins
+
+    monkeypatch.setattr(presence, "engine", engine)
+    assert tracker.flush() == 2
+    assert _stored(engine, 1, 2) == [START, START + datetime.timedelta(seconds=9)]
+
+def test_stop_flushes_what_is_pending(engine):
+    tracker = _tracker()
+    tracker.start()
+    tracker.touch(3, START)
+    tracker.stop()
+    assert _stored(engine, 3) == [START]
+
+def test_last_seen_takes_the_newer_of_tracked_and_stored():
+    tracker = _tracker()
+    assert tracker.last_seen(1, START) == START
+    tracker.touch(1, START + datetime.timedelta(minutes=1))
+    assert tracker.last_seen(1, START) == START + datetime.timedelta(minutes=1)
+    assert tracker.last_seen(1, START + datetime.timedelta(minutes=5)) == START + datetime.timedelta(minutes=5)
+
+def test_logout_reads_as_offline_and_ignores_older_stored_activity(engine):
+    tracker = _tracker()
+    now = datetime.datetime.utcnow()
+    tracker.touch(1, now)
+    tracker.mark_offline(1)
+    # The stored value from before the logout (another worker's flush) no longer counts
+    assert tracker.last_seen(1, now) < now - datetime.timedelta(minutes=59)
+    tracker.flush()
+    assert _stored(engine, 1)[0] < now - datetime.timedelta(minutes=59)
+
+def test_wearable_readings_only_count_while_signed_in():
+    tracker = _tracker()
+    tracker.touch(1, START, device=True)
+    assert tracker.last_seen(1) is None
+    tracker.touch(1, START) # a request: signed in
+    tracker.touch(1, START + datetime.timedelta(seconds=1), device=True)
+    assert tracker.last_seen(1) == START + datetime.timedelta(seconds=1)
+    tracker.mark_offline(1)
+    tracker.touch(1, datetime.datetime.utcnow(), device=True)
+    assert tracker.last_seen(1) < datetime.datetime.utcnow() - datetime.timedelta(minutes=59)
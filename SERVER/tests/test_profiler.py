@@ -0,0 +1,103 @@
+"""
+Sampling profiler: /admin/profile gating and validation, 1-in-K request
+selection, and route sessions attributing stacks to the route.
+
+    cd SERVER && python -m pytest tests/test_profiler.py
+"""
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dependencies, profiler
+from config import settings
+from routers import admin
+
+ADMIN, OTHER = "5550100", "5550200"
+
+def busy_endpoint():
+    # CPU-bound for long enough to be sampled many times
+    deadline = time.perf_counter() + 0.2
+    while time.perf_counter() < deadline:
+        pass
+    return {"ok": True}
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiler, "profiler", profiler.SamplingProfiler(interval=0.001, output_dir=str(tmp_path)))
+    monkeypatch.setattr(settings, "ADMIN_PHONES", [ADMIN])
+    app = FastAPI()
+    app.add_middleware(profiler.ProfilerMiddleware)
+    app.include_router(admin.router)
+    app.get("/busy/{n}")(busy_endpoint)
+    app.get("/quiet")(lambda: {"ok": True})
+    yield app
+    profiler.profiler.stop()
+
+def _client(app, phone: str) -> TestClient:
+    app.dependency_overrides[dependencies.get_current_user] = lambda: SimpleNamespace(id=1, phone=phone)
+    return TestClient(app)
+
+@pytest.mark.parametrize("method", ["get", "post", "delete"])
+def test_only_admins_reach_the_profiler(app, method):
+    response = getattr(_client(app, OTHER), method)("/admin/profile", **({"json": {}} if method == "post" else {}))
+    assert response.status_code == 403
+    assert profiler.profiler.session is None
+
+@pytest.mark.parametrize("body, status", [
+    ({"seconds": 0}, 400),
+    ({"seconds": settings.PROFILER_MAX_SECONDS + 1}, 400),
+    ({"seconds": 1, "every": 0}, 400),
+    ({"seconds": 1, "route": "GET /nowhere"}, 404),
+    ({"seconds": 1, "route": "/busy/{n}"}, 404), # no method
+])
+def test_invalid_sessions_are_refused(app, body, status):
+    assert _client(app, ADMIN).post("/admin/profile", json=body).status_code == status
+    assert profiler.profiler.session is None
+
+def test_one_session_at_a_time(app):
+    client = _client(app, ADMIN)
+    assert client.post("/admin/profile", json={"seconds": 5}).json()["running"]
+    assert client.post("/admin/profile", json={"seconds": 5}).status_code == 409
+    stopped = client.delete("/admin/profile").json()
+    assert not stopped["running"] and os.path.exists(stopped["last_file"])
+
+def test_one_in_every_matching_request_is_selected():
+    sampler = profiler.SamplingProfiler(interval=1, output_dir="unused")
+    sampler.session = profiler.ProfileSession(60, "GET", "/busy/{n}", every=3)
+    scopes = [{"method": "GET", "path": f"/busy/{i}"} for i in range(6)]
+    selected = [sampler.select(scope) is not None for scope in scopes]
+    assert selected == [True, False, False, True, False, False]
+    assert sampler.select({"method": "POST", "path": "/busy/1"}) is None
+    assert sampler.select({"method": "GET", "path": "/quiet"}) is None
+    assert (sampler.session.matched, sampler.session.selected) == (6, 2)
+
+def test_route_session_roots_only_the_endpoint_at_the_route(app):
+    client = _client(app, ADMIN)
+    client.post("/admin/profile", json={"seconds": 30, "route": "GET /busy/{n}"})
+    for i in range(2):
+        assert client.get(f"/busy/{i}").json() == {"ok": True}
+    client.get("/quiet")
+    status = client.get("/admin/profile").json()
+    assert (status["requests_matched"], status["requests_profiled"]) == (2, 2)
+    written = client.delete("/admin/profile").json()["last_file"]
+
+    with open(written) as f:
+        stacks = [line.rsplit(" ", 1) for line in f.read().splitlines()]
+    route_samples = sum(int(count) for stack, count in stacks if stack.startswith("GET /busy/{n};"))
+    assert route_samples > 10
+    for stack, count in stacks:
+        assert stack.startswith(("GET /busy/{n};", profiler.OTHER_ROOT + ";"))
+        if "busy_endpoint" in stack:
+            assert stack.startswith("GET /busy/{n};")
+
+def test_nothing_is_sampled_without_a_session(app):
+    client = _client(app, ADMIN)
+    client.get("/busy/1")
+    assert client.get("/admin/profile").json() == {"running": False, "last_file": None}
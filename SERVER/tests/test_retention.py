@@ -0,0 +1,76 @@
+"""
+Retention compactor: aged raw readings are deleted only once the 1-minute
+rollups count them (rollups.ensure_covered), in chunks of whole minutes.
+
+    cd SERVER && python -m pytest tests/test_retention.py
+"""
+import datetime
+import os
+import sys
+
+import pytest
+from sqlalchemy import func, select, update
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest, models, retention
+
+START = datetime.datetime(2026, 1, 1)
+
+@pytest.fixture
+def engine(db_engine, monkeypatch):
+    with db_engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), [{"id": 1, "fullname": "Pat", "phone": "5550100"}])
+    monkeypatch.setattr(retention, "engine", db_engine)
+    return db_engine
+
+def _hr(seconds: int) -> dict:
+    return ingest.build_row(1, "heart_rate", str(60 + seconds % 40), "bpm", START + datetime.timedelta(seconds=seconds))
+
+def _recent() -> dict:
+    return ingest.build_row(1, "heart_rate", "70", "bpm", datetime.datetime.utcnow())
+
+def _compactor(chunk_rows: int = 1000) -> retention.RetentionCompactor:
+    return retention.RetentionCompactor(retention_hours=24, interval=3600, chunk_rows=chunk_rows, vacuum_pages=100)
+
+def _raw(engine) -> int:
+    with engine.connect() as conn:
+        return conn.scalar(select(func.count()).select_from(models.HealthMetric.__table__))
+
+def _counted(engine) -> int:
+    """Heart-rate readings counted by the 1-minute rollups."""
+    rollup = models.VitalsRollupMinute.__table__
+    with engine.connect() as conn:
+        return conn.scalar(select(func.coalesce(func.sum(rollup.c.count), 0)).where(rollup.c.metric == "hr_bpm"))
+
+def test_rolled_up_readings_past_retention_are_deleted(engine):
+    with engine.begin() as conn:
+        ingest.write_rows(conn, [_hr(i) for i in range(150)] + [_recent()])
+    report = _compactor(chunk_rows=50).run_once()
+    assert report["rows_deleted"] == 150
+    assert report["chunks"] > 1
+    assert _raw(engine) == 1 # the recent reading stays
+    assert _counted(engine) == 151 # history survives in the rollups
+
+def test_readings_older_than_the_rollups_are_rolled_up_first(engine):
+    # Stored before rollups existed: raw rows with no rollup
+    with engine.begin() as conn:
+        conn.execute(models.HealthMetric.__table__.insert(), [_hr(i) for i in range(90)])
+    assert _counted(engine) == 0
+    assert _compactor().run_once()["rows_deleted"] == 90
+    assert _raw(engine) == 0
+    assert _counted(engine) == 90
+
+def test_partly_counted_minutes_are_kept(engine):
+    with engine.begin() as conn:
+        ingest.write_rows(conn, [_hr(i) for i in range(120)])
+        # One minute's rollup lost a reading: which one cannot be told, so nothing is deleted
+        rollup = models.VitalsRollupMinute.__table__
+        conn.execute(update(rollup).where(rollup.c.bucket_start == START).values(count=rollup.c.count - 1))
+    assert _compactor().run_once()["rows_deleted"] == 0
+    assert _raw(engine) == 120
+
+def test_off_without_a_retention_window():
+    compactor = retention.RetentionCompactor(retention_hours=0, interval=3600, chunk_rows=1000, vacuum_pages=100)
+    compactor.start()
+    assert compactor._thread is None
@@ -0,0 +1,60 @@
+"""
+Rollup resolution picking for /vitals/{user_id}/series (the requested width
+is honoured only while the answer stays within SERIES_MAX_POINTS buckets),
+and the duration parser behind window/step/resolution.
+
+    cd SERVER && python -m pytest tests/test_rollups.py
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rollups
+
+HOUR = 3600
+DAY = 86400
+
+def _name(span, requested=None, max_points=1500):
+    picked = rollups.pick_resolution(span, requested, max_points)
+    return picked[0] if picked else None
+
+@pytest.mark.parametrize("span, requested, expected", [
+    (DAY, None, "1m"),          # 1441 minute buckets fit
+    (7 * DAY, None, "1h"),
+    (7 * DAY, 60, "1h"),        # an explicit 1m over a week would be 10081 buckets
+    (7 * DAY, 5, "1h"),         # finer than any rollup
+    (DAY, 60, "1m"),
+    (DAY, HOUR, "1h"),
+    (DAY, 7 * DAY, "1d"),
+    (365 * DAY, None, "1d"),
+])
+def test_pick_resolution(span, requested, expected):
+    assert _name(span, requested) == expected
+
+def test_bucket_count_never_exceeds_max_points():
+    for span in (60, HOUR, DAY, 7 * DAY, 90 * DAY, 1000 * DAY):
+        for requested in (None, 1, 60, HOUR, DAY):
+            picked = rollups.pick_resolution(span, requested, 1500)
+            if picked is not None:
+                assert span // picked[1] + 1 <= 1500
+
+def test_range_too_long_for_daily_buckets():
+    assert _name(1500 * DAY) is None
+    assert _name(1498 * DAY) == "1d"
+
+def test_exact_boundary_counts_the_straddled_bucket():
+    # 500 minutes can touch 501 minute buckets
+    assert _name(500 * 60, 60, max_points=500) == "1h"
+    assert _name(499 * 60, 60, max_points=500) == "1m"
+
+@pytest.mark.parametrize("text, seconds", [("90", 90), ("30s", 30), ("5m", 300), ("24h", DAY), ("365d", 365 * DAY), ("1.5h", 1.5 * HOUR)])
+def test_parse_duration(text, seconds):
+    assert rollups.parse_duration(text) == seconds
+
+@pytest.mark.parametrize("text", ["", "0", "-5m", "5y", "abc", "366d", "1000000d", "99999999d", "9" * 400])
+def test_parse_duration_rejects(text):
+    with pytest.raises(ValueError):
+        rollups.parse_duration(text)
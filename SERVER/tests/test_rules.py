@@ -0,0 +1,132 @@
+"""
+Server-side vitals rules: count and duration thresholds, firing once per
+breach, and escalating the patient's status.
+
+    cd SERVER && python -m pytest tests/test_rules.py
+"""
+import datetime
+import os
+import sys
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest, models, rules
+from config import settings
+from routers import emergency
+
+START = datetime.datetime(2026, 1, 1)
+
+HR_HIGH = {"name": "hr_high", "metric": "heart_rate", "when": [("hr_bpm", ">", 120)], "count": 3, "of": 5, "status": "emergency"}
+SYSTOLIC_LOW = {"name": "systolic_low", "metric": "blood_pressure", "when": [("systolic", "<", 90)], "for_seconds": 30, "status": "alert"}
+
+def _hr(*values, user_id: int = 1, start: int = 0) -> list:
+    return [ingest.build_row(user_id, "heart_rate", str(v), "bpm", START + datetime.timedelta(seconds=start + i)) for i, v in enumerate(values)]
+
+def _bp(second: int, value: str, user_id: int = 1) -> dict:
+    return ingest.build_row(user_id, "blood_pressure", value, "mmHg", START + datetime.timedelta(seconds=second))
+
+def _names(fired: list) -> list:
+    return [rule.name for rule in fired]
+
+def test_default_rules_load():
+    engine = rules.RuleEngine(settings.VITALS_RULES)
+    assert len(engine.rules) == len(settings.VITALS_RULES)
+
+def test_rule_window_is_validated():
+    with pytest.raises(ValueError):
+        rules.Rule(**{**HR_HIGH, "count": 6, "of": 5})
+    with pytest.raises(ValueError):
+        rules.Rule(**{**HR_HIGH, "count": 3, "of": 65})
+
+def test_count_rule_fires_on_threshold_hit():
+    engine = rules.RuleEngine([HR_HIGH])
+    assert engine.evaluate(1, _hr(130, 80, 130)) == []
+    assert _names(engine.evaluate(1, _hr(125, start=3))) == ["hr_high"]
+    assert (engine.readings_evaluated, engine.rules_fired) == (4, 1)
+
+def test_threshold_is_strict():
+    engine = rules.RuleEngine([HR_HIGH])
+    assert engine.evaluate(1, _hr(120, 120, 120, 120, 120)) == []
+
+def test_count_rule_window_slides():
+    engine = rules.RuleEngine([HR_HIGH])
+    # Two hits age out of the 5-reading window before the third arrives
+    assert engine.evaluate(1, _hr(130, 130, 80, 80, 80, 130)) == []
+    assert _names(engine.evaluate(1, _hr(130, 130, start=6))) == ["hr_high"]
+
+def test_rule_fires_once_per_breach_episode():
+    engine = rules.RuleEngine([HR_HIGH])
+    assert _names(engine.evaluate(1, _hr(130, 130, 130, 130, 130))) == ["hr_high"]
+    assert engine.evaluate(1, _hr(130, 130, start=5)) == []
+    # Back under the count, then over it again: a new episode
+    assert engine.evaluate(1, _hr(80, 80, 80, start=7)) == []
+    assert _names(engine.evaluate(1, _hr(130, 130, 130, start=10))) == ["hr_high"]
+
+def test_other_metrics_and_missing_fields_do_not_match():
+    engine = rules.RuleEngine([HR_HIGH, SYSTOLIC_LOW])
+    assert engine.evaluate(1, [ingest.build_row(1, "steps", "130", "count", START + datetime.timedelta(seconds=i)) for i in range(5)]) == []
+    assert engine.readings_evaluated == 0
+
+def test_state_is_per_user():
+    engine = rules.RuleEngine([HR_HIGH])
+    engine.evaluate(1, _hr(130, 130, user_id=1))
+    assert engine.evaluate(2, _hr(130, user_id=2, start=2)) == []
+    assert _names(engine.evaluate(1, _hr(130, user_id=1, start=2))) == ["hr_high"]
+
+def test_duration_rule_fires_after_sustained_breach():
+    engine = rules.RuleEngine([SYSTOLIC_LOW])
+    assert engine.evaluate(1, [_bp(0, "85/70"), _bp(15, "84/70"), _bp(29, "80/60")]) == []
+    assert _names(engine.evaluate(1, [_bp(30, "82/65")])) == ["systolic_low"]
+    assert engine.evaluate(1, [_bp(45, "82/65")]) == []
+
+def test_duration_rule_restarts_after_normal_reading():
+    engine = rules.RuleEngine([SYSTOLIC_LOW])
+    engine.evaluate(1, [_bp(0, "85/70"), _bp(20, "110/70"), _bp(25, "85/70")])
+    assert engine.evaluate(1, [_bp(50, "85/70")]) == []
+    assert _names(engine.evaluate(1, [_bp(55, "85/70")])) == ["systolic_low"]
+
+@pytest.fixture
+def escalation(db_engine, monkeypatch):
+    with db_engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), [{"id": 1, "fullname": "Pat", "phone": "5550100"}])
+    Session = sessionmaker(bind=db_engine)
+    monkeypatch.setattr(rules, "SessionLocal", Session)
+    messages = []
+    monkeypatch.setattr(emergency.manager, "broadcast_threadsafe", messages.append)
+    return Session, messages
+
+def _status(Session) -> tuple:
+    with Session() as db:
+        status = db.query(models.PatientStatus).filter(models.PatientStatus.user_id == 1).first()
+        alerts = db.query(models.EmergencyAlert).filter(models.EmergencyAlert.user_id == 1, models.EmergencyAlert.is_active == True).count()
+    return (status.status if status else None, alerts)
+
+def test_fired_rule_escalates_status_and_opens_alert(escalation):
+    Session, messages = escalation
+    engine = rules.RuleEngine([HR_HIGH, SYSTOLIC_LOW])
+    engine.on_batch(1, _hr(130, 130))
+    assert _status(Session) == (None, 0)
+
+    engine.on_batch(1, _hr(130, start=2))
+    assert _status(Session) == ("emergency", 1)
+    assert [m["type"] for m in messages] == ["STATUS_UPDATE", "EMERGENCY_TRIGGER"]
+    assert messages[0]["data"]["reason"] == "hr_high"
+
+def test_escalation_never_lowers_status(escalation):
+    Session, messages = escalation
+    engine = rules.RuleEngine([HR_HIGH, SYSTOLIC_LOW])
+    engine.on_batch(1, _hr(130, 130, 130))
+    messages.clear()
+    engine.on_batch(1, [_bp(0, "85/70"), _bp(30, "85/70")]) # 'alert' is below 'emergency'
+    assert _status(Session) == ("emergency", 1)
+    assert messages == []
+
+def test_alert_rule_escalates_without_emergency(escalation):
+    Session, messages = escalation
+    engine = rules.RuleEngine([SYSTOLIC_LOW])
+    engine.on_batch(1, [_bp(0, "85/70"), _bp(30, "85/70")])
+    assert _status(Session) == ("alert", 0)
+    assert [m["type"] for m in messages] == ["STATUS_UPDATE"]
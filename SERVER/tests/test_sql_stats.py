@@ -0,0 +1,57 @@
+"""
+SQL instrumentation: per-request counts, headers and the query budget.
+
+    cd SERVER && python -m pytest tests/test_sql_stats.py
+"""
+import os
+import sys
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sql_stats
+from config import settings
+
+@pytest.fixture
+def client(db_engine, monkeypatch):
+    monkeypatch.setattr(settings, "SQL_ROUTE_BUDGETS", {"GET /queries/{count}": 3})
+    monkeypatch.setattr(settings, "SQL_REPEAT_LIMIT", 100)
+    sql_stats.instrument(db_engine)
+    app = FastAPI()
+    app.middleware("http")(sql_stats.middleware)
+
+    @app.get("/queries/{count}")
+    def run_queries(count: int):
+        with db_engine.connect() as conn:
+            for i in range(count):
+                conn.execute(text("SELECT :i"), {"i": i})
+        return {"ran": count}
+
+    return TestClient(app)
+
+def test_queries_are_counted_in_headers(client):
+    response = client.get("/queries/3")
+    assert response.status_code == 200
+    assert response.headers["X-DB-Queries"] == "3"
+    assert response.headers["Server-Timing"].startswith("db;dur=")
+
+def test_route_over_budget_raises_in_strict_mode(client, monkeypatch):
+    monkeypatch.setattr(settings, "SQL_STRICT", True)
+    with pytest.raises(sql_stats.QueryBudgetExceeded, match=r"GET /queries/\{count\}: 4 queries \(budget 3\)"):
+        client.get("/queries/4")
+
+def test_route_over_budget_only_logs_otherwise(client, monkeypatch, capsys):
+    monkeypatch.setattr(settings, "SQL_STRICT", False)
+    assert client.get("/queries/4").status_code == 200
+    assert "4 queries (budget 3)" in capsys.readouterr().out
+
+def test_repeated_statement_is_reported_with_its_caller(client, monkeypatch):
+    monkeypatch.setattr(settings, "SQL_STRICT", True)
+    monkeypatch.setattr(settings, "SQL_REPEAT_LIMIT", 2)
+    monkeypatch.setattr(settings, "SQL_ROUTE_BUDGETS", {})
+    with pytest.raises(sql_stats.QueryBudgetExceeded, match=r"3x at tests/test_sql_stats\.py:\d+: SELECT \?"):
+        client.get("/queries/3")
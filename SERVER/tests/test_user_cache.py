@@ -0,0 +1,122 @@
+"""
+Authenticated-user cache: hits without a query, LRU and TTL bounds,
+invalidation versions, and the session id re-check of stale entries.
+
+    cd SERVER && python -m pytest tests/test_user_cache.py
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import event, update
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dependencies, models
+
+PHONE = "5550100"
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(dependencies, "time", clock)
+    return clock
+
+@pytest.fixture
+def cache(monkeypatch, clock):
+    cache = dependencies.UserCache(max_users=2, ttl_seconds=300, sid_check_seconds=30)
+    monkeypatch.setattr(dependencies, "user_cache", cache)
+    return cache
+
+@pytest.fixture
+def db(db_engine, cache):
+    with db_engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), [{"id": 1, "fullname": "Pat", "phone": PHONE, "session_id": "s1"}])
+    statements = []
+    event.listen(db_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    with sessionmaker(bind=db_engine)() as session:
+        yield SimpleNamespace(session=session, engine=db_engine, statements=statements)
+
+def _token(sid: str = "s1") -> str:
+    return dependencies.create_access_token({"sub": PHONE, "sid": sid})
+
+def _user(phone: str) -> models.User:
+    return models.User(id=1, fullname="Pat", phone=phone, session_id=None)
+
+def test_second_request_is_served_without_a_query(db, cache):
+    assert dependencies.get_user_from_token(_token(), db.session).id == 1
+    db.session.expunge_all()
+    db.statements.clear()
+    user = dependencies.get_user_from_token(_token(), db.session)
+    assert (user.id, user.fullname) == (1, "Pat")
+    assert db.statements == []
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_entries_expire_after_the_ttl(cache, clock):
+    cache.put(PHONE, "s1", _user(PHONE), cache.version())
+    clock.now += 301
+    assert cache.get(PHONE, "s1") == (None, False)
+
+def test_least_recently_used_entry_is_evicted(cache):
+    for phone in ("1", "2"):
+        cache.put(phone, None, _user(phone), cache.version())
+    cache.get("1", None)
+    cache.put("3", None, _user("3"), cache.version())
+    assert cache.get("2", None)[0] is None
+    assert cache.get("1", None)[0] is not None
+    assert cache.stats()["size"] == 2
+
+def test_snapshot_read_before_an_invalidation_is_not_cached(cache):
+    version = cache.version() # taken before reading the row
+    cache.invalidate(PHONE)   # e.g. a profile update commits meanwhile
+    cache.put(PHONE, "s1", _user(PHONE), version)
+    assert cache.get(PHONE, "s1")[0] is None
+    cache.put(PHONE, "s1", _user(PHONE), cache.version())
+    assert cache.get(PHONE, "s1")[0] is not None
+
+def test_invalidations_pushed_out_of_the_history_still_refuse_old_snapshots(cache):
+    version = cache.version()
+    for phone in ("1", "2", "3"): # more than max_users: "1" is forgotten
+        cache.invalidate(phone)
+    cache.put("1", None, _user("1"), version)
+    assert cache.get("1", None)[0] is None
+
+def test_stale_entry_rechecks_the_session_id(db, cache, clock):
+    dependencies.get_user_from_token(_token(), db.session)
+    clock.now += 31
+    db.session.expunge_all()
+    db.statements.clear()
+    assert dependencies.get_user_from_token(_token(), db.session).id == 1
+    assert len(db.statements) == 1 and "session_id" in db.statements[0]
+    assert cache.sid_checks == 1
+
+    # Checked: served without a query until sid_check_seconds pass again
+    db.session.expunge_all()
+    db.statements.clear()
+    dependencies.get_user_from_token(_token(), db.session)
+    assert db.statements == []
+
+def test_login_elsewhere_ends_a_cached_session_at_the_recheck(db, cache, clock):
+    dependencies.get_user_from_token(_token(), db.session)
+    # Another worker logs the user in again: its invalidation never reaches this cache
+    with db.engine.begin() as conn:
+        conn.execute(update(models.User.__table__).values(session_id="s2"))
+    db.session.expunge_all()
+    assert dependencies.get_user_from_token(_token(), db.session).id == 1 # still fresh
+
+    clock.now += 31
+    db.session.expunge_all()
+    with pytest.raises(HTTPException) as expired:
+        dependencies.get_user_from_token(_token(), db.session)
+    assert expired.value.status_code == 401
+    assert cache.get(PHONE, "s1")[0] is None
@@ -0,0 +1,88 @@
+"""
+Latest-vitals ring buffer: LRU eviction, how far back each ring can answer
+(covered_since), and the frames resampler.
+
+    cd SERVER && python -m pytest tests/test_vitals_cache.py
+"""
+import datetime
+import os
+import sys
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest, vitals_cache
+
+NOW = datetime.datetime.utcnow().replace(microsecond=0)
+
+def _at(seconds_ago: float) -> datetime.datetime:
+    return NOW - datetime.timedelta(seconds=seconds_ago)
+
+def _hr(seconds_ago: float, value) -> dict:
+    return ingest.build_row(1, "heart_rate", str(value), "bpm", _at(seconds_ago))
+
+def _cache(**overrides) -> vitals_cache.VitalsCache:
+    options = dict(max_patients=10, capacity=100, window_seconds=3600)
+    options.update(overrides)
+    return vitals_cache.VitalsCache(**options)
+
+@pytest.fixture
+def db(db_engine):
+    with sessionmaker(bind=db_engine)() as session:
+        yield session
+
+def test_idle_patients_are_evicted_lru(db):
+    cache = _cache(max_patients=2)
+    cache.on_batch(1, [_hr(10, 70)])
+    cache.on_batch(2, [_hr(10, 70)])
+    cache.latest(db, 1) # patient 1 is now the most recently used
+    cache.on_batch(3, [_hr(10, 70)])
+    assert list(cache._patients) == [1, 3]
+    assert cache.evictions == 1
+
+def test_latest_is_served_from_the_ring_once_backfilled(db):
+    cache = _cache()
+    cache.on_batch(1, [_hr(20, 70), ingest.build_row(1, "steps", "150", "count", _at(15)), _hr(10, 75)])
+    assert cache.latest(db, 1)["heart_rate"]["hr_bpm"] == 75
+    assert cache.latest(db, 1)["steps"]["steps"] == 150
+    assert (cache.misses, cache.hits) == (1, 1)
+
+def test_full_ring_only_answers_for_what_it_still_holds(db):
+    cache = _cache(capacity=3)
+    cache.latest(db, 1) # backfilled from an empty table: covers the whole window
+    assert cache.frames(db, 1, _at(600), 60, 10) is not None
+
+    cache.on_batch(1, [_hr(50, 70), _hr(49, 71), _hr(48, 72), _hr(47, 73)])
+    ring = cache._patients[1]
+    assert ring.size == 3
+    assert ring.covered_since == vitals_cache._epoch(_at(50)) # the overwritten reading
+    assert cache.frames(db, 1, _at(50), 1, 10) is None
+    assert cache.frames(db, 1, _at(49), 1, 10)["heart_rate"][:3] == [71.0, 72.0, 73.0]
+
+def test_frames_average_per_slot_and_take_the_max_steps(db):
+    cache = _cache()
+    cache.latest(db, 1)
+    cache.on_batch(1, [
+        _hr(55, 70), _hr(52, 81),
+        ingest.build_row(1, "blood_pressure", "120/80", "mmHg", _at(45)),
+        ingest.build_row(1, "steps", "150", "count", _at(35)),
+        ingest.build_row(1, "steps", "100", "count", _at(31)),
+        _hr(1, 90), # after the last slot
+    ])
+    frames = cache.frames(db, 1, _at(60), 10, 5)
+    assert frames == {
+        "heart_rate": [75.5, None, None, None, None],
+        "systolic": [None, 120.0, None, None, None],
+        "diastolic": [None, 80.0, None, None, None],
+        "steps": [None, None, 150, None, None],
+    }
+
+def test_backfill_loads_the_window_from_the_database(db_engine, db):
+    with db_engine.begin() as conn:
+        ingest.write_rows(conn, [_hr(30, 70), _hr(20, 72), ingest.build_row(1, "steps", "900", "count", _at(7200))])
+    cache = _cache()
+    assert cache.frames(db, 1, _at(40), 10, 4)["heart_rate"] == [None, 70.0, 72.0, None]
+    # Older than the window, but still the newest steps reading for the tile
+    assert cache.latest(db, 1)["steps"]["steps"] == 900
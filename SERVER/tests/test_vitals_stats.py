@@ -0,0 +1,79 @@
+"""
+Windowed vitals statistics: percentiles, RMSSD, blood pressure and step
+totals, and the window query behind /vitals/{user_id}/stats.
+
+    cd SERVER && python -m pytest tests/test_vitals_stats.py
+"""
+import datetime
+import os
+import sys
+
+import numpy as np
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest, vitals_stats
+
+START = datetime.datetime(2026, 1, 1)
+NAN = float("nan")
+
+def test_summarize_percentiles():
+    stats = vitals_stats.summarize(np.arange(1, 101, dtype=float))
+    assert stats == {"count": 100, "mean": 50.5, "median": 50.5, "p5": 5.95, "p95": 95.05, "std": 28.87, "min": 1.0, "max": 100.0}
+
+def test_rmssd_of_successive_beat_intervals():
+    # 60, 75, 60 bpm: beat intervals of 1000, 800 and 1000 ms
+    stats = vitals_stats.heart_rate_stats(np.array([0.0, 1.0, 2.0]), np.array([60.0, 75.0, 60.0]))
+    assert stats["rmssd_ms"] == 200.0
+    assert stats["count"] == 3
+
+def test_rmssd_skips_gaps_and_missing_readings():
+    ts = np.array([0.0, 1.0, 2.0, 60.0, 61.0])
+    bpm = np.array([60.0, 75.0, NAN, 50.0, 0.0])
+    stats = vitals_stats.heart_rate_stats(ts, bpm)
+    # Only 60 -> 75 is a pair within HRV_MAX_GAP_SECONDS once NaN and 0 are dropped
+    assert stats["rmssd_ms"] == 200.0
+    assert stats["count"] == 3
+
+def test_single_reading_has_no_rmssd():
+    assert vitals_stats.heart_rate_stats(np.array([0.0]), np.array([70.0]))["rmssd_ms"] is None
+    assert vitals_stats.heart_rate_stats(np.array([0.0]), np.array([NAN])) is None
+
+def test_blood_pressure_needs_both_values():
+    stats = vitals_stats.blood_pressure_stats(np.array([120.0, 140.0, 130.0]), np.array([80.0, 90.0, NAN]))
+    assert stats["systolic"]["count"] == 2
+    assert stats["pulse_pressure"]["mean"] == 45.0
+
+def test_step_counter_resets_are_not_negative_steps():
+    # A running counter that resets to 0 at 120 s
+    stats = vitals_stats.step_stats(np.array([0.0, 60.0, 120.0, 180.0]), np.array([100.0, 160.0, 0.0, 30.0]))
+    assert stats == {"count": 4, "total": 90, "per_minute": 30.0}
+
+@pytest.fixture
+def db(db_engine):
+    rows = [
+        ingest.build_row(1, "heart_rate", str(bpm), "bpm", START + datetime.timedelta(seconds=i))
+        for i, bpm in enumerate([60, 75, 60])
+    ] + [
+        ingest.build_row(1, "blood_pressure", "120/80", "mmHg", START),
+        ingest.build_row(1, "steps", "100", "count", START),
+        ingest.build_row(1, "steps", "160", "count", START + datetime.timedelta(minutes=1)),
+        ingest.build_row(1, "heart_rate", "90", "bpm", START + datetime.timedelta(hours=2)), # outside the window
+        ingest.build_row(2, "heart_rate", "90", "bpm", START), # someone else
+    ]
+    with db_engine.begin() as conn:
+        ingest.write_rows(conn, rows)
+    with sessionmaker(bind=db_engine)() as session:
+        yield session
+
+def test_compute_over_a_window(db):
+    stats = vitals_stats.compute(db, 1, START, START + datetime.timedelta(hours=1))
+    assert stats["heart_rate"]["count"] == 3
+    assert stats["heart_rate"]["rmssd_ms"] == 200.0
+    assert stats["blood_pressure"]["systolic"]["mean"] == 120.0
+    assert stats["steps"] == {"count": 2, "total": 60, "per_minute": 60.0}
+
+def test_compute_empty_window(db):
+    assert vitals_stats.compute(db, 1, START - datetime.timedelta(days=1), START) == {"heart_rate": None, "blood_pressure": None, "steps": None}
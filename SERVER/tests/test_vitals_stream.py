@@ -0,0 +1,102 @@
+"""
+/vitals/ws: who may subscribe to which patients, and which batches reach
+each subscriber.
+
+    cd SERVER && python -m pytest tests/test_vitals_stream.py
+"""
+import asyncio
+import datetime
+import os
+import sys
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from starlette.websockets import WebSocketDisconnect
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dependencies, ingest, models
+from database import make_engine
+from routers import vitals
+
+CARETAKER, PATIENT, OTHER = 1, 2, 3
+START = datetime.datetime(2026, 1, 1)
+
+@pytest.fixture
+def client(db_engine, monkeypatch):
+    with db_engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), [
+            {"id": CARETAKER, "fullname": "Care", "phone": "5550100", "role": "caretaker"},
+            {"id": PATIENT, "fullname": "Pat", "phone": "5550200", "role": "patient"},
+            {"id": OTHER, "fullname": "Other", "phone": "5550300", "role": "patient"},
+        ])
+        conn.execute(models.CaretakerPatient.__table__.insert(), [{"caretaker_phone": "5550100", "patient_id": PATIENT}])
+    async_engine = make_engine(db_engine.url.render_as_string(hide_password=False), "concurrent", is_async=True)
+    monkeypatch.setattr(vitals, "AsyncSessionLocal", async_sessionmaker(bind=async_engine, expire_on_commit=False))
+    monkeypatch.setattr(vitals, "stream", vitals.VitalsStreamManager())
+    monkeypatch.setattr(dependencies, "user_cache", dependencies.UserCache(max_users=10, ttl_seconds=60, sid_check_seconds=60))
+    app = FastAPI()
+    app.include_router(vitals.router)
+    with TestClient(app) as client:
+        yield client
+    asyncio.run(async_engine.dispose())
+
+def _connect(client, phone: str = "5550100"):
+    return client.websocket_connect(f"/vitals/ws?token={dependencies.create_access_token({'sub': phone})}")
+
+def _hr(user_id: int, value: int, second: int = 0) -> list:
+    return [ingest.build_row(user_id, "heart_rate", str(value), "bpm", START + datetime.timedelta(seconds=second))]
+
+def test_caretaker_subscribes_to_own_id_and_linked_patient(client):
+    with _connect(client) as ws:
+        ws.send_json({"action": "subscribe", "patient_ids": [CARETAKER, PATIENT]})
+        assert ws.receive_json() == {"type": "SUBSCRIBED", "patient_ids": [CARETAKER, PATIENT], "interval": 0.0}
+
+def test_unlinked_patient_is_refused(client):
+    with _connect(client) as ws:
+        ws.send_json({"action": "subscribe", "patient_ids": [PATIENT, OTHER]})
+        assert ws.receive_json() == {"type": "ERROR", "detail": "Not a patient of yours", "patient_ids": [OTHER]}
+        # Nothing from the refused message was subscribed
+        ws.send_json({"action": "subscribe", "patient_ids": []})
+        assert ws.receive_json()["patient_ids"] == []
+
+@pytest.mark.parametrize("message", [
+    {"action": "subscribe", "patient_ids": ["two"]},
+    {"action": "subscribe", "patient_ids": [PATIENT], "interval": "nan"},
+    ["not", "an", "object"],
+])
+def test_malformed_messages_are_rejected(client, message):
+    with _connect(client) as ws:
+        ws.send_json(message)
+        assert ws.receive_json() == {"type": "ERROR", "detail": "Invalid subscription message"}
+
+def test_invalid_token_is_closed(client):
+    with pytest.raises(WebSocketDisconnect) as closed:
+        with client.websocket_connect("/vitals/ws?token=garbage") as ws:
+            ws.receive_json()
+    assert closed.value.code == 1008
+
+def test_only_subscribed_patients_are_pushed(client):
+    with _connect(client) as ws:
+        ws.send_json({"action": "subscribe", "patient_ids": [PATIENT]})
+        ws.receive_json()
+        vitals.stream.publish(OTHER, _hr(OTHER, 70))
+        vitals.stream.publish(PATIENT, _hr(PATIENT, 72))
+        frame = ws.receive_json()
+        assert frame["user_id"] == PATIENT
+        assert frame["readings"] == [{"metric_type": "heart_rate", "timestamp": START.isoformat(), "hr_bpm": 72.0}]
+
+        ws.send_json({"action": "unsubscribe", "patient_ids": [PATIENT]})
+        assert ws.receive_json()["patient_ids"] == []
+        assert PATIENT not in vitals.stream.by_patient
+
+def test_interval_sends_the_latest_reading_per_metric(client):
+    with _connect(client) as ws:
+        ws.send_json({"action": "subscribe", "patient_ids": [PATIENT], "interval": 0.05})
+        ws.receive_json()
+        vitals.stream.publish(PATIENT, _hr(PATIENT, 70))
+        vitals.stream.publish(PATIENT, _hr(PATIENT, 75, second=1))
+        frame = ws.receive_json()
+        assert [reading["hr_bpm"] for reading in frame["readings"]] == [75.0]
@@ -0,0 +1,247 @@
+"""
+In-memory cache of each patient's most recent vitals.
+
+Every accepted batch is appended (as an ingest listener) to a fixed-size,
+array-backed ring per patient, so the dashboard's current-value tiles and
+short chart windows are answered without touching the database. Patients
+are loaded from the database the first time they are read (and warmed at
+startup for everyone active recently); idle patients are evicted LRU once
+VITALS_CACHE_MAX_PATIENTS is reached.
+"""
+import datetime
+import math
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from sqlalchemy import select
+
+import models, ingest, rollups
+from config import settings
+from database import SessionLocal
+
+health_metrics = models.HealthMetric.__table__
+
+METRIC_TYPES = list(models.MetricType)
+METRIC_CODES = {metric_type: code for code, metric_type in enumerate(METRIC_TYPES)}
+VALUE_FIELDS = rollups.FIELDS
+NAN = float("nan")
+
+def _epoch(ts: datetime.datetime) -> float:
+    return (ts - rollups.EPOCH).total_seconds()
+
+class PatientVitals:
+    """Fixed-capacity ring of readings, one preallocated array per column (NaN = no value)."""
+    __slots__ = ("capacity", "head", "size", "ts", "metric", "columns", "latest", "covered_since", "backfilled")
+
+    def __init__(self, capacity: int, covered_since: float):
+        self.capacity = capacity
+        self.head = 0
+        self.size = 0
+        self.ts = array("d", bytes(8 * capacity))
+        self.metric = array("b", bytes(capacity))
+        self.columns = {field: array("d", bytes(8 * capacity)) for field in VALUE_FIELDS}
+        self.latest = {} # metric code -> newest row dict, for the current-value tiles
+        # Readings at or after this epoch second are all in the ring
+        self.covered_since = covered_since
+        self.backfilled = False
+
+    def append(self, row: dict, ts: float):
+        code = METRIC_CODES[row["metric_type"]]
+        slot = self.head
+        if self.size == self.capacity:
+            # Overwriting the oldest slot shrinks the window we can answer for
+            self.covered_since = max(self.covered_since, self.ts[slot])
+        else:
+            self.size += 1
+        self.ts[slot] = ts
+        self.metric[slot] = code
+        for field, column in self.columns.items():
+            value = row[field]
+            column[slot] = NAN if value is None else value
+        self.head = (slot + 1) % self.capacity
+
+        newest = self.latest.get(code)
+        if newest is None or row["timestamp"] >= newest["timestamp"]:
+            self.latest[code] = row
+
+    def slots(self):
+        """Ring positions from oldest to newest."""
+        start = (self.head - self.size) % self.capacity
+        return ((start + i) % self.capacity for i in range(self.size))
+
+    @staticmethod
+    def nbytes(capacity: int) -> int:
+        # 8-byte timestamp, 1-byte metric code and one 8-byte double per value column
+        return (8 + 1 + 8 * len(VALUE_FIELDS)) * capacity
+
+class VitalsCache:
+    def __init__(self, max_patients: int, capacity: int, window_seconds: float):
+        self.max_patients = max_patients
+        self.capacity = capacity
+        self.window_seconds = window_seconds
+        self._patients = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _get_or_create(self, user_id: int) -> PatientVitals:
+        # Caller holds the lock
+        ring = self._patients.get(user_id)
+        if ring is None:
+            # Live batches are complete from now on; older readings come from the backfill
+            ring = self._patients[user_id] = PatientVitals(self.capacity, time.time())
+            while len(self._patients) > self.max_patients:
+                self._patients.popitem(last=False)
+                self.evictions += 1
+        self._patients.move_to_end(user_id)
+        return ring
+
+    def on_batch(self, user_id: int, rows: list):
+        """Ingest listener: append the accepted batch to the patient's ring."""
+        with self._lock:
+            ring = self._get_or_create(user_id)
+            for row in rows:
+                ring.append(row, _epoch(row["timestamp"]))
+
+    def _load(self, db, user_id: int, since: datetime.datetime) -> tuple:
+        columns = [health_metrics.c[name] for name in ("metric_type", "unit", "timestamp") + VALUE_FIELDS]
+        recent = db.execute(
+            select(*columns)
+            .where(health_metrics.c.user_id == user_id, health_metrics.c.timestamp >= since)
+            .order_by(health_metrics.c.timestamp.desc())
+            .limit(self.capacity)
+        ).mappings().all()
+        # Tiles show the last known value even when it is older than the window
+        latest = []
+        seen = {row["metric_type"] for row in recent}
+        for metric_type in METRIC_TYPES:
+            if metric_type in seen:
+                continue
+            row = db.execute(
+                select(*columns)
+                .where(health_metrics.c.user_id == user_id, health_metrics.c.metric_type == metric_type)
+                .order_by(health_metrics.c.timestamp.desc())
+                .limit(1)
+            ).mappings().first()
+            if row is not None:
+                latest.append(row)
+        return [dict(row, user_id=user_id) for row in reversed(recent)], [dict(row, user_id=user_id) for row in latest]
+
+    def _ring(self, db, user_id: int) -> PatientVitals:
+        with self._lock:
+            ring = self._patients.get(user_id)
+            if ring is not None and ring.backfilled:
+                self._patients.move_to_end(user_id)
+                self.hits += 1
+                return ring
+            self.misses += 1
+
+        since = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.window_seconds)
+        recent, older = self._load(db, user_id, since)
+
+        with self._lock:
+            ring = self._get_or_create(user_id)
+            if not ring.backfilled:
+                if len(recent) < self.capacity:
+                    ring.covered_since = min(ring.covered_since, _epoch(since))
+                elif recent:
+                    ring.covered_since = max(ring.covered_since, _epoch(recent[0]["timestamp"]))
+                # Batches that arrived while we were querying are already in the ring
+                present = {(ring.metric[i], ring.ts[i]) for i in ring.slots()}
+                for row in recent:
+                    ts = _epoch(row["timestamp"])
+                    if (METRIC_CODES[row["metric_type"]], ts) not in present:
+                        ring.append(row, ts)
+                for row in older:
+                    code = METRIC_CODES[row["metric_type"]]
+                    if code not in ring.latest:
+                        ring.latest[code] = row
+                ring.backfilled = True
+            return ring
+
+    def latest(self, db, user_id: int) -> dict:
+        """Newest reading per metric type, {metric_type: row dict}."""
+        ring = self._ring(db, user_id)
+        with self._lock:
+            return {METRIC_TYPES[code].value: row for code, row in ring.latest.items()}
+
+    def frames(self, db, user_id: int, start: datetime.datetime, step_seconds: float, slots: int):
+        """
+        Same resampling as /vitals/{user_id}/frames (mean per slot, max for
+        steps), or None when the ring does not reach back to start.
+        """
+        ring = self._ring(db, user_id)
+        start_epoch = _epoch(start)
+        end_epoch = start_epoch + slots * step_seconds
+        sums = {field: [0.0] * slots for field in ("hr_bpm", "systolic", "diastolic")}
+        counts = {field: [0] * slots for field in sums}
+        steps = [None] * slots
+        with self._lock:
+            if start_epoch <= ring.covered_since:
+                return None
+            ts_column = ring.ts
+            for i in ring.slots():
+                ts = ts_column[i]
+                if ts < start_epoch or ts >= end_epoch:
+                    continue
+                index = int((ts - start_epoch) / step_seconds)
+                for field in sums:
+                    value = ring.columns[field][i]
+                    if not math.isnan(value):
+                        sums[field][index] += value
+                        counts[field][index] += 1
+                value = ring.columns["steps"][i]
+                if not math.isnan(value) and (steps[index] is None or value > steps[index]):
+                    steps[index] = int(value)
+
+        frames = {
+            name: [round(total / count, 1) if count else None for total, count in zip(sums[field], counts[field])]
+            for name, field in (("heart_rate", "hr_bpm"), ("systolic", "systolic"), ("diastolic", "diastolic"))
+        }
+        frames["steps"] = steps
+        return frames
+
+    def warm(self, limit: int = None) -> int:
+        """Load everyone with readings inside the cache window (run at startup)."""
+        since = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.window_seconds)
+        db = SessionLocal()
+        try:
+            user_ids = db.execute(
+                select(health_metrics.c.user_id).where(health_metrics.c.timestamp >= since).distinct()
+                .limit(limit or self.max_patients)
+            ).scalars().all()
+            for user_id in user_ids:
+                self._ring(db, user_id)
+        finally:
+            db.close()
+        print(f"🔥 Vitals cache warmed for {len(user_ids)} patients")
+        return len(user_ids)
+
+    def stats(self) -> dict:
+        with self._lock:
+            patients = len(self._patients)
+            readings = sum(ring.size for ring in self._patients.values())
+        bytes_per_patient = PatientVitals.nbytes(self.capacity)
+        return {
+            "patients": patients,
+            "max_patients": self.max_patients,
+            "capacity_per_patient": self.capacity,
+            "window_seconds": self.window_seconds,
+            "readings": readings,
+            "bytes_per_patient": bytes_per_patient,
+            "bytes_total": bytes_per_patient * patients,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+cache = VitalsCache(
+    max_patients=settings.VITALS_CACHE_MAX_PATIENTS,
+    capacity=settings.VITALS_CACHE_CAPACITY,
+    window_seconds=settings.VITALS_CACHE_WINDOW_SECONDS,
+)
+ingest.add_listener(cache.on_batch)
@@ -15,9 +15,11 @@ interface Patient {
 
 interface HealthMetric {
     metric_type: string;
-    value: string;
-    unit: string;
     timestamp: string;
+    hr_bpm?: number | null;
+    systolic?: number | null;
+    diastolic?: number | null;
+    steps?: number | null;
 }
 
 // Helper to check online status (within 15 seconds)
@@ -82,11 +84,21 @@ export default function CaretakerDashboard() {
         setMedicationData([]);
 
         let isActive = true;
+        // Incremental fetch: after the first poll only readings stored after the cursor are downloaded
+        let vitalsCursor: string | null = null;
+        const tiles: Record<string, HealthMetric> = {};
 
         const fetchVitalsAndMeds = async () => {
             try {
-                // Fetch Vitals
-                const vitalsRes = await api.get(`/vitals/${selectedPatientId}?limit=100`);
+                // The 2-minute chart is served from the server's in-memory vitals cache; the first poll
+                // seeds the current-value tiles from it and a cursor, later ones only fetch new readings
+                const [framesRes, newRes, latestRes] = await Promise.all([
+                    api.get(`/vitals/${selectedPatientId}/frames`, { params: { window: '2m', step: '1s' } }),
+                    api.get(`/vitals/${selectedPatientId}`, {
+                        params: vitalsCursor ? { limit: 500, since: vitalsCursor } : { limit: 1 }
+                    }),
+                    vitalsCursor ? null : api.get(`/vitals/${selectedPatientId}/latest`),
+                ]);
 
                 // Fetch Medication Logs (Last 7 Days)
                 const end = new Date();
@@ -100,48 +112,38 @@ export default function CaretakerDashboard() {
                 if (!isActive) return;
 
                 // --- Process Vitals ---
-                const metrics: HealthMetric[] = vitalsRes.data;
-                const grouped: Record<string, any> = {};
-
-                metrics.forEach(m => {
-                    const utcString = m.timestamp.endsWith('Z') ? m.timestamp : m.timestamp + 'Z';
-                    const localDate = new Date(utcString);
-                    const timeKey = localDate.toLocaleTimeString();
-
-                    if (!grouped[timeKey]) {
-                        grouped[timeKey] = { timestamp: timeKey };
-                    }
-
-                    if (m.metric_type === 'heart_rate') {
-                        grouped[timeKey].heart_rate = parseFloat(m.value);
-                        grouped[timeKey].raw_ts = localDate.getTime();
-                    } else if (m.metric_type === 'blood_pressure') {
-                        const [sys, dia] = m.value.split('/');
-                        grouped[timeKey].systolic = parseInt(sys);
-                        grouped[timeKey].diastolic = parseInt(dia);
-                    } else if (m.metric_type === 'steps') {
-                        grouped[timeKey].steps = parseInt(m.value);
-                    }
-                });
-
-                const sortedData = Object.values(grouped).sort((a: any, b: any) => a.raw_ts - b.raw_ts);
-                // Filter for last 2 minutes for the CHART
-                const cutoffTime = Date.now() - 120000;
-                const recentData = sortedData.filter((d: any) => d.raw_ts > cutoffTime);
-                setVitalsData(recentData);
-
-                // Use the LATEST available data for the "Current Value" display (even if older than 30s)
-                if (sortedData.length > 0) {
-                    const latest = sortedData[sortedData.length - 1];
-                    setCurrentVitals({
-                        heart_rate: latest.heart_rate || 0,
-                        sys: latest.systolic || 0,
-                        dia: latest.diastolic || 0,
-                        steps: latest.steps || 0
+                const frames = framesRes.data;
+                const chartPoints: any[] = [];
+                frames.t.forEach((t: number, i: number) => {
+                    if (frames.heart_rate[i] == null && frames.systolic[i] == null && frames.steps[i] == null) return;
+                    const localDate = new Date(t * 1000);
+                    chartPoints.push({
+                        timestamp: localDate.toLocaleTimeString(),
+                        raw_ts: localDate.getTime(),
+                        heart_rate: frames.heart_rate[i] ?? undefined,
+                        systolic: frames.systolic[i] ?? undefined,
+                        diastolic: frames.diastolic[i] ?? undefined,
+                        steps: frames.steps[i] ?? undefined,
                     });
-                } else {
-                    setCurrentVitals({ heart_rate: 0, sys: 0, dia: 0, steps: 0 });
-                }
+                });
+                setVitalsData(chartPoints);
+
+                // Use the LATEST available data for the "Current Value" display (even if older than the chart window)
+                const readings: HealthMetric[] = latestRes
+                    ? [...Object.values(latestRes.data.readings as Record<string, HealthMetric>), ...newRes.data]
+                    : newRes.data;
+                readings.forEach(m => {
+                    // Late uploads can arrive after newer readings: keep the newest per type
+                    const current = tiles[m.metric_type];
+                    if (!current || Date.parse(current.timestamp) <= Date.parse(m.timestamp)) tiles[m.metric_type] = m;
+                });
+                vitalsCursor = newRes.headers['x-vitals-cursor'] ?? vitalsCursor;
+                setCurrentVitals({
+                    heart_rate: tiles.heart_rate?.hr_bpm || 0,
+                    sys: tiles.blood_pressure?.systolic || 0,
+                    dia: tiles.blood_pressure?.diastolic || 0,
+                    steps: tiles.steps?.steps || 0
+                });
 
                 // --- Process Medications ---
                 // Group by date: { "2024-01-01": { taken: 5, total: 8 } }
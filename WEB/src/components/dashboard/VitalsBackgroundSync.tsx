@@ -1,11 +1,38 @@
-import React, { useEffect, useRef } from 'react';
+import { useEffect, useRef } from 'react';
+import api from '@/lib/api';
 import { useUser } from '@/context/UserContext';
 import { useApp } from '@/context/AppContext';
+import { toast } from '@/hooks/use-toast';
+
+// Hands the wearable to the server's device gateway. Returns null when the gateway
+// is pulling from it, otherwise why not (so this tab has to keep syncing).
+async function registerWithGateway(): Promise<string | null> {
+    // The URL is fetched by the server, not this browser, so it has to be one
+    // the server can reach (and that its GATEWAY_ALLOWED_HOSTS permits).
+    const healthApiUrl = import.meta.env.VITE_HEALTH_API_URL;
+    if (!healthApiUrl) return 'No wearable URL is configured for the server';
+    try {
+        // Registering the same URL again just updates the existing device
+        await api.post('/devices/', {
+            name: 'Health API',
+            url: healthApiUrl,
+            kind: 'health_api',
+            poll_interval_seconds: 1,
+        });
+        const { data } = await api.get('/devices/gateway/stats');
+        return data.running ? null : "The server's device gateway is turned off";
+    } catch (err: any) {
+        const detail = err?.response?.data?.detail;
+        return typeof detail === 'string' ? detail : 'The server could not register the wearable';
+    }
+}
 
 export default function VitalsBackgroundSync() {
     const { saveVitals, isAuthenticated, profile } = useUser();
     const { triggerEmergency } = useApp();
-    const bufferRef = useRef<any[]>([]);
+    // Latest callbacks, so re-renders do not re-register the wearable or restart the loop
+    const callbacks = useRef({ saveVitals, triggerEmergency });
+    callbacks.current = { saveVitals, triggerEmergency };
 
     useEffect(() => {
         // Only run for authenticated patients
@@ -34,45 +61,41 @@ export default function VitalsBackgroundSync() {
                         bloodPressure: `${systolic}/${diastolic}`,
                         reason: isHeartRateEmergency ? 'Heart rate out of range' : 'Blood pressure critical'
                     });
-                    triggerEmergency();
+                    callbacks.current.triggerEmergency();
                 }
 
-                const payload = [
-                    {
-                        metric_type: 'heart_rate',
-                        value: heartRate.toString(),
-                        unit: 'bpm',
-                        timestamp: new Date().toISOString()
-                    },
-                    {
-                        metric_type: 'blood_pressure',
-                        value: `${systolic}/${diastolic}`,
-                        unit: 'mmHg',
-                        timestamp: new Date().toISOString()
-                    },
-                    {
-                        metric_type: 'steps',
-                        value: data.step_count.steps.toString(),
-                        unit: 'count',
-                        timestamp: new Date().toISOString()
-                    }
-                ];
-
-                // Sync immediately without buffering
-                await saveVitals(payload);
-                console.log("Background: Synced vitals to server");
-
+                const timestamp = new Date().toISOString();
+                await callbacks.current.saveVitals([
+                    { metric_type: 'heart_rate', value: heartRate.toString(), unit: 'bpm', timestamp },
+                    { metric_type: 'blood_pressure', value: `${systolic}/${diastolic}`, unit: 'mmHg', timestamp },
+                    { metric_type: 'steps', value: data.step_count.steps.toString(), unit: 'count', timestamp },
+                ]);
             } catch (err) {
                 // Silent failure in background
-                // console.warn("Background vitals fetch failed", err);
             }
         };
 
-        const interval = setInterval(fetchData, 1000);
-        return () => clearInterval(interval);
-    }, [isAuthenticated, profile.role, saveVitals, triggerEmergency]);
-
-    /* Removed Buffered Sync Loop */
+        // The server's gateway keeps working when the tab is closed. Until it has
+        // taken the wearable over, this tab fetches and uploads every second as before.
+        let cancelled = false;
+        let interval: ReturnType<typeof setInterval> | undefined;
+        registerWithGateway().then(reason => {
+            if (cancelled || reason === null) return;
+            if (import.meta.env.VITE_HEALTH_API_URL) {
+                // A wearable was meant to be server-side: say so where the patient can see it
+                toast({
+                    variant: 'destructive',
+                    title: 'Vitals are only monitored while this tab is open',
+                    description: `${reason.replace(/\.$/, "")}. Keep this page open so readings and emergency checks continue.`,
+                });
+            }
+            interval = setInterval(fetchData, 1000);
+        });
+        return () => {
+            cancelled = true;
+            clearInterval(interval);
+        };
+    }, [isAuthenticated, profile.role]);
 
     return null; // Invisible component
 }
@@ -1 +1,9 @@
 /// <reference types="vite/client" />
+
+interface ImportMetaEnv {
+  // Wearable API the server's device gateway pulls from, e.g. https://wearables.example.com/all.
+  // The server must allow it (GATEWAY_ALLOWED_HOSTS, plus GATEWAY_ALLOWED_SCHEMES=http and
+  // GATEWAY_ALLOWED_NETWORKS for a LAN address). Unset, or while the gateway refuses it,
+  // the patient's tab polls http://<host>:8001/all itself.
+  readonly VITE_HEALTH_API_URL?: string;
+}